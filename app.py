@@ -10,15 +10,80 @@
 #   formatting: commas, underline expenses, double line under NOI,
 #   separator before FAD, DSCR row below FAD, right-justified numbers,
 #   equal column widths.
-
-from dataclasses import dataclass, field
-from datetime import date
-from typing import Dict, List, Tuple
+# - Waterfall distributions: forecast FAD through the deal's compiled tiers, partner forecast XIRR.
+# - Portfolio roll-up: FAD / NOI / DSCR per deal and year for every deal, paged, with drill-down
+#   into a deal's annual table, and a background bulk export of every deal's table (PDF/DOCX/XLSX ZIP)
+#   on an export worker process started by the first export and kept warm across reruns and sessions.
+# - Scenarios tab: sensitivity grids / Monte Carlo with FAD, DSCR and partner XIRR percentiles.
+# - Goal seek tab: terminal flow or FAD multiple each partner needs to hit a target IRR.
+# - All computation lives in waterfall_core.py (shared with batch.py for headless runs).
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Tuple
+
+# Start of this script run: the heavy imports below are paid on a cold start only
+# (later reruns find them in sys.modules), shown in the diagnostics as "script imports".
+SCRIPT_T0 = time.perf_counter()
 
 import pandas as pd
 import streamlit as st
-from scipy.optimize import brentq
+
+from report_export import EXPORT_FORMATS, UI_EXPORT_WORKERS, ExportJob, ExportWorker, deal_tables
+from waterfall_core import (
+    COMPILED_DIRNAME,
+    ColumnarDataset,
+    DealStateStore,
+    DATASET_MANIFEST,
+    DEFAULT_CACHE_BUDGET_MB,
+    DEFAULT_HORIZON_YEARS,
+    DEFAULT_RESULT_CACHE_ITEMS,
+    DEFAULT_START_YEAR,
+    FEED_NAMES,
+    FORECAST_READ_COLUMNS,
+    FrameCache,
+    GOAL_FAD_SCALE,
+    GOAL_TERMINAL,
+    PRO_YR_BASE_DEFAULT,
+    ROLLUP_DECIMALS,
+    ROLLUP_METRICS,
+    ROLLUP_PAGE_SIZES,
+    ResultMemo,
+    StageTimer,
+    annual_aggregation_table,
+    build_deal_index,
+    compile_dataset,
+    control_join,
+    deal_frames,
+    goal_seek,
+    load_coa,
+    load_dataset_deal,
+    load_forecast,
+    load_inputs_cached,
+    load_investment_map,
+    load_waterfalls,
+    memory_report,
+    monte_carlo_scenarios,
+    path_key,
+    pivot_annual_table,
+    portfolio_annual_aggregation,
+    portfolio_rollup,
+    refresh_deal,
+    replay_deal,
+    rollup_page,
+    run_scenarios,
+    run_waterfalls,
+    scenario_annual_summary,
+    scenario_summary,
+    sensitivity_grid,
+    stream_accounting,
+    style_annual_table,
+)
+
+IMPORT_SECONDS = time.perf_counter() - SCRIPT_T0
 
 
 # ============================================================
@@ -28,386 +93,6 @@ def is_streamlit_cloud() -> bool:
     return Path("/mount/src").exists()
 
 
-# ============================================================
-# CONFIG
-# ============================================================
-DEFAULT_START_YEAR = 2026
-DEFAULT_HORIZON_YEARS = 10
-PRO_YR_BASE_DEFAULT = 2025
-
-# Contra-revenue (vacancy / concessions) - reduces revenue
-CONTRA_REVENUE_ACCTS = {4040, 4043, 4030, 4042}
-
-# Explicit account definitions (NO iNOI)
-# NOTE: Revenue set includes ALL revenue-related accounts; contra is handled separately in normalization.
-REVENUE_ACCTS = {
-    4010, 4012, 4020, 4041, 4045, 4040, 4043, 4030, 4042, 4070,
-    4091, 4092, 4090, 4097, 4093, 4094, 4096, 4095,
-    4063, 4060, 4061, 4062, 4080, 4065
-}
-
-# Gross revenues are revenues excluding contra-revenues
-GROSS_REVENUE_ACCTS = REVENUE_ACCTS - CONTRA_REVENUE_ACCTS
-
-EXPENSE_ACCTS = {
-    5090, 5110, 5114, 5018, 5010, 5016, 5012, 5014,
-    5051, 5053, 5050, 5052, 5054, 5055,
-    5060, 5067, 5063, 5069, 5061, 5064, 5065, 5068, 5070, 5066,
-    5020, 5022, 5021, 5023, 5025, 5026,
-    5045, 5080, 5087, 5085, 5040,
-    5096, 5095, 5091, 5100
-}
-
-INTEREST_ACCTS = {5190, 7030}
-PRINCIPAL_ACCTS = {7060}
-CAPEX_ACCTS = {7050}
-OTHER_EXCLUDED_ACCTS = {4050, 5220, 5210, 5195, 7065, 5120, 5130, 5400}
-
-ALL_EXCLUDED = INTEREST_ACCTS | PRINCIPAL_ACCTS | CAPEX_ACCTS | OTHER_EXCLUDED_ACCTS
-
-
-# ============================================================
-# UTILITIES
-# ============================================================
-def to_date(x) -> date:
-    return pd.to_datetime(x).date()
-
-
-def is_year_end(d: date) -> bool:
-    return d.month == 12 and d.day == 31
-
-
-def year_ends_strictly_between(d0: date, d1: date) -> List[date]:
-    if d1 <= d0:
-        return []
-    out: List[date] = []
-    y = d0.year
-    while True:
-        ye = date(y, 12, 31)
-        if ye >= d1:
-            break
-        if ye > d0:
-            out.append(ye)
-        y += 1
-    return out
-
-
-# ============================================================
-# XIRR
-# ============================================================
-def xnpv(rate: float, cfs: List[Tuple[date, float]]) -> float:
-    if rate <= -0.999999999:
-        return float("inf")
-    cfs = sorted(cfs, key=lambda t: t[0])
-    t0 = cfs[0][0]
-    return sum(a / ((1 + rate) ** ((d - t0).days / 365.0)) for d, a in cfs)
-
-
-def xirr(cfs: List[Tuple[date, float]]) -> float:
-    return brentq(lambda r: xnpv(r, cfs), -0.9999, 10.0)
-
-
-# ============================================================
-# STATE (scaffolding for later waterfall execution)
-# ============================================================
-@dataclass
-class PartnerState:
-    principal: float = 0.0
-    pref_accrued: float = 0.0
-    pref_capitalized: float = 0.0
-    irr_cashflows: List[Tuple[date, float]] = field(default_factory=list)
-
-    def base(self) -> float:
-        return self.principal + self.pref_capitalized
-
-
-@dataclass
-class DealState:
-    vcode: str
-    last_event_date: date
-    partners: Dict[str, PartnerState] = field(default_factory=dict)
-
-
-# ============================================================
-# ACCRUAL / COMPOUNDING (scaffolding)
-# ============================================================
-def compound_year_end(deal: DealState):
-    for ps in deal.partners.values():
-        ps.pref_capitalized += ps.pref_accrued
-        ps.pref_accrued = 0.0
-
-
-def accrue_to(deal: DealState, new_date: date, pref_rates: Dict[str, float]):
-    d0, d1 = deal.last_event_date, new_date
-    if d1 <= d0:
-        return
-
-    splits = year_ends_strictly_between(d0, d1)
-    dates = [d0] + splits + [d1]
-
-    for i in range(len(dates) - 1):
-        s, e = dates[i], dates[i + 1]
-        yf = (e - s).days / 365.0
-
-        for p, ps in deal.partners.items():
-            r = pref_rates.get(p, 0.0)
-            ps.pref_accrued += ps.base() * r * yf
-
-        if is_year_end(e) and e != d1:
-            compound_year_end(deal)
-
-
-# ============================================================
-# ACCOUNTING INGESTION (HISTORICAL scaffolding)
-# ============================================================
-def map_bucket(flag):
-    return "capital" if str(flag).upper() == "Y" else "pref"
-
-
-def apply_txn(ps: PartnerState, d: date, amt: float, bucket: str):
-    # NOTE: accounting-feed sign conventions will be finalized later.
-    ps.irr_cashflows.append((d, amt))
-
-    if bucket == "capital":
-        ps.principal += -amt if amt < 0 else -min(amt, ps.principal)
-    else:
-        if amt > 0:
-            pay = min(amt, ps.pref_accrued)
-            ps.pref_accrued -= pay
-            ps.pref_capitalized -= (amt - pay)
-        else:
-            ps.pref_accrued += -amt
-
-
-# ============================================================
-# LOADERS + SIGN NORMALIZATION
-# ============================================================
-def load_coa(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    coa.csv headers (per your feed):
-      vcode, vdescription, vtype, iNOI, vMisc, vAccountType
-
-    Join rule:
-      coa.vcode == forecast_feed.vAccount == accounting_feed.TypeID
-
-    NOTE: iNOI is ignored in all calculations per your request.
-    """
-    df = df.copy()
-    df.columns = [str(c).strip() for c in df.columns]
-
-    if "vcode" not in df.columns:
-        raise ValueError("coa.csv is missing required column: vcode")
-
-    df = df.rename(columns={"vcode": "vAccount"})
-    df["vAccount"] = pd.to_numeric(df["vAccount"], errors="coerce").astype("Int64")
-
-    if "vAccountType" not in df.columns:
-        df["vAccountType"] = ""
-    df["vAccountType"] = df["vAccountType"].fillna("").astype(str).str.strip()
-
-    return df[["vAccount", "vAccountType"]]
-
-
-def normalize_forecast_signs(fc: pd.DataFrame) -> pd.DataFrame:
-    """
-    Deal-agnostic normalization using explicit account sets:
-
-      - Gross Revenue accounts: +abs(mAmount)
-      - Contra-Revenue (vacancy/concessions): -abs(mAmount)
-      - Expense accounts: -abs(mAmount)
-      - Interest/Principal/Capex/Other excluded: -abs(mAmount)
-      - Other accounts: leave as-is (for future expansion)
-    """
-    out = fc.copy()
-    base = pd.to_numeric(out["mAmount"], errors="coerce").fillna(0.0)
-
-    is_gross_rev = out["vAccount"].isin(GROSS_REVENUE_ACCTS)
-    is_contra_rev = out["vAccount"].isin(CONTRA_REVENUE_ACCTS)
-    is_exp = out["vAccount"].isin(EXPENSE_ACCTS)
-    is_outflow = out["vAccount"].isin(ALL_EXCLUDED)
-
-    amt = base.copy()
-    # Apply sign conventions by category (order matters: contra-rev must end negative)
-    amt = amt.where(~is_gross_rev, base.abs())
-    amt = amt.where(~is_contra_rev, -base.abs())
-    amt = amt.where(~is_exp, -base.abs())
-    amt = amt.where(~is_outflow, -base.abs())
-
-    out["mAmount_norm"] = amt
-    return out
-
-
-def load_forecast(df: pd.DataFrame, coa: pd.DataFrame, pro_yr_base: int) -> pd.DataFrame:
-    """
-    Forecast feed columns (per your feed):
-      Vcode, dtEntry, vSource, vAccount, mAmount, Year, Qtr, Date, Pro_Yr
-    """
-    df = df.copy()
-    df.columns = [str(c).strip() for c in df.columns]
-
-    df = df.rename(columns={"Vcode": "vcode", "Date": "event_date"})
-    df["vcode"] = df["vcode"].astype(str)
-
-    df["event_date"] = pd.to_datetime(df["event_date"]).dt.date
-    df["vAccount"] = pd.to_numeric(df["vAccount"], errors="coerce").astype("Int64")
-    df["mAmount"] = pd.to_numeric(df["mAmount"], errors="coerce").fillna(0.0)
-
-    df["Year"] = (int(pro_yr_base) + pd.to_numeric(df["Pro_Yr"], errors="coerce")).astype("Int64")
-
-    # Join to COA (optional: for labeling / future use)
-    df = df.merge(coa, on="vAccount", how="left")
-    df["vAccountType"] = df["vAccountType"].fillna("").astype(str)
-
-    df = normalize_forecast_signs(df)
-    return df
-
-
-# ============================================================
-# ANNUAL AGGREGATION (Revenues → FAD by year) using explicit sets
-# ============================================================
-def annual_aggregation_table(fc_deal: pd.DataFrame, start_year: int, horizon_years: int) -> pd.DataFrame:
-    years = list(range(int(start_year), int(start_year) + int(horizon_years)))
-    f = fc_deal[fc_deal["Year"].isin(years)].copy()
-
-    def sum_where(mask: pd.Series) -> pd.Series:
-        if f.empty:
-            return pd.Series(dtype=float)
-        return f.loc[mask].groupby("Year")["mAmount_norm"].sum()
-
-    # Revenues include gross + contra (contra already negative after normalization)
-    revenues = sum_where(f["vAccount"].isin(GROSS_REVENUE_ACCTS | CONTRA_REVENUE_ACCTS))
-    expenses = sum_where(f["vAccount"].isin(EXPENSE_ACCTS))
-
-    interest = sum_where(f["vAccount"].isin(INTEREST_ACCTS))
-    principal = sum_where(f["vAccount"].isin(PRINCIPAL_ACCTS))
-    capex = sum_where(f["vAccount"].isin(CAPEX_ACCTS))
-    excluded_other = sum_where(f["vAccount"].isin(OTHER_EXCLUDED_ACCTS))
-
-    out = pd.DataFrame({"Year": years}).set_index("Year")
-
-    out["Revenues"] = revenues
-    out["Expenses"] = expenses
-
-    # Expenses are normalized negative; NOI = Revenues + Expenses
-    out["NOI"] = out["Revenues"].fillna(0.0) + out["Expenses"].fillna(0.0)
-
-    out["Interest"] = interest
-    out["Principal"] = principal
-    out["Total Debt Service"] = out["Interest"].fillna(0.0) + out["Principal"].fillna(0.0)
-
-    out["Excluded Accounts"] = excluded_other
-    out["Capital Expenditures"] = capex
-
-    # Interest/Principal/Excluded/Capex are normalized negative outflows:
-    out["Funds Available for Distribution"] = (
-        out["NOI"].fillna(0.0)
-        + out["Interest"].fillna(0.0)
-        + out["Principal"].fillna(0.0)
-        + out["Excluded Accounts"].fillna(0.0)
-        + out["Capital Expenditures"].fillna(0.0)
-    )
-
-    # DSCR = NOI / |Total Debt Service|
-    tds_abs = out["Total Debt Service"].abs().replace(0, pd.NA)
-    out["Debt Service Coverage Ratio"] = out["NOI"] / tds_abs
-
-    out = out.reset_index().fillna(0.0)
-    return out
-
-
-def pivot_annual_table(df: pd.DataFrame) -> pd.DataFrame:
-    wide = df.set_index("Year").T
-    wide.index.name = "Line Item"
-
-    desired_order = [
-        "Revenues",
-        "Expenses",
-        "NOI",
-        "Interest",
-        "Principal",
-        "Total Debt Service",
-        "Excluded Accounts",
-        "Capital Expenditures",
-        "Funds Available for Distribution",
-        "Debt Service Coverage Ratio",
-    ]
-    existing = [r for r in desired_order if r in wide.index]
-    remainder = [r for r in wide.index if r not in existing]
-    return wide.loc[existing + remainder]
-
-
-def style_annual_table(df: pd.DataFrame) -> pd.io.formats.style.Styler:
-    # Base formatter: dollars with commas
-    def money_fmt(x):
-        if pd.isna(x):
-            return ""
-        return f"{x:,.0f}"
-
-    # DSCR formatter
-    def dscr_fmt(x):
-        if pd.isna(x):
-            return ""
-        return f"{x:,.2f}"
-
-    styler = df.style.format(money_fmt)
-
-    # Override DSCR row formatting
-    if "Debt Service Coverage Ratio" in df.index:
-        styler = styler.format(
-            {col: dscr_fmt for col in df.columns},
-            subset=pd.IndexSlice[["Debt Service Coverage Ratio"], :]
-        )
-
-    # Equal column widths + alignment
-    styler = styler.set_table_styles(
-        [
-            {"selector": "th", "props": [("text-align", "left"), ("width", "220px")]},
-            {"selector": "td", "props": [("text-align", "right"), ("width", "140px")]},
-        ],
-        overwrite=False,
-    )
-
-    # Underline Expenses row
-    if "Expenses" in df.index:
-        styler = styler.set_properties(
-            subset=pd.IndexSlice[["Expenses"], :],
-            **{"text-decoration": "underline"}
-        )
-
-    # Double line under NOI + bold NOI
-    if "NOI" in df.index:
-        styler = styler.set_properties(
-            subset=pd.IndexSlice[["NOI"], :],
-            **{"border-bottom": "3px double black", "font-weight": "bold"}
-        )
-
-    # Line under the last row BEFORE Funds Available
-    if "Funds Available for Distribution" in df.index:
-        fad_idx = df.index.get_loc("Funds Available for Distribution")
-        if fad_idx > 0:
-            prev_row = df.index[fad_idx - 1]
-            styler = styler.set_properties(
-                subset=pd.IndexSlice[[prev_row], :],
-                **{"border-bottom": "2px solid black"}
-            )
-
-    # Bold Funds Available
-    if "Funds Available for Distribution" in df.index:
-        styler = styler.set_properties(
-            subset=pd.IndexSlice[["Funds Available for Distribution"], :],
-            **{"font-weight": "bold"}
-        )
-
-    # Separator above DSCR
-    if "Debt Service Coverage Ratio" in df.index:
-        styler = styler.set_properties(
-            subset=pd.IndexSlice[["Debt Service Coverage Ratio"], :],
-            **{"border-top": "1px solid #999"}
-        )
-
-    return styler
-
-
 # ============================================================
 # STREAMLIT UI
 # ============================================================
@@ -423,14 +108,24 @@ with st.sidebar:
         mode = "Upload CSVs"
         st.info("Running on Streamlit Cloud — local folders are disabled. Please upload CSVs.")
     else:
-        mode = st.radio("Load data from:", ["Local folder", "Upload CSVs"], index=0)
+        mode = st.radio("Load data from:", ["Local folder", "Compiled dataset", "Upload CSVs"], index=0)
 
     folder = None
+    dataset_path = None
+    stream_acct = False
     uploads = {}
 
     if mode == "Local folder":
         folder = st.text_input("Data folder path", placeholder=r"C:\Path\To\Data")
         st.caption("Required: investment_map.csv, waterfalls.csv, coa.csv, accounting_feed.csv, forecast_feed.csv")
+        stream_acct = st.checkbox("Stream accounting_feed per deal (low memory)", value=False)
+        if folder and st.button("Compile to columnar dataset"):
+            with st.spinner("Compiling feeds..."):
+                out = compile_dataset({k: f"{folder}/{k}.csv" for k in FEED_NAMES}, Path(folder) / COMPILED_DIRNAME)
+            st.success(f"Compiled dataset written to {out}. Switch to 'Compiled dataset' to use it.")
+    elif mode == "Compiled dataset":
+        dataset_path = st.text_input("Compiled dataset path", placeholder=rf"C:\Path\To\Data\{COMPILED_DIRNAME}")
+        st.caption("Produced by 'Compile to columnar dataset' in Local folder mode.")
     else:
         uploads["investment_map"] = st.file_uploader("investment_map.csv", type="csv")
         uploads["waterfalls"] = st.file_uploader("waterfalls.csv", type="csv")
@@ -444,139 +139,553 @@ with st.sidebar:
     horizon_years = st.number_input("Horizon (years)", min_value=1, max_value=30, value=DEFAULT_HORIZON_YEARS, step=1)
     pro_yr_base = st.number_input("Pro_Yr base year", min_value=1900, max_value=2100, value=PRO_YR_BASE_DEFAULT, step=1)
 
+    st.divider()
+    st.header("Performance")
+    cache_budget_mb = st.number_input("Ingestion cache budget (MB)", min_value=64, max_value=65536,
+                                      value=DEFAULT_CACHE_BUDGET_MB, step=64)
+    store_path = st.text_input("Deal state store (SQLite file; blank = off)", value="",
+                               help="Checkpoints replayed deal states; later runs replay only newer accounting rows.")
+    diagnostics = st.checkbox("Record stage diagnostics", value=False)
+    trace_memory = st.checkbox("Include memory (tracemalloc, slower)", value=False, disabled=not diagnostics)
+
+
+# ============================================================
+# DIAGNOSTICS (per-stage timings, shown in the sidebar as stages finish)
+# ============================================================
+timer = StageTimer(enabled=diagnostics, trace_memory=trace_memory)
+timer.record("script imports", IMPORT_SECONDS)
+timer.record("script start to sidebar", time.perf_counter() - SCRIPT_T0)
+if diagnostics:
+    st.sidebar.divider()
+    st.sidebar.header("Diagnostics")
+diag_slot = st.sidebar.empty()
+
+
+@contextmanager
+def stage(name: str):
+    with timer.stage(name) as metric:
+        yield metric
+    if timer.enabled:
+        diag_slot.dataframe(timer.to_frame(), hide_index=True)
+
 
 # ============================================================
 # LOAD INPUTS
 # ============================================================
+@st.cache_resource
+def get_frame_cache() -> FrameCache:
+    return FrameCache(DEFAULT_CACHE_BUDGET_MB * 1024 * 1024)
+
+
+@st.cache_resource
+def get_result_cache() -> FrameCache:
+    # Per-deal results (replayed DealState, annual tables), kept apart from the input frames
+    return FrameCache(DEFAULT_CACHE_BUDGET_MB * 1024 * 1024, max_items=DEFAULT_RESULT_CACHE_ITEMS)
+
+
+@st.cache_resource
+def get_state_store(path: str) -> DealStateStore:
+    return DealStateStore(path)
+
+
+@st.cache_resource
+def get_export_worker() -> ExportWorker:
+    # One export process per server with a small pool, started by the first export
+    # (not by opening the view) and kept warm for the exports after it
+    return ExportWorker(min(UI_EXPORT_WORKERS, os.cpu_count() or 1))
+
+
 def load_inputs():
-    if CLOUD and mode == "Local folder":
-        st.error("Local folder mode is disabled on Streamlit Cloud.")
+    if CLOUD and mode != "Upload CSVs":
+        st.error("Local folder modes are disabled on Streamlit Cloud.")
         st.stop()
 
+    cache = get_frame_cache()
+    cache.set_budget(int(cache_budget_mb) * 1024 * 1024)
+
+    if mode == "Compiled dataset":
+        if not dataset_path:
+            st.error("Please enter a compiled dataset path.")
+            st.stop()
+
+        manifest = Path(dataset_path) / DATASET_MANIFEST
+        if not manifest.exists():
+            st.error(f"No compiled dataset found at {dataset_path} (missing {DATASET_MANIFEST}).")
+            st.stop()
+
+        ds = ColumnarDataset(dataset_path)
+        ds_key = ("dataset", path_key(str(manifest)))
+        inv = cache.get_or_load(ds_key + ("investment_map",), lambda: load_investment_map(ds.frame("investment_map")))
+        wf = cache.get_or_load(ds_key + ("waterfalls",), lambda: load_waterfalls(ds.frame("waterfalls")))
+        coa = cache.get_or_load(ds_key + ("coa",), lambda: load_coa(ds.frame("coa")))
+
+        def deal_feeds(deal: str):
+            return cache.get_or_load(
+                ds_key + ("deal", str(deal), int(pro_yr_base)),
+                lambda: load_dataset_deal(ds, deal, inv, wf, coa, int(pro_yr_base)),
+            )
+
+        def portfolio_forecast():
+            # Every mapped deal's forecast partitions, read only when the roll-up needs them
+            return cache.get_or_load(
+                ds_key + ("forecast_feed", int(pro_yr_base)),
+                lambda: load_forecast(
+                    ds.partitions("forecast_feed", sorted(inv["vcode"].dropna().unique()), FORECAST_READ_COLUMNS),
+                    coa, int(pro_yr_base),
+                ),
+            )
+
+        data_keys = {k: ds_key + (k,) for k in FEED_NAMES}
+        loaded = {"investment_map": inv, "waterfalls": wf, "coa": coa}
+        return inv, wf, coa, deal_feeds, portfolio_forecast, loaded, data_keys
+
     if mode == "Local folder":
         if not folder:
             st.error("Please enter a data folder path.")
             st.stop()
 
-        inv = pd.read_csv(f"{folder}/investment_map.csv")
-        wf = pd.read_csv(f"{folder}/waterfalls.csv")
-        coa = load_coa(pd.read_csv(f"{folder}/coa.csv"))
-        acct = pd.read_csv(f"{folder}/accounting_feed.csv")
-        fc = load_forecast(pd.read_csv(f"{folder}/forecast_feed.csv"), coa, int(pro_yr_base))
+        sources = {k: f"{folder}/{k}.csv" for k in FEED_NAMES}
+        keys = {k: path_key(p) for k, p in sources.items()}
     else:
         for k, f in uploads.items():
             if f is None:
                 st.warning(f"Please upload {k}.csv")
                 st.stop()
 
-        inv = pd.read_csv(uploads["investment_map"])
-        wf = pd.read_csv(uploads["waterfalls"])
-        coa = load_coa(pd.read_csv(uploads["coa"]))
-        acct = pd.read_csv(uploads["accounting_feed"])
-        fc = load_forecast(pd.read_csv(uploads["forecast_feed"]), coa, int(pro_yr_base))
+        sources = dict(uploads)
+        keys = {k: cache.upload_key(f) for k, f in sources.items()}
+
+    inv, wf, coa, acct, fc = load_inputs_cached(cache, sources, keys, int(pro_yr_base), accounting=not stream_acct,
+                                                timer=timer)
+    index = cache.get_or_load(
+        ("deal_index", stream_acct) + tuple(keys[k] for k in FEED_NAMES) + (int(pro_yr_base),),
+        lambda: build_deal_index(inv, wf, acct, fc),
+    )
 
-    inv["vcode"] = inv["vcode"].astype(str)
-    if "InvestmentID" in inv.columns:
-        inv["InvestmentID"] = inv["InvestmentID"].astype(str)
+    loaded = {"investment_map": inv, "waterfalls": wf, "coa": coa, "forecast_feed": fc}
+    if not stream_acct:
+        loaded["accounting_feed"] = acct
+        return inv, wf, coa, lambda deal: deal_frames(index, wf, acct, fc, deal), lambda: fc, loaded, keys
+
+    def deal_feeds_streamed(deal: str):
+        # Accounting is read per deal from the file, keeping only that deal's rows
+        wf_d, _, fc_d = deal_frames(index, wf, acct, fc, deal)
+        acct_d = cache.get_or_load(
+            ("accounting_stream", keys["accounting_feed"], keys["investment_map"], str(deal)),
+            lambda: control_join(inv, stream_accounting(sources["accounting_feed"], inv, [deal]), deal),
+        )
+        return wf_d, acct_d, fc_d
 
-    if "TypeID" in acct.columns:
-        acct["TypeID"] = pd.to_numeric(acct["TypeID"], errors="coerce").astype("Int64")
+    return inv, wf, coa, deal_feeds_streamed, lambda: fc, loaded, keys
 
-    return inv, wf, coa, acct, fc
 
+with stage("load_inputs") as m:
+    inv, wf, coa, deal_feeds, portfolio_forecast, loaded, data_keys = load_inputs()
+    m.rows = sum(len(df) for df in loaded.values())
 
-inv, wf, coa, acct, fc = load_inputs()
+memo = ResultMemo(get_result_cache(), data_keys)
+
+_cache = get_frame_cache()
+st.sidebar.caption(
+    f"Cache: {len(_cache)} frames, {_cache.nbytes / 1024 ** 2:,.0f} MB "
+    f"(hits {_cache.hits}, misses {_cache.misses}); "
+    f"results: {len(memo.cache)} (hits {memo.cache.hits}, misses {memo.cache.misses})"
+)
+if diagnostics:
+    with st.sidebar.expander("Memory footprint (loaded frames)"):
+        st.dataframe(memory_report(loaded), hide_index=True)
+
+view = st.radio("View", ["Deal report", "Portfolio roll-up"], horizontal=True, label_visibility="collapsed")
+
+
+# ============================================================
+# PORTFOLIO ROLL-UP (every deal, one metric at a time, paged)
+# ============================================================
+# The roll-up tables are built once per report window and memoized; a rerun
+# (page, sort, filter, metric) only slices the cached table, and only the
+# current page is sent to the browser. Number formats are applied by the grid.
+def annual_table(deal: str):
+    # Shared with the deal report's annual table (same memo key)
+    return memo.get(
+        "annual_table",
+        (str(deal), int(pro_yr_base), int(start_year), int(horizon_years)),
+        lambda: pivot_annual_table(annual_aggregation_table(deal_feeds(deal)[2], int(start_year), int(horizon_years))),
+    )
+
+
+if view == "Portfolio roll-up":
+    st.subheader("Portfolio Roll-up (per deal and year)")
+
+    with stage("portfolio_rollup") as m:
+        rollup = memo.get(
+            "portfolio_rollup",
+            (int(pro_yr_base), int(start_year), int(horizon_years)),
+            lambda: portfolio_rollup(portfolio_annual_aggregation(
+                portfolio_forecast(), int(start_year), int(horizon_years),
+                sorted(inv["vcode"].dropna().unique().tolist()),
+            )),
+        )
+        m.rows = sum(t.size for t in rollup.tables.values())
+        m.cached = memo.last_hit
+
+    st.markdown("**Portfolio totals**")
+    st.dataframe(style_annual_table(pivot_annual_table(rollup.totals)), use_container_width=True)
+
+    metric_col, search_col, sort_col, size_col = st.columns([2, 2, 2, 1])
+    with metric_col:
+        metric = st.radio("Metric", list(ROLLUP_METRICS), horizontal=True,
+                          format_func=lambda k: f"{k} ({ROLLUP_METRICS[k]})" if k != ROLLUP_METRICS[k] else k)
+    table = rollup.tables[metric]
+    with search_col:
+        search = st.text_input("Filter deals", "", placeholder="vcode contains...")
+    with sort_col:
+        sort_by = st.selectbox("Sort by", ["Deal"] + [f"{y} (high to low)" for y in table.columns])
+    with size_col:
+        page_size = st.selectbox("Rows per page", ROLLUP_PAGE_SIZES, index=1)
+
+    sort_year = None if sort_by == "Deal" else sort_by.split()[0]
+    _, n_rows, n_pages = rollup_page(table, 1, page_size, search, sort_year)
+    page_no = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1, step=1)
+
+    with stage("render_rollup_page") as m:
+        page, n_rows, n_pages = rollup_page(table, page_no, page_size, search, sort_year)
+        fmt = "%.2f" if ROLLUP_DECIMALS[metric] else "localized"
+        event = st.dataframe(
+            page,
+            use_container_width=True,
+            column_config={y: st.column_config.NumberColumn(y, format=fmt) for y in page.columns},
+            on_select="rerun",
+            selection_mode="single-row",
+            # A new page / ordering starts without a selection
+            key=f"rollup_{metric}_{page_no}_{page_size}_{search}_{sort_by}",
+        )
+        m.rows = page.size
+
+    first = (int(page_no) - 1) * int(page_size)
+    st.caption(f"Deals {first + 1 if n_rows else 0:,}-{first + len(page):,} of {n_rows:,}. "
+               "Select a row to drill into that deal's annual table.")
+
+    rows = event.selection.rows if event is not None else []
+    if rows:
+        drill = str(page.index[rows[0]])
+        st.markdown(f"**{drill}: Annual Operating Forecast**")
+        with stage("drill_down") as m:
+            drill_df = annual_table(drill)
+            st.dataframe(style_annual_table(drill_df), use_container_width=True)
+            m.rows = drill_df.size
+            m.cached = memo.last_hit
+
+    # ============================================================
+    # BULK EXPORT (every deal's annual table, rendered in a background process pool)
+    # ============================================================
+    @st.fragment(run_every=1.0)
+    def export_progress(job: ExportJob):
+        # Polls the running job; one full rerun once it finishes swaps in the download
+        if job.running:
+            st.progress(job.done / max(job.total, 1), text=f"Rendering {job.done:,} of {job.total:,} deals...")
+        else:
+            st.rerun()
+
+    with st.expander("Export investor packages (every deal's annual table)"):
+        export_formats = st.multiselect("Formats", EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+        job = st.session_state.get("export_job")
+        if st.button("Start export", disabled=not export_formats or (job is not None and job.running)):
+            if job is not None:
+                job.discard()
+            st.session_state.pop("export_zip", None)
+            fd, zip_path = tempfile.mkstemp(prefix="investor_packages_", suffix=".zip")
+            os.close(fd)
+            job = ExportJob(list(deal_tables(rollup.annual)), zip_path, export_formats).start(get_export_worker())
+            st.session_state["export_job"] = job
+
+        if job is not None:
+            if job.running:
+                export_progress(job)
+            elif job.error is not None:
+                st.error("Export failed:")
+                st.code(job.error)
+            else:
+                # Read once into the session (the temp file is removed as it is read)
+                if "export_zip" not in st.session_state:
+                    st.session_state["export_zip"] = job.take_result()
+                st.download_button(f"Download ZIP ({job.total:,} deals, {', '.join(job.formats)})",
+                                   st.session_state["export_zip"], file_name="investor_packages.zip",
+                                   mime="application/zip")
+    st.stop()
 
 deal = st.selectbox("Select Deal", sorted(inv["vcode"].dropna().unique().tolist()))
 
-if not st.button("Run Report", type="primary"):
+if st.button("Run Report", type="primary"):
+    st.session_state["report_deal"] = deal
+
+# The report stays up across reruns (e.g. scenario inputs) until another deal is picked
+if st.session_state.get("report_deal") != deal:
     st.stop()
 
+with stage("control_join") as m:
+    wf_d, acct, fc_deal = deal_feeds(deal)
+    m.rows = len(wf_d) + len(acct) + len(fc_deal)
+
 
 # ============================================================
-# CONTROL POPULATION (INNER JOIN ON InvestmentID → vcode)
+# CONTROL POPULATION (INNER JOIN ON InvestmentID → vcode, resolved by the deal index)
 # ============================================================
-if "InvestmentID" in acct.columns and "InvestmentID" in inv.columns:
-    acct["InvestmentID"] = acct["InvestmentID"].astype(str)
-    acct = acct.merge(inv[["InvestmentID", "vcode"]], on="InvestmentID", how="inner")
-    acct = acct[acct["vcode"] == deal].copy()
-else:
-    acct = pd.DataFrame()
-
 if acct.empty:
     st.warning("No accounting data found for the selected deal (after InvestmentID→vcode control join).")
 
 
 # ============================================================
-# INITIALIZE DEAL STATE FROM WATERFALL (scaffolding)
+# INITIALIZE DEAL STATE FROM WATERFALL
 # ============================================================
-wf_d = wf[wf["vcode"].astype(str) == str(deal)].copy()
 if wf_d.empty:
     st.error(f"No waterfall steps found for deal {deal}.")
     st.stop()
 
-wf_d["dteffective"] = pd.to_datetime(wf_d["dteffective"]).dt.date
-start_date = wf_d["dteffective"].min()
+# ============================================================
+# APPLY HISTORICAL ACCOUNTING TO BUILD CURRENT STATE
+# ============================================================
+# Memoized on the deal and the feeds it reads; report-window settings don't invalidate it.
+# With a state store, the replay resumes from the deal's checkpoint.
+store = get_state_store(store_path) if store_path and not CLOUD else None
+with stage("deal_state (init + replay)") as m:
+    if store is None:
+        state, plan, ledger = memo.get("deal_state", (str(deal),), lambda: replay_deal(deal, wf_d, acct))
+    else:
+        state, plan, ledger = memo.get("deal_state", (str(deal), "store", store.path),
+                                       lambda: refresh_deal(store, deal, wf_d, acct))
+    m.rows = len(acct)
+    m.cached = memo.last_hit
 
-state = DealState(str(deal), start_date)
-for p in wf_d["PropCode"].astype(str).unique():
-    state.partners[p] = PartnerState()
+if store is not None:
+    ck = store.status([deal])
+    if not ck.empty:
+        st.caption(f"Deal state store: {ck['last_refresh'].iloc[0]} "
+                   f"(watermark {ck['watermark'].iloc[0]}, {ck['rows'].iloc[0]:,} accounting rows checkpointed)")
 
-pref_rates: Dict[str, float] = {}
-if "vState" in wf_d.columns:
-    pref_rows = wf_d[wf_d["vState"].astype(str).str.strip().str.lower().eq("pref")]
-    for _, r in pref_rows.iterrows():
-        rate = float(r.get("nPercent") or 0.0)
-        if rate > 1.0:
-            rate /= 100.0
-        pref_rates[str(r["PropCode"])] = rate
 
+if fc_deal.empty:
+    st.error(f"No forecast rows found for deal {deal}.")
+    st.stop()
+
+report_tab, scenario_tab, goal_tab = st.tabs(["Annual report", "Scenarios", "Goal seek"])
 
 # ============================================================
-# APPLY HISTORICAL ACCOUNTING TO BUILD CURRENT STATE (placeholder)
+# ANNUAL AGGREGATION DISPLAY (Years across columns)
 # ============================================================
-if not acct.empty and "EffectiveDate" in acct.columns and "InvestorID" in acct.columns:
-    acct["EffectiveDate"] = pd.to_datetime(acct["EffectiveDate"]).dt.date
-    acct["InvestorID"] = acct["InvestorID"].astype(str)
-
-    for _, r in acct.sort_values("EffectiveDate").iterrows():
-        d = r["EffectiveDate"]
-        accrue_to(state, d, pref_rates)
-
-        inv_id = r["InvestorID"]
-        if inv_id in state.partners:
-            apply_txn(
-                state.partners[inv_id],
-                d,
-                float(r.get("Amt", 0.0)),
-                map_bucket(r.get("Capital", "Y")),
-            )
+with report_tab:
+    st.subheader("Annual Operating Forecast (Revenues → Funds Available for Distribution)")
+
+    with stage("annual_aggregation") as m:
+        annual_df = annual_table(deal)
+        m.rows = len(fc_deal)
+        m.cached = memo.last_hit
+
+    with stage("style_annual_table") as m:
+        styled = style_annual_table(annual_df)
+        m.rows = annual_df.size
+
+    with stage("render_table") as m:
+        st.dataframe(styled, use_container_width=True)
+        m.rows = annual_df.size
+
+    st.caption(
+        "Definitions: Revenues include gross revenue accounts (+) and contra-revenue accounts (vacancy/concessions) as (-). "
+        "Expenses are always negative. NOI = Revenues + Expenses. "
+        "Funds Available for Distribution = NOI + Interest + Principal + Excluded + Capex. "
+        "DSCR = NOI / |Total Debt Service|."
+    )
 
-        state.last_event_date = d
+    st.success("Annual aggregation table generated successfully.")
+
+    # ============================================================
+    # WATERFALL DISTRIBUTIONS (compiled tiers over forecast FAD)
+    # ============================================================
+    st.subheader("Waterfall Distributions (forecast FAD by partner)")
+
+    with stage("waterfall") as m:
+        distributions, forecast = memo.get(
+            "waterfall",
+            (str(deal), int(pro_yr_base), int(start_year), int(horizon_years)),
+            lambda: run_waterfalls(
+                [state], [plan],
+                annual_aggregation_table(fc_deal, int(start_year), int(horizon_years)).assign(vcode=str(deal)),
+                int(start_year), int(horizon_years),
+            ),
+        )
+        m.rows = len(distributions)
+        m.cached = memo.last_hit
+
+    st.dataframe(
+        distributions.pivot(index="PropCode", columns="Year", values="total").round(0),
+        use_container_width=True,
+    )
+    st.dataframe(
+        forecast.drop(columns=["vcode"]).set_index("PropCode").style.format(
+            {t: "{:,.0f}" for t in ["pref", "capital", "promote", "exit", "total"]} | {"XIRR": "{:.2%}"},
+            na_rep="",
+        ),
+        use_container_width=True,
+    )
+    st.caption(
+        "Each year's positive FAD pays accrued pref pro rata, then returns principal pro rata; the remainder "
+        "is split by the deal's share/promote steps (capital-weighted when it has none). Distributions never "
+        "exceed FAD: the feeds carry no exit proceeds, so principal and pref still outstanding after the last "
+        "year are not paid. XIRR combines each partner's history with these distributions."
+    )
 
 
 # ============================================================
-# ANNUAL AGGREGATION DISPLAY (Years across columns)
+# SCENARIOS (sensitivity grid / Monte Carlo on the replayed deal state)
 # ============================================================
-st.subheader("Annual Operating Forecast (Revenues → Funds Available for Distribution)")
+def parse_values(text: str, cast=float) -> Tuple:
+    return tuple(cast(v) for v in text.replace(";", ",").split(",") if v.strip())
+
+
+def build_scenarios(spec: Tuple):
+    if spec[0] == "grid":
+        return sensitivity_grid(*spec[1:])
+    return monte_carlo_scenarios(*spec[1:])
+
+
+with scenario_tab:
+    st.subheader("Scenarios (FAD, DSCR and partner XIRR distributions)")
+
+    with st.form("scenario_form"):
+        kind = st.radio("Scenario set", ["Sensitivity grid", "Monte Carlo"], horizontal=True)
+        grid_col, mc_col = st.columns(2)
+        with grid_col:
+            st.markdown("**Sensitivity grid** (comma-separated values; every combination is run)")
+            grid_bps = st.text_input("Pref rate shift (bps)", "-100, 0, 100")
+            grid_rev = st.text_input("Revenue growth shock (%/yr)", "-2, 0, 2")
+            grid_exp = st.text_input("Expense growth shock (%/yr)", "0")
+            grid_exit = st.text_input("Exit shift (years)", "-1, 0, 1")
+        with mc_col:
+            st.markdown("**Monte Carlo** (normal shocks around the base case)")
+            mc_n = st.number_input("Scenarios", min_value=10, max_value=100_000, value=2_000, step=100)
+            mc_bps = st.number_input("Pref rate shift s.d. (bps)", min_value=0.0, max_value=1_000.0, value=50.0)
+            mc_rev = st.number_input("Revenue growth s.d. (%/yr)", min_value=0.0, max_value=50.0, value=1.0)
+            mc_exp = st.number_input("Expense growth s.d. (%/yr)", min_value=0.0, max_value=50.0, value=1.0)
+            mc_exit = st.number_input("Max exit shift (years)", min_value=0, max_value=10, value=1)
+            mc_seed = st.number_input("Seed", min_value=0, max_value=2 ** 31 - 1, value=0)
+        submitted = st.form_submit_button("Run scenarios")
+
+    if submitted:
+        try:
+            if kind == "Sensitivity grid":
+                spec = ("grid", parse_values(grid_bps), tuple(v / 100 for v in parse_values(grid_rev)),
+                        tuple(v / 100 for v in parse_values(grid_exp)), parse_values(grid_exit, int))
+                if not all(spec[1:]):
+                    raise ValueError("every grid input needs at least one value")
+            else:
+                spec = ("mc", int(mc_n), float(mc_bps), float(mc_rev) / 100, float(mc_exp) / 100,
+                        int(mc_exit), int(mc_seed))
+            st.session_state["scenario_spec"] = spec
+        except ValueError as e:
+            st.error(f"Invalid scenario inputs: {e}")
+
+    spec = st.session_state.get("scenario_spec")
+    if spec is None:
+        st.info("Set up a sensitivity grid or Monte Carlo run and press 'Run scenarios'.")
+    else:
+        with stage("scenarios") as m:
+            result = memo.get(
+                "scenarios",
+                (str(deal), int(pro_yr_base), int(start_year), int(horizon_years), spec),
+                lambda: run_scenarios(state, plan, fc_deal, build_scenarios(spec),
+                                      int(start_year), int(horizon_years)),
+            )
+            summary = scenario_summary(result)
+            annual_pct = scenario_annual_summary(result)
+            m.rows = len(result.scenarios)
+            m.cached = memo.last_hit
+
+        st.markdown(f"**{len(result.scenarios):,} scenarios** — percentiles across scenarios")
+        st.dataframe(summary.drop(columns="vcode").set_index("metric"), use_container_width=True)
+
+        fad = annual_pct[annual_pct["metric"] == "Funds Available for Distribution"].set_index("Year")
+        st.markdown("**Funds Available for Distribution by year (P5 / P50 / P95)**")
+        st.line_chart(fad[["P5", "P50", "P95"]])
+
+        st.caption(
+            "Shocks: pref shift is added to each partner's pref rate; growth shocks compound yearly on "
+            "Revenues / Expenses from the start year; exit shift moves the last held year. "
+            "Partner flows: history from the accounting replay, then each year's positive FAD pays accrued "
+            "pref, then principal, then the remainder by the promote split; nothing is paid beyond FAD, so "
+            "balances still outstanding at exit are not repaid."
+        )
 
-fc_deal = fc[fc["vcode"].astype(str) == str(deal)].copy()
-if fc_deal.empty:
-    st.error(f"No forecast rows found for deal {deal}.")
-    st.stop()
 
-annual_df_raw = annual_aggregation_table(fc_deal, int(start_year), int(horizon_years))
-annual_df = pivot_annual_table(annual_df_raw)
-styled = style_annual_table(annual_df)
+# ============================================================
+# GOAL SEEK (terminal flow / FAD multiple for target partner IRRs)
+# ============================================================
+GOAL_MODE_LABELS = {
+    "Terminal cash flow at the last year-end": GOAL_TERMINAL,
+    "Multiple of forecast FAD": GOAL_FAD_SCALE,
+}
 
-st.dataframe(styled, use_container_width=True)
+with goal_tab:
+    st.subheader("Goal Seek (what each partner needs to reach a target IRR)")
+
+    with st.form("goal_seek_form"):
+        goal_label = st.radio("Solve for", list(GOAL_MODE_LABELS), horizontal=True)
+        goal_default = st.number_input("Target IRR for every partner (%)", min_value=-99.0, max_value=1_000.0,
+                                       value=15.0, step=0.5)
+        goal_edits = st.data_editor(
+            pd.DataFrame({"PropCode": [str(c) for c in plan.codes], "Target IRR (%)": float("nan")}),
+            column_config={"PropCode": st.column_config.TextColumn(disabled=True),
+                           "Target IRR (%)": st.column_config.NumberColumn(min_value=-99.0, format="%.2f")},
+            hide_index=True, use_container_width=True, key=f"goal_targets_{deal}",
+        )
+        goal_submitted = st.form_submit_button("Solve")
 
-st.caption(
-    "Definitions: Revenues include gross revenue accounts (+) and contra-revenue accounts (vacancy/concessions) as (-). "
-    "Expenses are always negative. NOI = Revenues + Expenses. "
-    "Funds Available for Distribution = NOI + Interest + Principal + Excluded + Capex. "
-    "DSCR = NOI / |Total Debt Service|."
-)
+    if goal_submitted:
+        per_partner = goal_edits["Target IRR (%)"].fillna(goal_default) / 100
+        st.session_state["goal_spec"] = (str(deal), GOAL_MODE_LABELS[goal_label],
+                                         tuple(zip(goal_edits["PropCode"], per_partner.astype(float))))
 
-st.success("Annual aggregation table generated successfully.")
+    goal_spec = st.session_state.get("goal_spec")
+    if goal_spec is None or goal_spec[0] != str(deal):
+        st.info("Set a target IRR (per partner in the table, or one for all) and press 'Solve'.")
+    else:
+        _, goal_mode, goal_targets = goal_spec
+        with stage("goal_seek") as m:
+            solved = memo.get(
+                "goal_seek",
+                (str(deal), int(pro_yr_base), int(start_year), int(horizon_years), goal_mode, goal_targets),
+                lambda: goal_seek(
+                    [state], [plan],
+                    annual_aggregation_table(fc_deal, int(start_year), int(horizon_years)).assign(vcode=str(deal)),
+                    int(start_year), int(horizon_years),
+                    pd.DataFrame(goal_targets, columns=["PropCode", "target_irr"]).assign(vcode=str(deal)),
+                    goal_mode,
+                ),
+            )
+            m.rows = len(solved)
+            m.cached = memo.last_hit
+
+        value_format = "{:,.0f}" if goal_mode == GOAL_TERMINAL else "{:,.3f}x"
+        st.dataframe(
+            solved.drop(columns=["vcode", "mode"]).set_index("PropCode").style.format(
+                {"target_irr": "{:.2%}", "forecast_XIRR": "{:.2%}", "XIRR_at_value": "{:.2%}",
+                 "value": value_format},
+                na_rep="",
+            ),
+            use_container_width=True,
+        )
+        st.caption(
+            "Terminal: the extra distribution each partner would need at the last year-end of the horizon "
+            "(negative: it could receive that much less). FAD multiple: the factor on every forecast year's "
+            "FAD at which the partner's waterfall distributions meet its target; 'met_at_zero' means its "
+            "history alone meets the target, 'no_positive_fad' that the deal never has FAD to scale, "
+            "'unreachable' that no multiple up to 1,000x meets it. "
+            "All partners are solved together; XIRR_at_value re-solves the partner's XIRR at the solution."
+        )
 
+if timer.enabled:
+    st.sidebar.download_button(
+        "Download diagnostics (JSON lines)",
+        timer.to_jsonl({"vcode": str(deal), "mode": mode, "start_year": int(start_year),
+                        "horizon_years": int(horizon_years)}),
+        file_name=f"diagnostics_{deal}.jsonl",
+        mime="application/x-ndjson",
+    )
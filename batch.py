@@ -0,0 +1,436 @@
+# batch.py
+# Headless portfolio runs for the Waterfall + XIRR Forecast.
+#   python batch.py run <data> [-o OUT] [--workers N] [--start-year Y] [--horizon H] [--pro-yr-base B]
+#                       [--deals V ...] [--low-memory] [--memory-report] [--store DB]
+#   python batch.py scenarios <data> [-o OUT] [--monte-carlo N ... | --grid-pref-bps B ... ] [run options]
+#   python batch.py export <data> [-o OUT] [--formats pdf docx xlsx] [run options]
+#   python batch.py goal-seek <data> [-o OUT] (--target-irr R | --targets CSV) [--mode terminal|fad_scale]
+#                             [run options]
+#   python batch.py compile <csv folder> [<dataset dir>]
+# <data> is a folder with the five CSV feeds or a compiled columnar dataset.
+# Deals are processed in chunks across a process pool; outputs:
+#   OUT/annual_tables.csv   one row per (vcode, Year), same line items as the UI table
+#   OUT/partner_states.csv  final partner balances, last event date and XIRR, plus
+#                           forecast distributions and XIRR through the compiled waterfall
+#   OUT/distributions.csv   waterfall distributions per (vcode, PropCode, Year) by tier
+#   OUT/skipped_deals.csv   deals that could not be run (no waterfall steps)
+# With --store, deal states are checkpointed in a SQLite file and later runs
+# replay only accounting rows past each deal's watermark (full replay when
+# back-dated rows appear).
+# The scenarios command writes OUT/scenarios.csv (the scenario set),
+# OUT/scenario_summary.csv (per deal: FAD, DSCR, partner XIRR percentiles)
+# and OUT/scenario_annual.csv (per deal and Year: FAD and DSCR percentiles).
+# The export command writes OUT/investor_packages.zip: each deal's annual table
+# as <vcode>/<vcode>_annual_forecast.{pdf,docx,xlsx}, rendered across the pool.
+# The goal-seek command writes OUT/goal_seek.csv: per (vcode, PropCode) the
+# terminal flow (or FAD multiple) that meets the partner's target IRR; --targets
+# is a CSV with vcode, PropCode, target_irr (0.15 = 15%).
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from waterfall_core import (
+    COMPILED_DIRNAME,
+    DATASET_MANIFEST,
+    DEFAULT_HORIZON_YEARS,
+    DEFAULT_START_YEAR,
+    FEED_NAMES,
+    GOAL_MODES,
+    GOAL_TERMINAL,
+    PRO_YR_BASE_DEFAULT,
+    ColumnarDataset,
+    DealStateStore,
+    StageTimer,
+    annual_aggregation_table,
+    build_deal_index,
+    compile_dataset,
+    deal_frames,
+    load_coa,
+    load_dataset_deal,
+    load_folder,
+    load_investment_map,
+    load_waterfalls,
+    memory_report,
+    monte_carlo_scenarios,
+    pivot_annual_table,
+    run_deals,
+    run_goal_seek,
+    run_portfolio_scenarios,
+    sensitivity_grid,
+)
+from report_export import EXPORT_FORMATS, export_zip
+
+DEFAULT_CHUNK_SIZE = 25
+
+
+# ============================================================
+# WORKERS (module-level so they pickle into the process pool)
+# ============================================================
+def open_store(path: Optional[str]) -> Optional[DealStateStore]:
+    # Each worker opens its own store handle (SQLite allows concurrent writers with a busy timeout)
+    return DealStateStore(path) if path else None
+
+
+def run_frames_job(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+                   start_year: int, horizon_years: int, store_path: Optional[str] = None):
+    return run_deals(frames, start_year, horizon_years, open_store(store_path))
+
+
+def dataset_frames(root: str, deals: List[str], pro_yr_base: int):
+    # Each worker reads only its own deals' partitions from the memory-mapped dataset
+    ds = ColumnarDataset(root)
+    inv = load_investment_map(ds.frame("investment_map"))
+    wf = load_waterfalls(ds.frame("waterfalls"))
+    coa = load_coa(ds.frame("coa"))
+    return {d: load_dataset_deal(ds, d, inv, wf, coa, pro_yr_base) for d in deals}
+
+
+def run_dataset_job(root: str, deals: List[str], pro_yr_base: int, start_year: int, horizon_years: int,
+                    store_path: Optional[str] = None):
+    return run_deals(dataset_frames(root, deals, pro_yr_base), start_year, horizon_years, open_store(store_path))
+
+
+def scenario_frames_job(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+                        scenarios: pd.DataFrame, start_year: int, horizon_years: int,
+                        store_path: Optional[str] = None):
+    return run_portfolio_scenarios(frames, scenarios, start_year, horizon_years, store=open_store(store_path))
+
+
+def scenario_dataset_job(root: str, deals: List[str], pro_yr_base: int, scenarios: pd.DataFrame,
+                         start_year: int, horizon_years: int, store_path: Optional[str] = None):
+    return run_portfolio_scenarios(dataset_frames(root, deals, pro_yr_base), scenarios, start_year, horizon_years,
+                                   store=open_store(store_path))
+
+
+def goal_seek_frames_job(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]], targets,
+                         start_year: int, horizon_years: int, mode: str, store_path: Optional[str] = None):
+    return run_goal_seek(frames, targets, start_year, horizon_years, mode, store=open_store(store_path))
+
+
+def goal_seek_dataset_job(root: str, deals: List[str], pro_yr_base: int, targets, start_year: int,
+                          horizon_years: int, mode: str, store_path: Optional[str] = None):
+    return run_goal_seek(dataset_frames(root, deals, pro_yr_base), targets, start_year, horizon_years, mode,
+                         store=open_store(store_path))
+
+
+# ============================================================
+# COMMANDS
+# ============================================================
+def chunks(items: List[str], size: int) -> List[List[str]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def select_deals(args):
+    """
+    (deals, frames_of): the deals to run, and for a CSV folder a function
+    returning deal_frames for a group of them (None for a compiled dataset,
+    whose workers read their own partitions).
+    """
+    data = Path(args.data)
+    if (data / DATASET_MANIFEST).exists():
+        inv = load_investment_map(ColumnarDataset(data).frame("investment_map"))
+        frames_of = None
+        loaded = {"investment_map": inv}
+    else:
+        timer = StageTimer()
+        inv, wf, coa, acct, fc = load_folder(data, args.pro_yr_base, stream=args.low_memory, vcodes=args.deals,
+                                             timer=timer)
+        print("Parsed " + ", ".join(f"{m.stage.split()[-1]}.csv {m.seconds:.2f}s" for m in timer.metrics),
+              file=sys.stderr)
+        index = build_deal_index(inv, wf, acct, fc)
+        loaded = {"investment_map": inv, "waterfalls": wf, "coa": coa, "accounting_feed": acct, "forecast_feed": fc}
+
+        def frames_of(group: List[str]):
+            return {d: deal_frames(index, wf, acct, fc, d) for d in group}
+
+    if args.memory_report:
+        print(memory_report(loaded).to_string(index=False, float_format="{:,.2f}".format), file=sys.stderr)
+
+    deals = sorted(inv["vcode"].dropna().unique().tolist())
+    if args.deals:
+        wanted = set(args.deals)
+        deals = [d for d in deals if d in wanted]
+    return deals, frames_of
+
+
+def report_store(args, deals: List[str]):
+    if args.store:
+        modes = DealStateStore(args.store).status(deals)["last_refresh"].value_counts()
+        print("Deal state store: " + ", ".join(f"{n} {mode}" for mode, n in modes.items()), file=sys.stderr)
+
+
+def cmd_run(args) -> int:
+    t0 = time.perf_counter()
+    deals, frames_of = select_deals(args)
+    if not deals:
+        print("No deals to run.", file=sys.stderr)
+        return 1
+
+    print(f"Loaded {len(deals)} deals in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    annual_parts: List[pd.DataFrame] = []
+    partner_parts: List[pd.DataFrame] = []
+    distribution_parts: List[pd.DataFrame] = []
+    skipped: List[str] = []
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = []
+        for group in chunks(deals, args.chunk_size):
+            if frames_of is None:
+                futures.append(pool.submit(run_dataset_job, args.data, group, args.pro_yr_base,
+                                           args.start_year, args.horizon, args.store))
+            else:
+                futures.append(pool.submit(run_frames_job, frames_of(group), args.start_year, args.horizon,
+                                           args.store))
+
+        done = 0
+        for fut in as_completed(futures):
+            annual, partners, distributions, skip = fut.result()
+            annual_parts.append(annual)
+            partner_parts.append(partners)
+            distribution_parts.append(distributions)
+            skipped.extend(skip)
+            done += 1
+            print(f"[{done}/{len(futures)}] chunks done", file=sys.stderr)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    pd.concat(annual_parts, ignore_index=True).sort_values(["vcode", "Year"]).to_csv(
+        out / "annual_tables.csv", index=False)
+    pd.concat(partner_parts, ignore_index=True).sort_values(["vcode", "PropCode"]).to_csv(
+        out / "partner_states.csv", index=False)
+    pd.concat(distribution_parts, ignore_index=True).sort_values(["vcode", "PropCode", "Year"]).to_csv(
+        out / "distributions.csv", index=False)
+    pd.DataFrame({"vcode": sorted(skipped), "reason": "no waterfall steps"}).to_csv(
+        out / "skipped_deals.csv", index=False)
+
+    print(f"Wrote {out} ({len(deals)} deals, {len(skipped)} skipped) in {time.perf_counter() - t0:.1f}s",
+          file=sys.stderr)
+    report_store(args, deals)
+    return 0
+
+
+def build_scenarios(args) -> pd.DataFrame:
+    if args.monte_carlo:
+        return monte_carlo_scenarios(args.monte_carlo, args.pref_bps_sd, args.revenue_growth_sd,
+                                     args.expense_growth_sd, args.exit_shift_max, args.seed)
+    return sensitivity_grid(args.grid_pref_bps, args.grid_revenue_growth, args.grid_expense_growth,
+                            args.grid_exit_shift)
+
+
+def cmd_scenarios(args) -> int:
+    t0 = time.perf_counter()
+    scenarios = build_scenarios(args)
+    deals, frames_of = select_deals(args)
+    if not deals:
+        print("No deals to run.", file=sys.stderr)
+        return 1
+
+    print(f"Loaded {len(deals)} deals, {len(scenarios)} scenarios in {time.perf_counter() - t0:.1f}s",
+          file=sys.stderr)
+
+    summary_parts: List[pd.DataFrame] = []
+    annual_parts: List[pd.DataFrame] = []
+    skipped: List[str] = []
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = []
+        for group in chunks(deals, args.chunk_size):
+            if frames_of is None:
+                futures.append(pool.submit(scenario_dataset_job, args.data, group, args.pro_yr_base, scenarios,
+                                           args.start_year, args.horizon, args.store))
+            else:
+                futures.append(pool.submit(scenario_frames_job, frames_of(group), scenarios,
+                                           args.start_year, args.horizon, args.store))
+
+        done = 0
+        for fut in as_completed(futures):
+            summary, annual, skip = fut.result()
+            summary_parts.append(summary)
+            annual_parts.append(annual)
+            skipped.extend(skip)
+            done += 1
+            print(f"[{done}/{len(futures)}] chunks done", file=sys.stderr)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    scenarios.to_csv(out / "scenarios.csv", index_label="scenario")
+    pd.concat(summary_parts, ignore_index=True).to_csv(out / "scenario_summary.csv", index=False)
+    pd.concat(annual_parts, ignore_index=True).to_csv(out / "scenario_annual.csv", index=False)
+    pd.DataFrame({"vcode": sorted(skipped), "reason": "no waterfall steps"}).to_csv(
+        out / "skipped_deals.csv", index=False)
+
+    print(f"Wrote {out} ({len(deals)} deals x {len(scenarios)} scenarios, {len(skipped)} skipped) "
+          f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    report_store(args, deals)
+    return 0
+
+
+def cmd_export(args) -> int:
+    t0 = time.perf_counter()
+    deals, frames_of = select_deals(args)
+    if not deals:
+        print("No deals to export.", file=sys.stderr)
+        return 1
+
+    # Annual tables are cheap next to rendering: build them here, render in the pool
+    frames = frames_of(deals) if frames_of is not None else dataset_frames(args.data, deals, args.pro_yr_base)
+    tables = [(d, pivot_annual_table(annual_aggregation_table(frames[d][2], args.start_year, args.horizon)))
+              for d in deals]
+    del frames
+    print(f"Built {len(tables)} annual tables in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    step = max(1, len(tables) // 20)
+
+    def progress(done: int, vcode: str):
+        if done % step == 0 or done == len(tables):
+            print(f"[{done}/{len(tables)}] deals rendered", file=sys.stderr)
+
+    n = export_zip(tables, out / "investor_packages.zip", args.formats, args.workers, progress=progress)
+    print(f"Wrote {out / 'investor_packages.zip'} ({n} deals, {', '.join(args.formats)}) "
+          f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return 0
+
+
+def cmd_goal_seek(args) -> int:
+    t0 = time.perf_counter()
+    if args.targets:
+        targets = pd.read_csv(args.targets, dtype={"vcode": str, "PropCode": str})
+        missing = {"vcode", "PropCode", "target_irr"} - set(targets.columns)
+        if missing:
+            print(f"{args.targets} is missing columns: {', '.join(sorted(missing))}", file=sys.stderr)
+            return 1
+    else:
+        targets = args.target_irr
+    deals, frames_of = select_deals(args)
+    if not deals:
+        print("No deals to run.", file=sys.stderr)
+        return 1
+
+    print(f"Loaded {len(deals)} deals in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    result_parts: List[pd.DataFrame] = []
+    skipped: List[str] = []
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = []
+        for group in chunks(deals, args.chunk_size):
+            if frames_of is None:
+                futures.append(pool.submit(goal_seek_dataset_job, args.data, group, args.pro_yr_base, targets,
+                                           args.start_year, args.horizon, args.mode, args.store))
+            else:
+                futures.append(pool.submit(goal_seek_frames_job, frames_of(group), targets,
+                                           args.start_year, args.horizon, args.mode, args.store))
+
+        done = 0
+        for fut in as_completed(futures):
+            results, skip = fut.result()
+            result_parts.append(results)
+            skipped.extend(skip)
+            done += 1
+            print(f"[{done}/{len(futures)}] chunks done", file=sys.stderr)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    results = pd.concat(result_parts, ignore_index=True).sort_values(["vcode", "PropCode"])
+    results.to_csv(out / "goal_seek.csv", index=False)
+    pd.DataFrame({"vcode": sorted(skipped), "reason": "no waterfall steps"}).to_csv(
+        out / "skipped_deals.csv", index=False)
+
+    counts = results["status"].value_counts()
+    print(f"Wrote {out} ({len(results)} partners: " + ", ".join(f"{n} {s}" for s, n in counts.items())
+          + f"; {len(skipped)} deals skipped) in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    report_store(args, deals)
+    return 0
+
+
+def cmd_compile(args) -> int:
+    folder = Path(args.folder)
+    out = Path(args.out) if args.out else folder / COMPILED_DIRNAME
+    t0 = time.perf_counter()
+    compile_dataset({k: str(folder / f"{k}.csv") for k in FEED_NAMES}, out)
+    print(f"Compiled {folder} -> {out} in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Headless Waterfall + XIRR Forecast runs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_run_options(p: argparse.ArgumentParser):
+        p.add_argument("data", help="folder with the five CSV feeds, or a compiled dataset")
+        p.add_argument("-o", "--out", default="batch_output", help="output folder (default: batch_output)")
+        p.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+        p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="deals per worker task")
+        p.add_argument("--start-year", type=int, default=DEFAULT_START_YEAR)
+        p.add_argument("--horizon", type=int, default=DEFAULT_HORIZON_YEARS, help="horizon in years")
+        p.add_argument("--pro-yr-base", type=int, default=PRO_YR_BASE_DEFAULT)
+        p.add_argument("--deals", nargs="+", help="only run these vcodes")
+        p.add_argument("--low-memory", action="store_true",
+                       help="stream accounting_feed in chunks, keeping only the rows of the deals being run")
+        p.add_argument("--store", metavar="DB",
+                       help="SQLite deal state store: resume each deal from its checkpoint and replay only "
+                            "accounting rows past its watermark (created if missing)")
+        p.add_argument("--memory-report", action="store_true",
+                       help="print the in-memory footprint of each loaded frame to stderr")
+
+    run = sub.add_parser("run", help="run every deal and write annual tables + partner states")
+    add_run_options(run)
+    run.set_defaults(func=cmd_run)
+
+    scen = sub.add_parser("scenarios", help="run a sensitivity grid or Monte Carlo set and write percentile summaries")
+    add_run_options(scen)
+    scen.add_argument("--grid-pref-bps", type=float, nargs="+", default=[0.0], help="pref rate shifts (bps)")
+    scen.add_argument("--grid-revenue-growth", type=float, nargs="+", default=[0.0],
+                      help="revenue growth shocks (0.01 = +1%%/yr)")
+    scen.add_argument("--grid-expense-growth", type=float, nargs="+", default=[0.0],
+                      help="expense growth shocks (0.01 = +1%%/yr)")
+    scen.add_argument("--grid-exit-shift", type=int, nargs="+", default=[0], help="exit shifts (years)")
+    scen.add_argument("--monte-carlo", type=int, metavar="N", help="run N random scenarios instead of the grid")
+    scen.add_argument("--pref-bps-sd", type=float, default=0.0, help="Monte Carlo pref shift s.d. (bps)")
+    scen.add_argument("--revenue-growth-sd", type=float, default=0.0, help="Monte Carlo revenue growth s.d.")
+    scen.add_argument("--expense-growth-sd", type=float, default=0.0, help="Monte Carlo expense growth s.d.")
+    scen.add_argument("--exit-shift-max", type=int, default=0, help="Monte Carlo exit shift range (+/- years)")
+    scen.add_argument("--seed", type=int, help="Monte Carlo random seed")
+    scen.set_defaults(func=cmd_scenarios)
+
+    export = sub.add_parser("export", help="render every deal's annual table to PDF/DOCX/XLSX in one ZIP")
+    add_run_options(export)
+    export.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS),
+                        help="document formats (default: all)")
+    export.set_defaults(func=cmd_export)
+
+    goal = sub.add_parser("goal-seek", help="solve the terminal flow or FAD multiple that meets target partner IRRs")
+    add_run_options(goal)
+    target = goal.add_mutually_exclusive_group(required=True)
+    target.add_argument("--target-irr", type=float, metavar="R", help="one target IRR for every partner (0.15 = 15%%)")
+    target.add_argument("--targets", metavar="CSV", help="per-partner targets: CSV with vcode, PropCode, target_irr")
+    goal.add_argument("--mode", choices=GOAL_MODES, default=GOAL_TERMINAL,
+                      help="terminal: extra flow at the last year-end; fad_scale: multiple of forecast FAD "
+                           "(default: terminal)")
+    goal.set_defaults(func=cmd_goal_seek)
+
+    comp = sub.add_parser("compile", help="compile a CSV folder into a columnar dataset")
+    comp.add_argument("folder", help="folder with the five CSV feeds")
+    comp.add_argument("out", nargs="?", help=f"dataset folder (default: <folder>/{COMPILED_DIRNAME})")
+    comp.set_defaults(func=cmd_compile)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
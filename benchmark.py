@@ -0,0 +1,451 @@
+# benchmark.py
+# Scaling benchmark for waterfall_core on a synthetic portfolio.
+#   python benchmark.py [--deals N] [--partners N] [--accounts N] [--years N] [--history-years N]
+#                       [--repeat N] [--out FILE] [--baseline FILE] [--keep-data DIR] [--startup]
+# - Generates investment_map / waterfalls / coa / accounting_feed / forecast_feed
+#   from the account sets defined in waterfall_core (REVENUE_ACCTS, EXPENSE_ACCTS, ...)
+# - Times each pipeline stage (best of --repeat) and measures its peak traced
+#   memory in a separate tracemalloc run, so tracing never inflates timings
+# - Appends one JSON line per stage to --out; --baseline prints the ratio to the
+#   latest earlier run with the same parameters
+# - --startup adds cold imports, the app's first run and warm reruns, and a cold
+#   export process vs the warm export worker, each in fresh interpreters
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from report_export import ExportJob, ExportWorker, deal_tables
+from waterfall_core import (
+    CAPEX_ACCTS,
+    CONTRA_REVENUE_ACCTS,
+    EXPENSE_ACCTS,
+    GROSS_REVENUE_ACCTS,
+    INTEREST_ACCTS,
+    OTHER_EXCLUDED_ACCTS,
+    PRINCIPAL_ACCTS,
+    PRO_YR_BASE_DEFAULT,
+    DealState,
+    accrue_to,
+    annual_aggregation_table,
+    apply_txn,
+    build_deal_index,
+    compile_waterfall,
+    deal_frames,
+    init_deal_state,
+    load_accounting,
+    load_coa,
+    load_forecast,
+    load_investment_map,
+    load_waterfalls,
+    map_bucket,
+    normalize_forecast_signs,
+    partner_irrs,
+    portfolio_annual_aggregation,
+    read_feeds,
+    replay_ledger,
+    run_waterfalls,
+    xirr,
+)
+
+DEFAULT_OUT = "bench_results.jsonl"
+
+
+# ============================================================
+# SYNTHETIC PORTFOLIO
+# ============================================================
+def generate_portfolio(deals: int, partners: int, accounts: int, years: int, history_years: int,
+                       seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    Raw (CSV-shaped) frames for a synthetic portfolio:
+      forecast_feed   -> deals x accounts x 12 months x years rows
+      accounting_feed -> per partner: one contribution, then quarterly pref/capital
+                         distributions over history_years
+    Every deal carries the interest and principal accounts so DSCR is defined.
+    """
+    rng = np.random.default_rng(seed)
+    vcodes = [f"D{i:05d}" for i in range(deals)]
+    inv_ids = [f"INV{i:05d}" for i in range(deals)]
+    props = [f"LP{k}" for k in range(max(partners - 1, 0))] + ["GP"]
+
+    pool = sorted(GROSS_REVENUE_ACCTS | CONTRA_REVENUE_ACCTS | EXPENSE_ACCTS | CAPEX_ACCTS | OTHER_EXCLUDED_ACCTS)
+    must = sorted(INTEREST_ACCTS | PRINCIPAL_ACCTS)
+    chosen = must + list(rng.choice(pool, size=max(min(accounts, len(pool) + len(must)) - len(must), 0), replace=False))
+    chosen = np.array(chosen, dtype=np.int64)
+
+    all_accts = sorted(GROSS_REVENUE_ACCTS | CONTRA_REVENUE_ACCTS | EXPENSE_ACCTS | INTEREST_ACCTS
+                       | PRINCIPAL_ACCTS | CAPEX_ACCTS | OTHER_EXCLUDED_ACCTS)
+    coa = pd.DataFrame({
+        "vcode": all_accts,
+        "vdescription": [f"Account {a}" for a in all_accts],
+        "vtype": "",
+        "iNOI": 0,
+        "vMisc": "",
+        "vAccountType": ["Revenue" if a < 5000 else "Expense" for a in all_accts],
+    })
+
+    investment_map = pd.DataFrame({"vcode": vcodes, "InvestmentID": inv_ids})
+
+    start_year = PRO_YR_BASE_DEFAULT + 1 - history_years
+    starts = [date(start_year, int(m), 15) for m in rng.integers(1, 13, size=deals)]
+    waterfalls = pd.DataFrame(
+        [
+            (v, p, state, pct, s.isoformat())
+            for v, s in zip(vcodes, starts)
+            for p in props
+            for state, pct in (("pref", float(rng.choice([6.0, 8.0, 10.0]))), ("share", 100.0 / len(props)))
+        ],
+        columns=["vcode", "PropCode", "vState", "nPercent", "dteffective"],
+    )
+
+    # Accounting: contribution at start, then quarterly distributions
+    quarters = history_years * 4
+    acct_rows = []
+    for inv_id, s in zip(inv_ids, starts):
+        for p in props:
+            acct_rows.append((inv_id, p, s.isoformat(), int(rng.choice(must)), -float(rng.uniform(5e5, 5e6)), "Y"))
+            for q in range(1, quarters):
+                d = (pd.Timestamp(s) + pd.DateOffset(months=3 * q)).date()
+                acct_rows.append((inv_id, p, d.isoformat(), int(rng.choice(must)),
+                                  float(rng.uniform(1e4, 2e5)), "Y" if rng.random() < 0.3 else "N"))
+    accounting_feed = pd.DataFrame(
+        acct_rows, columns=["InvestmentID", "InvestorID", "EffectiveDate", "TypeID", "Amt", "Capital"])
+
+    # Forecast: every (deal, account, month) over the horizon, signs deliberately mixed
+    months = years * 12
+    n = deals * len(chosen) * months
+    deal_idx = np.repeat(np.arange(deals), len(chosen) * months)
+    acct_col = np.tile(np.repeat(chosen, months), deals)
+    month_idx = np.tile(np.arange(months), deals * len(chosen))
+    year_off = month_idx // 12
+    event = pd.to_datetime({"year": PRO_YR_BASE_DEFAULT + year_off, "month": month_idx % 12 + 1, "day": 28})
+    forecast_feed = pd.DataFrame({
+        "Vcode": np.asarray(vcodes, dtype=object)[deal_idx],
+        "dtEntry": f"{PRO_YR_BASE_DEFAULT}-01-01",
+        "vSource": "SYN",
+        "vAccount": acct_col,
+        "mAmount": rng.normal(5e3, 2e4, size=n).round(2),
+        "Year": PRO_YR_BASE_DEFAULT + year_off,
+        "Qtr": (month_idx % 12) // 3 + 1,
+        "Date": event.dt.strftime("%Y-%m-%d"),
+        "Pro_Yr": year_off,
+    })
+
+    return {
+        "investment_map": investment_map,
+        "waterfalls": waterfalls,
+        "coa": coa,
+        "accounting_feed": accounting_feed,
+        "forecast_feed": forecast_feed,
+    }
+
+
+def write_portfolio(frames: Dict[str, pd.DataFrame], folder) -> Path:
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, df in frames.items():
+        df.to_csv(folder / f"{name}.csv", index=False)
+    return folder
+
+
+# ============================================================
+# MEASUREMENT
+# ============================================================
+def measure(fn: Callable[[], object], repeat: int) -> Tuple[object, float, float]:
+    """(result, best wall seconds over repeat runs, peak traced MB of one extra run)."""
+    best = float("inf")
+    result = None
+    for _ in range(max(repeat, 1)):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, best, peak / 1024 ** 2
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).resolve().parent, check=False)
+        return out.stdout.strip()
+    except OSError:
+        return ""
+
+
+# ============================================================
+# STAGES
+# ============================================================
+def scalar_replay(states: List[Tuple[DealState, Dict[str, float]]], acct: pd.DataFrame):
+    # The per-row accrue_to/apply_txn loop (the pre-vectorization report path)
+    acct = acct.assign(
+        EffectiveDate=pd.to_datetime(acct["EffectiveDate"]).dt.date,
+        InvestorID=acct["InvestorID"].astype(str),
+    )
+    by_deal = {v: g for v, g in acct.groupby("vcode", sort=False)}
+    for state, rates in states:
+        rows = by_deal.get(state.vcode)
+        if rows is None:
+            continue
+        for _, r in rows.sort_values("EffectiveDate", kind="stable").iterrows():
+            d = r["EffectiveDate"]
+            accrue_to(state, d, rates)
+            if r["InvestorID"] in state.partners:
+                apply_txn(state.partners[r["InvestorID"]], d, float(r["Amt"]), map_bucket(r["Capital"]))
+            state.last_event_date = d
+
+
+def run_benchmarks(params: Dict[str, int], repeat: int, keep_data: str = None,
+                   startup: bool = False) -> List[dict]:
+    frames = generate_portfolio(**params)
+    tmp = None
+    if keep_data:
+        folder = write_portfolio(frames, keep_data)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        folder = write_portfolio(frames, tmp.name)
+
+    start_year, horizon = PRO_YR_BASE_DEFAULT + 1, min(params["years"], 10)
+    results: List[dict] = []
+
+    def stage(name: str, fn: Callable[[], object], rows: int):
+        out, seconds, peak_mb = measure(fn, repeat)
+        results.append({"stage": name, "seconds": seconds, "peak_mb": peak_mb, "rows": int(rows)})
+        print(f"  {name:<38} {seconds:>9.4f}s  {peak_mb:>9.1f} MB  rows={rows:,}", file=sys.stderr)
+        return out
+
+    try:
+        stage("read_csv", lambda: {k: pd.read_csv(folder / f"{k}.csv") for k in frames},
+              sum(len(df) for df in frames.values()))
+        raw, _ = stage("read_feeds (parallel)",
+                       lambda: read_feeds({k: folder / f"{k}.csv" for k in frames}, list(frames)),
+                       sum(len(df) for df in frames.values()))
+
+        coa = stage("load_coa", lambda: load_coa(raw["coa"]), len(raw["coa"]))
+        fc = stage("load_forecast", lambda: load_forecast(raw["forecast_feed"], coa, PRO_YR_BASE_DEFAULT),
+                   len(raw["forecast_feed"]))
+        stage("normalize_forecast_signs", lambda: normalize_forecast_signs(fc), len(fc))
+
+        inv = load_investment_map(raw["investment_map"])
+        wf = load_waterfalls(raw["waterfalls"])
+        acct = load_accounting(raw["accounting_feed"])
+        index = stage("build_deal_index", lambda: build_deal_index(inv, wf, acct, fc), len(acct) + len(fc))
+
+        vcodes = sorted(inv["vcode"].unique())
+        per_deal = {d: deal_frames(index, wf, acct, fc, d) for d in vcodes}
+
+        stage("annual_aggregation_table (per deal)",
+              lambda: [annual_aggregation_table(per_deal[d][2], start_year, horizon) for d in vcodes], len(fc))
+        stage("portfolio_annual_aggregation",
+              lambda: portfolio_annual_aggregation(fc, start_year, horizon, vcodes), len(fc))
+
+        acct_joined = pd.concat([per_deal[d][1] for d in vcodes], ignore_index=True)
+
+        def fresh_states():
+            return [init_deal_state(d, per_deal[d][0]) for d in vcodes]
+
+        stage("replay accrue_to/apply_txn (scalar)", lambda: scalar_replay(fresh_states(), acct_joined),
+              len(acct_joined))
+
+        def vector_replay():
+            states = fresh_states()
+            replay_ledger([s for s, _ in states], {s.vcode: r for s, r in states}, acct_joined)
+            return [s for s, _ in states]
+
+        replayed = stage("replay_ledger (vectorized)", vector_replay, len(acct_joined))
+
+        flows = [ps.irr_cashflows for s in replayed for ps in s.partners.values()]
+        n_flows = sum(len(f) for f in flows)
+
+        def scalar_xirr():
+            out = []
+            for cfs in flows:
+                try:
+                    out.append(xirr(cfs))
+                except ValueError:
+                    out.append(float("nan"))
+            return out
+
+        stage("xirr (per partner)", scalar_xirr, n_flows)
+        stage("partner_irrs (batched)", lambda: partner_irrs(replayed), n_flows)
+
+        plans = [compile_waterfall(d, per_deal[d][0]) for d in vcodes]
+        annual = portfolio_annual_aggregation(fc, start_year, horizon, vcodes)
+        stage("run_waterfalls (compiled)",
+              lambda: run_waterfalls(replayed, plans, annual, start_year, horizon), n_flows)
+
+        if startup:
+            results.extend(run_startup_benchmarks(folder, annual, repeat))
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    return results
+
+
+# ============================================================
+# STARTUP (fresh interpreters: cold imports, app script runs, export worker)
+# ============================================================
+IMPORT_PROBE = "import time; t0 = time.perf_counter(); import {}; print(time.perf_counter() - t0)"
+
+# Cold first run of app.py (its imports included), then warm reruns with the
+# portfolio loaded: Streamlit re-executes the whole script on every rerun
+APP_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file(sys.argv[1], default_timeout=600)
+t0 = time.perf_counter(); at.run(); first = time.perf_counter() - t0
+at.sidebar.text_input[0].set_value(sys.argv[2]).run()
+reruns = []
+for _ in range(int(sys.argv[3])):
+    t0 = time.perf_counter(); at.run(); reruns.append(time.perf_counter() - t0)
+print(json.dumps({"first": first, "rerun": min(reruns), "exceptions": len(at.exception)}))
+"""
+
+EXPORT_DEALS = 10
+
+
+def probe(args: List[str]) -> str:
+    out = subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True,
+                         cwd=Path(__file__).resolve().parent)
+    return out.stdout.strip().splitlines()[-1]
+
+
+def run_startup_benchmarks(folder: Path, annual: pd.DataFrame, repeat: int) -> List[dict]:
+    """
+    Time-to-first-render and per-rerun overhead of the app, and cold vs warm
+    exports. Each cold measurement is a fresh interpreter (best of repeat);
+    peak memory is not traced.
+    """
+    results: List[dict] = []
+    app = str(Path(__file__).resolve().parent / "app.py")
+
+    def record(name: str, seconds: float, rows: int = 0):
+        results.append({"stage": name, "seconds": seconds, "peak_mb": None, "rows": int(rows)})
+        print(f"  {name:<38} {seconds:>9.4f}s  {'-':>9}     rows={rows:,}", file=sys.stderr)
+
+    for label, modules in [("waterfall_core", "waterfall_core"),
+                           ("app modules", "streamlit, waterfall_core, report_export")]:
+        record(f"startup: import {label} (cold)",
+               min(float(probe(["-c", IMPORT_PROBE.format(modules)])) for _ in range(max(repeat, 1))))
+
+    runs = [json.loads(probe(["-c", APP_PROBE, app, str(folder), str(max(repeat, 1))]))
+            for _ in range(max(repeat, 1))]
+    if any(r["exceptions"] for r in runs):
+        print("  app.py raised during the startup probe", file=sys.stderr)
+    record("startup: app first run (cold)", min(r["first"] for r in runs))
+    record("startup: app rerun (warm, data loaded)", min(r["rerun"] for r in runs))
+
+    tables = list(deal_tables(annual))[:EXPORT_DEALS]
+    with tempfile.TemporaryDirectory() as tmp:
+        pickled = Path(tmp) / "tables.pkl"
+        pd.to_pickle(tables, pickled)
+        cold = float("inf")
+        for _ in range(max(repeat, 1)):
+            t0 = time.perf_counter()
+            probe(["-m", "report_export", str(pickled), str(Path(tmp) / "cold.zip")])
+            cold = min(cold, time.perf_counter() - t0)
+        record(f"export {len(tables)} deals (cold process)", cold, len(tables))
+
+        worker = ExportWorker().start()
+        try:
+            warm = float("inf")
+            for _ in range(max(repeat, 1)):
+                t0 = time.perf_counter()
+                job = ExportJob(tables, Path(tmp) / "warm.zip").start(worker)
+                while job.running:
+                    time.sleep(0.01)
+                if job.error:
+                    raise RuntimeError(job.error)
+                warm = min(warm, time.perf_counter() - t0)
+        finally:
+            worker.close()
+        record(f"export {len(tables)} deals (warm worker)", warm, len(tables))
+    return results
+
+
+# ============================================================
+# REPORTING
+# ============================================================
+def load_baseline(path, params: Dict[str, int]) -> Dict[str, dict]:
+    """Stage -> record of the latest run in path with identical parameters."""
+    latest: Dict[str, dict] = {}
+    with open(path) as fh:
+        for line in fh:
+            rec = json.loads(line)
+            if rec.get("params") == params:
+                latest[rec["stage"]] = rec
+    return latest
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark waterfall_core stages on a synthetic portfolio.")
+    parser.add_argument("--deals", type=int, default=50)
+    parser.add_argument("--partners", type=int, default=4)
+    parser.add_argument("--accounts", type=int, default=40, help="forecast accounts per deal")
+    parser.add_argument("--years", type=int, default=10, help="forecast years")
+    parser.add_argument("--history-years", type=int, default=8, help="years of accounting history")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (best is kept)")
+    parser.add_argument("--out", default=DEFAULT_OUT, help=f"JSON lines results file (default: {DEFAULT_OUT})")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--keep-data", help="write the synthetic CSVs to this folder and keep them")
+    parser.add_argument("--startup", action="store_true",
+                        help="also time cold imports, the app's first run / reruns and cold vs warm exports")
+    args = parser.parse_args(argv)
+
+    params = {
+        "deals": args.deals,
+        "partners": args.partners,
+        "accounts": args.accounts,
+        "years": args.years,
+        "history_years": args.history_years,
+        "seed": args.seed,
+    }
+    baseline = load_baseline(args.baseline, params) if args.baseline else {}
+
+    print(f"Benchmark {params}", file=sys.stderr)
+    results = run_benchmarks(params, args.repeat, args.keep_data, args.startup)
+
+    meta = {
+        "run_id": uuid.uuid4().hex[:12],
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "params": params,
+    }
+    with open(args.out, "a") as fh:
+        for rec in results:
+            fh.write(json.dumps({**meta, **rec}) + "\n")
+    print(f"Appended {len(results)} stage results to {args.out}", file=sys.stderr)
+
+    if baseline:
+        print("\nvs baseline (seconds ratio, <1 is faster):", file=sys.stderr)
+        for rec in results:
+            old = baseline.get(rec["stage"])
+            if old and old["seconds"] > 0:
+                print(f"  {rec['stage']:<38} {rec['seconds'] / old['seconds']:>6.2f}x", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# daycount.py
+# Day-count conventions and calendar arithmetic on integer date ordinals
+# (date.toordinal()), for the accrual engine and XIRR in waterfall_core.py.
+# - Dates are converted to ordinals once; every function here works on whole arrays.
+# - Conventions: Actual/365 Fixed, Actual/360, Actual/Actual (ISDA), 30/360 (bond basis).
+
+from __future__ import annotations
+
+from datetime import date
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# ============================================================
+# CONVENTIONS
+# ============================================================
+ACT_365F = "ACT/365F"
+ACT_360 = "ACT/360"
+ACT_ACT = "ACT/ACT"
+THIRTY_360 = "30/360"
+
+DAY_COUNTS = (ACT_365F, ACT_360, ACT_ACT, THIRTY_360)
+DEFAULT_DAY_COUNT = ACT_365F
+
+# Spellings used in deal terms (upper-cased, single-spaced) -> convention
+DAY_COUNT_ALIASES = {
+    "ACT/365F": ACT_365F, "ACT/365": ACT_365F, "ACT/365 FIXED": ACT_365F, "A/365F": ACT_365F, "A/365": ACT_365F,
+    "ACTUAL/365": ACT_365F, "ACTUAL/365F": ACT_365F, "ACTUAL/365 FIXED": ACT_365F,
+    "ACT/360": ACT_360, "A/360": ACT_360, "ACTUAL/360": ACT_360,
+    "ACT/ACT": ACT_ACT, "ACT/ACT ISDA": ACT_ACT, "A/A": ACT_ACT, "ACTUAL/ACTUAL": ACT_ACT,
+    "ACTUAL/ACTUAL ISDA": ACT_ACT,
+    "30/360": THIRTY_360, "30/360 US": THIRTY_360, "30U/360": THIRTY_360, "BOND BASIS": THIRTY_360,
+}
+
+
+def day_count(name) -> str:
+    """Convention for a deal-terms spelling; blank / missing means DEFAULT_DAY_COUNT."""
+    if name is None or pd.isna(name) or not str(name).strip():
+        return DEFAULT_DAY_COUNT
+    key = " ".join(str(name).upper().split())
+    if key not in DAY_COUNT_ALIASES:
+        raise ValueError(f"Unknown day-count convention {name!r} (expected one of {', '.join(DAY_COUNTS)})")
+    return DAY_COUNT_ALIASES[key]
+
+
+# ============================================================
+# ORDINAL CALENDAR
+# ============================================================
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def to_ordinals(values) -> np.ndarray:
+    days = pd.to_datetime(pd.Series(values)).to_numpy().astype("datetime64[D]").astype(np.int64)
+    return days + EPOCH_ORDINAL
+
+
+def ordinal_years(ords: np.ndarray) -> np.ndarray:
+    return (ords - EPOCH_ORDINAL).astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+
+def ordinal_ymd(ords: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    days = (np.asarray(ords, dtype=np.int64) - EPOCH_ORDINAL).astype("datetime64[D]")
+    months = days.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]").astype(np.int64) + 1970
+    return years, months.astype(np.int64) % 12 + 1, (days - months).astype(np.int64) + 1
+
+
+def year_start_ordinals(years: np.ndarray) -> np.ndarray:
+    jan1 = (np.asarray(years, dtype=np.int64) - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+    return jan1.astype(np.int64) + EPOCH_ORDINAL
+
+
+def year_end_ordinals(years: np.ndarray) -> np.ndarray:
+    # Jan 1 of the following year, minus one day
+    return year_start_ordinals(np.asarray(years, dtype=np.int64) + 1) - 1
+
+
+def days_in_year(years: np.ndarray) -> np.ndarray:
+    y = np.asarray(years, dtype=np.int64)
+    leap = (y % 4 == 0) & ((y % 100 != 0) | (y % 400 == 0))
+    return np.where(leap, 366, 365)
+
+
+# ============================================================
+# YEAR FRACTIONS
+# ============================================================
+def year_fraction(start: np.ndarray, end: np.ndarray, convention: str = DEFAULT_DAY_COUNT) -> np.ndarray:
+    """
+    Year fraction from start to end ordinals (elementwise, broadcasting):
+      ACT/365F -> days / 365
+      ACT/360  -> days / 360
+      ACT/ACT  -> days in each calendar year / that year's length (ISDA)
+      30/360   -> 360*dY + 30*dM + dD with day 31 -> 30 rules (bond basis)
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+
+    if convention == ACT_365F:
+        return (end - start) / 365.0
+    if convention == ACT_360:
+        return (end - start) / 360.0
+    if convention == ACT_ACT:
+        y1, y2 = ordinal_years(start), ordinal_years(end)
+        first = (year_start_ordinals(y1 + 1) - start) / days_in_year(y1)
+        last = (end - year_start_ordinals(y2)) / days_in_year(y2)
+        return np.where(y1 == y2, (end - start) / days_in_year(y1), first + (y2 - y1 - 1) + last)
+    if convention == THIRTY_360:
+        y1, m1, d1 = ordinal_ymd(start)
+        y2, m2, d2 = ordinal_ymd(end)
+        d1 = np.minimum(d1, 30)
+        d2 = np.where((d2 == 31) & (d1 == 30), 30, d2)
+        return (360 * (y2 - y1) + 30 * (m2 - m1) + (d2 - d1)) / 360.0
+    raise ValueError(f"Unknown day-count convention {convention!r}")
+
+
+def year_end_splits(start: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Split every interval (start, end] at the year-ends strictly inside it, for
+    whole arrays of intervals at once. Each interval yields its year-end
+    segments followed by one segment ending at end (intervals with
+    end <= start yield only that one).
+
+    Returns flat per-segment arrays (interval, from, to, at_year_end):
+    at_year_end marks segments closing on an interior year-end, where accrued
+    pref compounds.
+    """
+    start = np.asarray(start, dtype=np.int64)
+    end = np.asarray(end, dtype=np.int64)
+
+    y0 = ordinal_years(start)
+    lo = y0 + (start == year_end_ordinals(y0))
+    hi = ordinal_years(end) - 1
+    n_ye = np.where(end > start, np.maximum(hi - lo + 1, 0), 0)
+
+    n_seg = n_ye + 1
+    interval = np.repeat(np.arange(len(start)), n_seg)
+    pos = np.arange(len(interval)) - np.repeat(np.cumsum(n_seg) - n_seg, n_seg)
+    at_year_end = pos < n_ye[interval]
+    seg_to = np.where(at_year_end, year_end_ordinals(lo[interval] + pos), end[interval])
+    seg_from = np.where(pos == 0, start[interval], np.roll(seg_to, 1))
+    return interval, seg_from, seg_to, at_year_end
@@ -0,0 +1,611 @@
+# report_export.py
+# Bulk export of per-deal annual tables (investor packages) to PDF / DOCX / XLSX.
+# - Formatting follows style_annual_table through annual_row_styles: underlined
+#   Expenses, double rule under NOI, rule above FAD, DSCR to two decimals.
+# - fpdf2, python-docx and XlsxWriter are imported by the renderers, so the app
+#   and batch runs work without them until an export is requested.
+# - export_zip renders deals in a process pool and writes each deal's documents
+#   into one ZIP as they complete; only a bounded window of deals is in flight.
+# - ExportWorker is a warm `python -m report_export --serve` process for the UI
+#   (a pool started inside the Streamlit server would re-run the app script in
+#   spawned workers): it imports the renderers and starts its pool once, then
+#   runs ExportJobs as they come, so an export skips interpreter start-up.
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import hashlib
+import importlib
+import io
+import json
+import os
+import pickle
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import traceback
+import zipfile
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from waterfall_core import annual_row_styles, pivot_annual_table
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+EXPORT_FORMATS = ("pdf", "docx", "xlsx")
+EXPORT_TITLE = "Annual Operating Forecast"
+EXPORT_SUBTITLE = "Revenues to Funds Available for Distribution"
+
+# Deals submitted to the pool per worker ahead of the ZIP writer
+INFLIGHT_PER_WORKER = 2
+
+# Pool size of the UI's long-lived ExportWorker: it shares the machine with the
+# Streamlit server for the server's lifetime (batch exports use every core)
+UI_EXPORT_WORKERS = 2
+
+
+def deal_tables(annual: pd.DataFrame) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """(vcode, annual table as shown in the UI) per deal of portfolio_annual_aggregation output."""
+    for vcode, rows in annual.groupby("vcode", sort=True):
+        yield str(vcode), pivot_annual_table(rows.drop(columns="vcode"))
+
+
+def format_value(x, decimals: int) -> str:
+    if pd.isna(x):
+        return ""
+    return f"{x:,.{decimals}f}"
+
+
+# Longest sheet name Excel accepts
+XLSX_SHEET_MAX = 31
+
+
+def safe_name(vcode: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", str(vcode)).strip("._") or "deal"
+
+
+def _short_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:8]
+
+
+def unique_name(vcode: str, taken: set) -> str:
+    """
+    safe_name(vcode), made unique (case-insensitively, as most file systems
+    compare) among the names already in taken, which it is added to: a
+    vcode that sanitizes to a taken name (A/B and A_B, A. and A) gets a short
+    hash of the vcode appended, then a counter if that is taken too.
+    """
+    base = safe_name(vcode)
+    name = base
+    if name.lower() in taken:
+        name = f"{base}_{_short_hash(str(vcode))}"
+        k = 2
+        while name.lower() in taken:
+            name = f"{base}_{_short_hash(str(vcode))}_{k}"
+            k += 1
+    taken.add(name.lower())
+    return name
+
+
+def sheet_name(vcode: str) -> str:
+    # Truncated names keep a hash of the vcode, so distinct vcodes keep distinct sheet names
+    name = safe_name(vcode)
+    if len(name) <= XLSX_SHEET_MAX:
+        return name
+    return f"{name[:XLSX_SHEET_MAX - 9]}_{_short_hash(str(vcode))}"
+
+
+# ============================================================
+# RENDERERS (one document per deal, returned as bytes)
+# ============================================================
+def render_pdf(vcode: str, table: pd.DataFrame, title: str = EXPORT_TITLE) -> bytes:
+    from fpdf import FPDF
+
+    def latin1(text: str) -> str:
+        # Core PDF fonts are Latin-1 only
+        return str(text).encode("latin-1", "replace").decode("latin-1")
+
+    styles = annual_row_styles(table.index)
+    pdf = FPDF(orientation="L", unit="mm", format="A4")
+    pdf.set_auto_page_break(auto=True, margin=12)
+    pdf.add_page()
+
+    pdf.set_font("Helvetica", style="B", size=13)
+    pdf.cell(0, 8, latin1(f"{vcode}: {title}"), new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font("Helvetica", size=9)
+    pdf.cell(0, 6, latin1(EXPORT_SUBTITLE), new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(3)
+
+    label_w = 58.0
+    col_w = (pdf.epw - label_w) / max(len(table.columns), 1)
+    size = 8 if len(table.columns) <= 12 else 6
+    row_h = size * 0.6
+
+    pdf.set_font("Helvetica", style="B", size=size)
+    pdf.cell(label_w, row_h, "Line Item")
+    for year in table.columns:
+        pdf.cell(col_w, row_h, str(year), align="R")
+    pdf.ln(row_h)
+    pdf.line(pdf.l_margin, pdf.get_y(), pdf.l_margin + pdf.epw, pdf.get_y())
+
+    for item, values in table.iterrows():
+        rs = styles[item]
+        y0 = pdf.get_y()
+        if rs.rule_above:
+            pdf.set_draw_color(153)
+            pdf.line(pdf.l_margin, y0, pdf.l_margin + pdf.epw, y0)
+            pdf.set_draw_color(0)
+
+        pdf.set_font("Helvetica", style=("B" if rs.bold else "") + ("U" if rs.underline else ""), size=size)
+        pdf.cell(label_w, row_h, latin1(item))
+        for x in values:
+            pdf.cell(col_w, row_h, format_value(x, rs.decimals), align="R")
+        pdf.ln(row_h)
+
+        y1 = pdf.get_y()
+        if rs.rule_below:
+            pdf.line(pdf.l_margin, y1, pdf.l_margin + pdf.epw, y1)
+        if rs.rule_below == "double":
+            pdf.line(pdf.l_margin, y1 + 0.6, pdf.l_margin + pdf.epw, y1 + 0.6)
+            pdf.ln(0.6)
+
+    return bytes(pdf.output())
+
+
+def _docx_border(cell, edge: str, val: str, size: int = 8, color: str = "000000"):
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+
+    tc_pr = cell._tc.get_or_add_tcPr()
+    borders = tc_pr.find(qn("w:tcBorders"))
+    if borders is None:
+        borders = OxmlElement("w:tcBorders")
+        tc_pr.append(borders)
+    el = OxmlElement(f"w:{edge}")
+    el.set(qn("w:val"), val)
+    el.set(qn("w:sz"), str(size))
+    el.set(qn("w:color"), color)
+    borders.append(el)
+
+
+def render_docx(vcode: str, table: pd.DataFrame, title: str = EXPORT_TITLE) -> bytes:
+    from docx import Document
+    from docx.enum.section import WD_ORIENT
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Pt
+
+    styles = annual_row_styles(table.index)
+    doc = Document()
+    section = doc.sections[0]
+    section.orientation = WD_ORIENT.LANDSCAPE
+    section.page_width, section.page_height = section.page_height, section.page_width
+
+    doc.add_heading(f"{vcode}: {title}", level=1)
+    doc.add_paragraph(EXPORT_SUBTITLE)
+
+    size = Pt(8 if len(table.columns) <= 12 else 6)
+    grid = doc.add_table(rows=len(table) + 1, cols=len(table.columns) + 1)
+
+    def put(cell, text: str, right: bool, bold: bool = False, underline: bool = False):
+        para = cell.paragraphs[0]
+        if right:
+            para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        run = para.add_run(text)
+        run.font.size = size
+        run.bold = bold
+        run.underline = underline
+
+    header = grid.rows[0].cells
+    put(header[0], "Line Item", right=False, bold=True)
+    for j, year in enumerate(table.columns, start=1):
+        put(header[j], str(year), right=True, bold=True)
+    for cell in header:
+        _docx_border(cell, "bottom", "single", 4)
+
+    for i, (item, values) in enumerate(table.iterrows(), start=1):
+        rs = styles[item]
+        cells = grid.rows[i].cells
+        put(cells[0], str(item), right=False, bold=rs.bold, underline=rs.underline)
+        for j, x in enumerate(values, start=1):
+            put(cells[j], format_value(x, rs.decimals), right=True, bold=rs.bold, underline=rs.underline)
+        for cell in cells:
+            if rs.rule_below == "double":
+                _docx_border(cell, "bottom", "double", 6)
+            elif rs.rule_below == "single":
+                _docx_border(cell, "bottom", "single", 12)
+            if rs.rule_above:
+                _docx_border(cell, "top", "single", 4, "999999")
+
+    buf = io.BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def render_xlsx(vcode: str, table: pd.DataFrame, title: str = EXPORT_TITLE) -> bytes:
+    import xlsxwriter
+
+    styles = annual_row_styles(table.index)
+    buf = io.BytesIO()
+    wb = xlsxwriter.Workbook(buf, {"in_memory": True, "nan_inf_to_errors": True})
+    ws = wb.add_worksheet(sheet_name(vcode))
+
+    bold = wb.add_format({"bold": True})
+    header = wb.add_format({"bold": True, "align": "right", "bottom": 1})
+    formats: Dict[object, object] = {}
+
+    def fmt(rs):
+        # xlsxwriter formats are workbook objects: one per distinct row style
+        if rs not in formats:
+            props = {"num_format": "#,##0.00" if rs.decimals == 2 else "#,##0", "bold": rs.bold}
+            if rs.underline:
+                props["underline"] = 1
+            if rs.rule_below == "double":
+                props["bottom"] = 6
+            elif rs.rule_below == "single":
+                props["bottom"] = 2
+            if rs.rule_above:
+                props.update({"top": 1, "top_color": "#999999"})
+            formats[rs] = wb.add_format(props)
+        return formats[rs]
+
+    ws.write(0, 0, f"{vcode}: {title}", bold)
+    ws.write(1, 0, EXPORT_SUBTITLE)
+    ws.write(3, 0, "Line Item", wb.add_format({"bold": True, "bottom": 1}))
+    for j, year in enumerate(table.columns, start=1):
+        ws.write(3, j, year, header)
+
+    for i, (item, values) in enumerate(table.iterrows(), start=4):
+        rs = styles[item]
+        ws.write_string(i, 0, str(item), fmt(rs))
+        for j, x in enumerate(values, start=1):
+            if pd.isna(x):
+                ws.write_blank(i, j, None, fmt(rs))
+            else:
+                ws.write_number(i, j, float(x), fmt(rs))
+
+    ws.set_column(0, 0, 34)
+    ws.set_column(1, len(table.columns), 14)
+    ws.freeze_panes(4, 1)
+    wb.close()
+    return buf.getvalue()
+
+
+RENDERERS: Dict[str, Callable[[str, pd.DataFrame, str], bytes]] = {
+    "pdf": render_pdf,
+    "docx": render_docx,
+    "xlsx": render_xlsx,
+}
+
+
+def warm_up():
+    """Import whichever renderer libraries are installed (pool initializer of the warm worker)."""
+    for module in ("fpdf", "docx", "xlsxwriter"):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def render_deal(vcode: str, table: pd.DataFrame, formats: Sequence[str], title: str = EXPORT_TITLE,
+                name: Optional[str] = None) -> Tuple[str, List[Tuple[str, bytes]]]:
+    """Worker task: (vcode, [(path inside the ZIP, document bytes)]) for one deal, filed under name."""
+    name = name or safe_name(vcode)
+    return vcode, [(f"{name}/{name}_annual_forecast.{ext}", RENDERERS[ext](vcode, table, title)) for ext in formats]
+
+
+# ============================================================
+# ZIP EXPORT (process pool, streamed)
+# ============================================================
+def export_zip(tables: Iterable[Tuple[str, pd.DataFrame]], out, formats: Sequence[str] = EXPORT_FORMATS,
+               workers: Optional[int] = None, title: str = EXPORT_TITLE,
+               progress: Optional[Callable[[int, str], None]] = None,
+               pool: Optional[ProcessPoolExecutor] = None) -> int:
+    """
+    Render every (vcode, annual table) in formats and write the documents into
+    one ZIP at out (path or binary file object). Deals are rendered in a
+    process pool (pool, left open for the caller, or one started for this
+    export); each deal's documents are written to the archive as soon as
+    it completes and then dropped, so memory holds at most
+    INFLIGHT_PER_WORKER deals per worker rather than the whole export.
+    Each deal's folder is unique_name(vcode), so no two deals share ZIP members.
+    progress(done, vcode) is called after each deal. Returns the deal count.
+    """
+    unknown = [f for f in formats if f not in RENDERERS]
+    if unknown or not formats:
+        raise ValueError(f"Unknown export format(s) {unknown} (expected some of {', '.join(EXPORT_FORMATS)})")
+
+    workers = workers or os.cpu_count() or 1
+    todo = iter(tables)
+    taken: set = set()
+    done = 0
+
+    # Documents are already compressed formats: store them as-is
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf, \
+            (nullcontext(pool) if pool is not None else ProcessPoolExecutor(max_workers=workers)) as pool:
+        pending = set()
+
+        def submit_next() -> bool:
+            item = next(todo, None)
+            if item is None:
+                return False
+            pending.add(pool.submit(render_deal, item[0], item[1], tuple(formats), title,
+                                    unique_name(item[0], taken)))
+            return True
+
+        for _ in range(workers * INFLIGHT_PER_WORKER):
+            if not submit_next():
+                break
+
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                pending.discard(fut)
+                vcode, docs = fut.result()
+                for arcname, data in docs:
+                    zf.writestr(arcname, data)
+                done += 1
+                if progress is not None:
+                    progress(done, vcode)
+                submit_next()
+    return done
+
+
+# ============================================================
+# BACKGROUND EXPORT (warm worker process for the UI)
+# ============================================================
+PROGRESS_PREFIX = "PROGRESS"
+DONE_PREFIX = "DONE"
+ERROR_PREFIX = "ERROR"
+
+
+class ExportJob:
+    """
+    One export_zip run on an ExportWorker, for the UI: start() returns at once
+    and done / total / error / finished can be read from any rerun while it
+    runs. The tables are handed over in a temporary pickle, removed when the
+    job finishes; the ZIP at path is removed if it fails, once take_result()
+    has read it, or on discard().
+    """
+
+    def __init__(self, tables: Sequence[Tuple[str, pd.DataFrame]], path, formats: Sequence[str] = EXPORT_FORMATS,
+                 title: str = EXPORT_TITLE):
+        self.tables = list(tables)
+        self.path = str(path)
+        self.formats = tuple(formats)
+        self.title = title
+        self.total = len(self.tables)
+        self.done = 0
+        self.error: Optional[str] = None
+        self.finished = False
+        self.discarded = False
+        self.tables_path: Optional[str] = None
+
+    def start(self, worker: "ExportWorker") -> "ExportJob":
+        try:
+            fd, self.tables_path = tempfile.mkstemp(prefix="export_tables_", suffix=".pkl")
+            with os.fdopen(fd, "wb") as fh:
+                pickle.dump(self.tables, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            self.finish(str(e))
+            return self
+        self.tables = []
+        worker.submit(self)
+        return self
+
+    @property
+    def running(self) -> bool:
+        return not self.finished
+
+    def finish(self, error: Optional[str] = None):
+        self.error = error
+        _remove(self.tables_path)
+        if error is not None or self.discarded:
+            _remove(self.path)
+        self.finished = True
+
+    def take_result(self) -> bytes:
+        """The finished ZIP's bytes; the file is removed once read."""
+        try:
+            with open(self.path, "rb") as fh:
+                return fh.read()
+        finally:
+            _remove(self.path)
+
+    def discard(self):
+        # Drop the job's files; a running job keeps going, and its ZIP is removed when it finishes
+        self.discarded = True
+        _remove(self.path)
+
+
+def _remove(path: Optional[str]):
+    try:
+        if path is not None:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExportWorker:
+    """
+    A long-lived `python -m report_export --serve` process, shared by every UI
+    session. It imports pandas and the renderer libraries and starts its
+    process pool once, then runs the ExportJobs submitted to it one after
+    another (job specs as JSON lines on its stdin; PROGRESS / DONE / ERROR
+    lines back on its stdout). If it dies, its jobs fail and the next submit
+    starts a fresh one.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._jobs: Dict[int, ExportJob] = {}
+        self._reader: Optional[threading.Thread] = None
+        self._next_id = 0
+        # Fail (and so clean up after) jobs still running when the server exits
+        atexit.register(self.close)
+
+    def start(self) -> "ExportWorker":
+        """Start the process now (it warms up while the UI is in use) rather than on the first submit."""
+        with self._lock:
+            self._ensure_running()
+        return self
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _ensure_running(self):
+        if self.alive:
+            return
+        cmd = [sys.executable, "-m", "report_export", "--serve"]
+        if self.workers:
+            cmd += ["--workers", str(self.workers)]
+        # Its own process group, so its pool workers can be cleaned up with it
+        self._proc = subprocess.Popen(cmd, cwd=str(Path(__file__).resolve().parent), stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1,
+                                      start_new_session=hasattr(os, "killpg"))
+        self._jobs = {}
+        self._reader = threading.Thread(target=self._read, args=(self._proc, self._jobs), daemon=True)
+        self._reader.start()
+
+    def submit(self, job: ExportJob):
+        with self._lock:
+            self._ensure_running()
+            self._next_id += 1
+            self._jobs[self._next_id] = job
+            spec = {"id": self._next_id, "tables": job.tables_path, "out": job.path,
+                    "formats": list(job.formats), "title": job.title}
+            try:
+                self._proc.stdin.write(json.dumps(spec) + "\n")
+                self._proc.stdin.flush()
+            except OSError as e:
+                if self._jobs.pop(self._next_id, None) is not None:
+                    job.finish(f"export worker unavailable: {e}")
+
+    def _read(self, proc: subprocess.Popen, jobs: Dict[int, ExportJob]):
+        log = deque(maxlen=20)
+        for line in proc.stdout:
+            kind, _, rest = line.rstrip("\n").partition(" ")
+            if kind not in (PROGRESS_PREFIX, DONE_PREFIX, ERROR_PREFIX):
+                log.append(line.rstrip())
+                continue
+            job_id, _, rest = rest.partition(" ")
+            with self._lock:
+                job = jobs.get(int(job_id))
+                if job is None:
+                    continue
+                if kind == PROGRESS_PREFIX:
+                    job.done = int(rest.split()[0])
+                else:
+                    del jobs[int(job_id)]
+                    job.finish(json.loads(rest) if kind == ERROR_PREFIX else None)
+
+        code = proc.wait()
+        if hasattr(os, "killpg"):
+            # Pool workers orphaned by a crashed server process
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        with self._lock:
+            for job in jobs.values():
+                job.finish("\n".join(log) or f"export worker exited with code {code}")
+            jobs.clear()
+
+    def close(self, timeout: float = 10.0):
+        """Stop the process (killed after timeout); its unfinished jobs fail and their files are removed."""
+        if self.alive:
+            self._proc.stdin.close()
+            try:
+                self._proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+        if self._reader is not None:
+            self._reader.join(timeout)
+
+
+def _pool_worker_init():
+    # Only the server process writes to the protocol pipe: pool workers holding it
+    # open would keep the UI from seeing the server exit
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    os.close(devnull)
+    warm_up()
+
+
+def start_pool(workers: int) -> ProcessPoolExecutor:
+    warm_up()
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_pool_worker_init)
+    # Start the workers now rather than on the first job's first deal
+    wait([pool.submit(int) for _ in range(workers)])
+    return pool
+
+
+def serve(workers: Optional[int] = None) -> int:
+    """--serve: run the job specs read from stdin (JSON lines) until it closes, on one warm pool."""
+    workers = workers or os.cpu_count() or 1
+    pool = start_pool(workers)
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        spec = json.loads(line)
+        job_id = spec["id"]
+        try:
+            with open(spec["tables"], "rb") as fh:
+                tables = pickle.load(fh)
+
+            def progress(done: int, vcode: str):
+                print(f"{PROGRESS_PREFIX} {job_id} {done} {len(tables)} {vcode}", flush=True)
+
+            n = export_zip(tables, spec["out"], spec["formats"], workers, spec["title"], progress, pool=pool)
+            print(f"{DONE_PREFIX} {job_id} {n}", flush=True)
+        except Exception as e:
+            print(f"{ERROR_PREFIX} {job_id} {json.dumps(traceback.format_exc())}", flush=True)
+            if isinstance(e, BrokenProcessPool):
+                pool = start_pool(workers)
+    pool.shutdown()
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render pickled (vcode, annual table) pairs into one ZIP.")
+    parser.add_argument("tables", nargs="?", help="pickle of [(vcode, annual table), ...]")
+    parser.add_argument("out", nargs="?", help="ZIP file to write")
+    parser.add_argument("--formats", nargs="+", choices=EXPORT_FORMATS, default=list(EXPORT_FORMATS))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--title", default=EXPORT_TITLE)
+    parser.add_argument("--serve", action="store_true",
+                        help="stay up and run job specs (JSON lines) from stdin on one warm pool")
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        return serve(args.workers)
+    if not args.tables or not args.out:
+        parser.error("tables and out are required (unless --serve)")
+
+    with open(args.tables, "rb") as fh:
+        tables = pickle.load(fh)
+
+    def progress(done: int, vcode: str):
+        print(f"{PROGRESS_PREFIX} {done} {len(tables)} {vcode}", flush=True)
+
+    export_zip(tables, args.out, args.formats, args.workers, args.title, progress)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Portfolio-wide annual aggregation against the per-deal annual_aggregation_table.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from waterfall_core import (
+    CAPEX_ACCTS, CONTRA_REVENUE_ACCTS, EXPENSE_ACCTS, GROSS_REVENUE_ACCTS, INTEREST_ACCTS, OTHER_EXCLUDED_ACCTS,
+    PRINCIPAL_ACCTS, annual_aggregation_table, id_strings, load_coa, load_forecast, portfolio_annual_aggregation,
+)
+
+PRO_YR_BASE = 2020
+START_YEAR = 2022
+HORIZON = 6
+
+# Each deal draws from a random subset of these, so some line items are missing
+ACCOUNT_GROUPS = [GROSS_REVENUE_ACCTS, CONTRA_REVENUE_ACCTS, EXPENSE_ACCTS, INTEREST_ACCTS, PRINCIPAL_ACCTS,
+                  CAPEX_ACCTS, OTHER_EXCLUDED_ACCTS, {1000, 9999}]
+
+
+def random_forecast(rng, n_deals=30):
+    """
+    A loaded forecast (load_forecast) for n_deals random deals. Deals have
+    gaps in years and line items; the last two have no rows inside the window.
+    """
+    parts = []
+    for i in range(n_deals):
+        groups = [sorted(g) for g, keep in zip(ACCOUNT_GROUPS, rng.random(len(ACCOUNT_GROUPS)) < 0.6) if keep]
+        accounts = [a for g in groups for a in g] or [4010]
+        pro_yrs = rng.choice(np.arange(-2, 10), int(rng.integers(1, 8)), replace=False)
+        if i >= n_deals - 2:
+            pro_yrs = np.array([-1, HORIZON + START_YEAR - PRO_YR_BASE + 1])  # before / after the window
+        n = int(rng.integers(1, 60))
+        parts.append(pd.DataFrame({
+            "Vcode": f"D{i:03d}",
+            "vSource": "S",
+            "vAccount": rng.choice(accounts, n),
+            "mAmount": rng.normal(0.0, 10_000.0, n).round(2),
+            "Pro_Yr": rng.choice(pro_yrs, n),
+            "Date": "2025-03-31",
+        }))
+    raw = pd.concat(parts, ignore_index=True)
+    raw = raw.sample(frac=1.0, random_state=int(rng.integers(1 << 31))).reset_index(drop=True)
+
+    accounts = sorted(set(raw["vAccount"]))
+    coa = load_coa(pd.DataFrame({"vcode": accounts, "vAccountType": "x"}))
+    return load_forecast(raw, coa, PRO_YR_BASE)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_portfolio_aggregation_matches_per_deal(seed):
+    fc = random_forecast(np.random.default_rng(seed))
+    vcodes = sorted(set(id_strings(fc["vcode"]))) + ["NOROWS"]  # plus a deal with no forecast at all
+
+    portfolio = portfolio_annual_aggregation(fc, START_YEAR, HORIZON, vcodes)
+    assert list(portfolio["vcode"].unique()) == vcodes
+
+    deal_of_row = id_strings(fc["vcode"])
+    for vcode, got in portfolio.groupby("vcode", sort=False):
+        want = annual_aggregation_table(fc[deal_of_row == vcode], START_YEAR, HORIZON)
+        got = got.drop(columns="vcode").reset_index(drop=True)
+        pd.testing.assert_frame_equal(got, want.astype({c: float for c in want.columns if c != "Year"}),
+                                      check_dtype=False, check_exact=True)
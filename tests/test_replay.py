@@ -0,0 +1,132 @@
+"""
+Vectorized ledger replay (replay_ledger / replay_deal) against the scalar
+reference replay_accounting.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+import pytest
+
+from waterfall_core import init_deal_state, replay_accounting, replay_deal, replay_ledger
+
+DAY_COUNT_SPELLINGS = ["", "ACT/365F", "ACT/360", "ACT/ACT", "30/360"]
+
+
+def assert_same_state(vec, ref):
+    assert vec.last_event_date == ref.last_event_date
+    assert vec.ledger.codes == ref.ledger.codes
+    for name in ("principal", "pref_accrued", "pref_capitalized"):
+        np.testing.assert_allclose(getattr(vec.ledger, name), getattr(ref.ledger, name), rtol=1e-12, atol=1e-9)
+    for code in ref.partners:
+        assert vec.partners[code].irr_cashflows == ref.partners[code].irr_cashflows
+
+
+def waterfall(vcode, codes, start="2020-01-01"):
+    return pd.DataFrame({
+        "vcode": vcode,
+        "PropCode": codes,
+        "vState": "pref",
+        "nPercent": 8.0,
+        "dteffective": start,
+    })
+
+
+def test_replay_deal_without_partner_rows():
+    # One accounting row whose InvestorID matches no PropCode: no flows, but the date still advances
+    wf = waterfall("D1", ["P1"])
+    acct = pd.DataFrame({"vcode": ["D1"], "InvestorID": ["ZZZ"], "EffectiveDate": ["2021-03-31"],
+                         "Amt": [100.0], "Capital": ["Y"]})
+
+    ref, rates = init_deal_state("D1", wf)
+    replay_accounting(ref, acct, rates)
+    state, _, ledger = replay_deal("D1", wf, acct)
+
+    assert ledger.empty
+    assert state.last_event_date == date(2021, 3, 31)
+    assert_same_state(state, ref)
+
+
+def test_replay_ledger_mixes_deals_with_and_without_partner_rows():
+    wf = {"D1": waterfall("D1", ["P1"]), "D2": waterfall("D2", ["P1", "P2"])}
+    acct = pd.DataFrame({
+        "vcode": ["D1", "D2", "D2", "D1"],
+        "InvestorID": ["ZZZ", "P2", "P1", "YYY"],
+        "EffectiveDate": ["2021-03-31", "2020-06-30", "2022-12-31", "2023-01-15"],
+        "Amt": [100.0, -500.0, 40.0, 7.0],
+        "Capital": ["Y", "Y", "N", "Y"],
+    })
+
+    refs, rates, states = [], {}, []
+    for vcode, wf_d in wf.items():
+        ref, rates[vcode] = init_deal_state(vcode, wf_d)
+        replay_accounting(ref, acct[acct["vcode"] == vcode], rates[vcode])
+        refs.append(ref)
+        states.append(init_deal_state(vcode, wf_d)[0])
+
+    ledger = replay_ledger(states, rates, acct)
+
+    assert list(ledger["vcode"]) == ["D2", "D2"]
+    for state, ref in zip(states, refs):
+        assert_same_state(state, ref)
+
+
+def random_portfolio(rng, n_deals=40):
+    """
+    Waterfalls and accounting rows for n_deals random deals. The rows include
+    Dec-31 events, same-day repeats for one partner, rows dated before the
+    deal's start and rows for investors that are not partners of the deal.
+    """
+    wf_parts, acct_parts = [], []
+    for i in range(n_deals):
+        vcode = f"D{i:03d}"
+        start = date(2015, 1, 1) + timedelta(days=int(rng.integers(0, 1500)))
+        codes = [f"P{j}" for j in range(int(rng.integers(1, 5)))]
+        wf_parts.append(pd.DataFrame({
+            "vcode": vcode,
+            "PropCode": codes,
+            "vState": "pref",
+            "nPercent": rng.uniform(0.0, 12.0, len(codes)).round(2),
+            "vDayCount": rng.choice(DAY_COUNT_SPELLINGS, len(codes)),
+            "dteffective": start,
+        }))
+
+        n = int(rng.integers(0, 30))
+        days = rng.integers(-200, 3000, n)
+        dates = [start + timedelta(days=int(d)) for d in days]
+        dec31 = rng.random(n) < 0.2
+        dates = [date(d.year, 12, 31) if y else d for d, y in zip(dates, dec31)]
+        investors = rng.choice(codes + ["ZZZ", "Q9"], n, p=[0.8 / len(codes)] * len(codes) + [0.1, 0.1])
+        rows = pd.DataFrame({
+            "vcode": vcode,
+            "InvestorID": investors,
+            "EffectiveDate": pd.to_datetime(dates),
+            "Amt": rng.normal(0.0, 50_000.0, n).round(2),
+            "Capital": rng.choice(["Y", "N", "y"], n),
+        })
+        repeats = rows.sample(frac=0.3, random_state=int(rng.integers(1 << 31)))
+        repeats = repeats.assign(Amt=rng.normal(0.0, 20_000.0, len(repeats)).round(2))
+        acct_parts.append(pd.concat([rows, repeats]))
+
+    acct = pd.concat(acct_parts, ignore_index=True)
+    acct = acct.sample(frac=1.0, random_state=int(rng.integers(1 << 31))).reset_index(drop=True)
+    return pd.concat(wf_parts, ignore_index=True), acct
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_replay_ledger_matches_replay_accounting(seed):
+    wf, acct = random_portfolio(np.random.default_rng(seed))
+
+    refs, rates, states = [], {}, []
+    for vcode, wf_d in wf.groupby("vcode", sort=False):
+        ref, rates[vcode] = init_deal_state(vcode, wf_d)
+        replay_accounting(ref, acct[acct["vcode"] == vcode], rates[vcode])
+        refs.append(ref)
+        states.append(init_deal_state(vcode, wf_d)[0])
+
+    ledger = replay_ledger(states, rates, acct)
+
+    for state, ref in zip(states, refs):
+        assert_same_state(state, ref)
+    assert len(ledger) == sum(r.ledger.n_flows for r in refs)
@@ -0,0 +1,2846 @@
+# waterfall_core.py
+# Compute core for the Waterfall + XIRR Forecast (no Streamlit dependency).
+# - Loaders, sign normalization, annual aggregation, table styling and the paged portfolio roll-up
+# - Batched XIRR, deal state, accrual and vectorized ledger replay
+# - Deal index, columnar dataset and ingestion cache
+# - SQLite deal state store: checkpoints with watermark-based incremental refresh
+# - Compiled waterfall engine: tier distributions of forecast FAD, forecast XIRR
+# - Scenario engine (sensitivity grids, Monte Carlo) with percentile summaries
+# - Goal seek: terminal flow or FAD multiple that meets a target partner IRR
+# Used by app.py (Streamlit UI) and batch.py (headless portfolio runs).
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from dataclasses import asdict, dataclass, field, replace
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from daycount import (
+    DEFAULT_DAY_COUNT,
+    EPOCH_ORDINAL,
+    day_count,
+    ordinal_years,
+    to_ordinals,
+    year_end_ordinals,
+    year_end_splits,
+    year_fraction,
+)
+
+
+# ============================================================
+# CONFIG
+# ============================================================
+DEFAULT_START_YEAR = 2026
+DEFAULT_HORIZON_YEARS = 10
+PRO_YR_BASE_DEFAULT = 2025
+DEFAULT_CACHE_BUDGET_MB = 1024
+DEFAULT_RESULT_CACHE_ITEMS = 256
+ACCOUNTING_CHUNK_ROWS = 250_000
+
+COMPILED_DIRNAME = "_compiled"
+
+FEED_NAMES = ["investment_map", "waterfalls", "coa", "accounting_feed", "forecast_feed"]
+
+# Contra-revenue (vacancy / concessions) - reduces revenue
+CONTRA_REVENUE_ACCTS = {4040, 4043, 4030, 4042}
+
+# Explicit account definitions (NO iNOI)
+# NOTE: Revenue set includes ALL revenue-related accounts; contra is handled separately in normalization.
+REVENUE_ACCTS = {
+    4010, 4012, 4020, 4041, 4045, 4040, 4043, 4030, 4042, 4070,
+    4091, 4092, 4090, 4097, 4093, 4094, 4096, 4095,
+    4063, 4060, 4061, 4062, 4080, 4065
+}
+
+# Gross revenues are revenues excluding contra-revenues
+GROSS_REVENUE_ACCTS = REVENUE_ACCTS - CONTRA_REVENUE_ACCTS
+
+EXPENSE_ACCTS = {
+    5090, 5110, 5114, 5018, 5010, 5016, 5012, 5014,
+    5051, 5053, 5050, 5052, 5054, 5055,
+    5060, 5067, 5063, 5069, 5061, 5064, 5065, 5068, 5070, 5066,
+    5020, 5022, 5021, 5023, 5025, 5026,
+    5045, 5080, 5087, 5085, 5040,
+    5096, 5095, 5091, 5100
+}
+
+INTEREST_ACCTS = {5190, 7030}
+PRINCIPAL_ACCTS = {7060}
+CAPEX_ACCTS = {7050}
+OTHER_EXCLUDED_ACCTS = {4050, 5220, 5210, 5195, 7065, 5120, 5130, 5400}
+
+ALL_EXCLUDED = INTEREST_ACCTS | PRINCIPAL_ACCTS | CAPEX_ACCTS | OTHER_EXCLUDED_ACCTS
+
+# Account classes: every forecast row gets one small-int code at load time
+# (categorical "acct_class" column); sign normalization and aggregation index by it.
+ACCOUNT_CLASSES = ["other", "gross_revenue", "contra_revenue", "expense", "interest", "principal", "capex", "excluded"]
+ACCOUNT_CLASS_SETS = {
+    "gross_revenue": GROSS_REVENUE_ACCTS,
+    "contra_revenue": CONTRA_REVENUE_ACCTS,
+    "expense": EXPENSE_ACCTS,
+    "interest": INTEREST_ACCTS,
+    "principal": PRINCIPAL_ACCTS,
+    "capex": CAPEX_ACCTS,
+    "excluded": OTHER_EXCLUDED_ACCTS,
+}
+
+# vAccount -> class code (accounts not listed are "other", code 0)
+ACCOUNT_CLASS_TABLE = pd.Series(
+    {acct: ACCOUNT_CLASSES.index(cls) for cls, accts in ACCOUNT_CLASS_SETS.items() for acct in sorted(accts)},
+    dtype=np.int8,
+).sort_index()
+
+# Sign applied to abs(mAmount) per class code; 0 leaves the amount as-is
+ACCOUNT_CLASS_SIGN = np.array([0, 1, -1, -1, -1, -1, -1, -1], dtype=np.int8)
+
+
+# ============================================================
+# UTILITIES
+# ============================================================
+def to_date(x) -> date:
+    return pd.to_datetime(x).date()
+
+
+# ============================================================
+# XIRR (vectorized, batched)
+# ============================================================
+# Cash-flow series are packed once into padded NumPy arrays of year fractions
+# (daycount.year_fraction, Actual/365 Fixed unless asked otherwise) and amounts;
+# every solver iteration is then pure array math across all series.
+XIRR_MIN_RATE = -0.9999
+XIRR_GUESS = 0.10
+XIRR_TOL = 1e-10
+XIRR_NPV_TOL = 1e-6                      # |NPV| at an accepted root, relative to sum(|amounts|)
+XIRR_MAX_NEWTON = 50
+XIRR_MAX_BISECT = 200
+
+# Bracket scan for the fallback solver: dense around typical returns, wide on the upside
+XIRR_SCAN_GRID = np.concatenate([
+    np.linspace(XIRR_MIN_RATE, 1.0, 81),
+    np.geomspace(1.05, 1.0e4, 60),
+])
+
+XIRR_OK = "ok"
+XIRR_EMPTY = "empty"                     # no non-zero flows
+XIRR_NO_SIGN_CHANGE = "no_sign_change"   # all flows share one sign: no root exists
+XIRR_NO_ROOT = "no_root"                 # mixed signs, but NPV never crosses zero in scan range
+
+
+@dataclass
+class XirrResult:
+    rates: np.ndarray    # annual rate per series; NaN where status != ok
+    status: np.ndarray   # XIRR_* code per series
+
+
+def pack_flows(owner: np.ndarray, ords: np.ndarray, amounts: np.ndarray, n_series: int,
+               day_count: str = DEFAULT_DAY_COUNT) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pack a flat flow log (series number, date ordinal, amount per flow) into
+    padded (n_series, max_flows) arrays, keeping log order within a series:
+      times   -> year fractions from each series' earliest date
+      amounts -> flow amounts (padding is 0.0, so it never moves NPV)
+    """
+    owner = np.asarray(owner, dtype=np.int64)
+    counts = np.bincount(owner, minlength=n_series)
+    width = int(counts.max()) if owner.size else 0
+
+    order = np.argsort(owner, kind="stable")
+    row = owner[order]
+    col = np.arange(len(row)) - (np.cumsum(counts) - counts)[row]
+
+    t0 = np.zeros(n_series, dtype=np.int64)
+    if owner.size:
+        t0[:] = np.iinfo(np.int64).max
+        np.minimum.at(t0, owner, ords)
+
+    times = np.zeros((n_series, width), dtype=float)
+    packed = np.zeros((n_series, width), dtype=float)
+    times[row, col] = year_fraction(t0[row], np.asarray(ords, dtype=np.int64)[order], day_count)
+    packed[row, col] = np.asarray(amounts, dtype=float)[order]
+    return times, packed
+
+
+def xirr_arrays(series: Sequence[Sequence[Tuple[date, float]]],
+                day_count: str = DEFAULT_DAY_COUNT) -> Tuple[np.ndarray, np.ndarray]:
+    """pack_flows for a list of [(date, amount), ...] series."""
+    sizes = [len(cfs) for cfs in series]
+    total = sum(sizes)
+    owner = np.repeat(np.arange(len(series)), sizes)
+    ords = np.fromiter((d.toordinal() for cfs in series for d, _ in cfs), dtype=np.int64, count=total)
+    amounts = np.fromiter((float(a) for cfs in series for _, a in cfs), dtype=float, count=total)
+    return pack_flows(owner, ords, amounts, len(series), day_count)
+
+
+def _npv(rates: np.ndarray, times: np.ndarray, amounts: np.ndarray) -> np.ndarray:
+    disc = np.exp(-times * np.log1p(rates)[:, None])
+    return (amounts * disc).sum(axis=1)
+
+
+def _npv_and_slope(rates: np.ndarray, times: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # d/dr [a * (1+r)^-t] = -t * a * (1+r)^-(t+1)
+    disc = np.exp(-times * np.log1p(rates)[:, None])
+    pv = amounts * disc
+    return pv.sum(axis=1), -(times * pv).sum(axis=1) / (1.0 + rates)
+
+
+def _xirr_newton(times: np.ndarray, amounts: np.ndarray, guess: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Newton iterations on all series at once; returns (rates, converged mask)."""
+    n = amounts.shape[0]
+    r = np.full(n, float(guess))
+    converged = np.zeros(n, dtype=bool)
+    failed = np.zeros(n, dtype=bool)
+
+    with np.errstate(all="ignore"):
+        for _ in range(XIRR_MAX_NEWTON):
+            act = np.flatnonzero(~(converged | failed))
+            if act.size == 0:
+                break
+            npv, slope = _npv_and_slope(r[act], times[act], amounts[act])
+            r_new = r[act] - npv / slope
+
+            bad = ~np.isfinite(r_new) | (r_new <= XIRR_MIN_RATE)
+            failed[act[bad]] = True
+
+            good = act[~bad]
+            step = np.abs(r_new[~bad] - r[good])
+            r[good] = r_new[~bad]
+            done = good[step <= XIRR_TOL * np.maximum(1.0, np.abs(r[good]))]
+            if done.size:
+                # A tiny step alone is not a root: near -1 the NPV blows up while
+                # the steps shrink. Rows whose NPV is not ~0 go to the fallback.
+                resid = np.abs(_npv(r[done], times[done], amounts[done]))
+                root = resid <= XIRR_NPV_TOL * np.abs(amounts[done]).sum(axis=1)
+                converged[done[root]] = True
+                failed[done[~root]] = True
+
+    return r, converged
+
+
+def _xirr_bracketed(times: np.ndarray, amounts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fallback: scan XIRR_SCAN_GRID for the first NPV sign change, then bisect
+    every bracketed series in lockstep. Returns (rates, found mask).
+    """
+    n = amounts.shape[0]
+    rates = np.full(n, np.nan)
+
+    with np.errstate(all="ignore"):
+        grid_npv = np.column_stack([_npv(np.full(n, g), times, amounts) for g in XIRR_SCAN_GRID])
+
+    sign = np.sign(grid_npv)
+    exact = sign == 0
+    crossing = (sign[:, :-1] * sign[:, 1:]) < 0
+
+    has_exact = exact.any(axis=1)
+    rates[has_exact] = XIRR_SCAN_GRID[exact.argmax(axis=1)[has_exact]]
+
+    todo = np.flatnonzero(~has_exact & crossing.any(axis=1))
+    if todo.size:
+        j = crossing[todo].argmax(axis=1)
+        lo, hi = XIRR_SCAN_GRID[j].copy(), XIRR_SCAN_GRID[j + 1].copy()
+        t, a = times[todo], amounts[todo]
+        f_lo = _npv(lo, t, a)
+        with np.errstate(all="ignore"):
+            for _ in range(XIRR_MAX_BISECT):
+                mid = 0.5 * (lo + hi)
+                f_mid = _npv(mid, t, a)
+                left = np.sign(f_mid) == np.sign(f_lo)
+                lo = np.where(left, mid, lo)
+                f_lo = np.where(left, f_mid, f_lo)
+                hi = np.where(left, hi, mid)
+                if np.all(hi - lo <= XIRR_TOL * np.maximum(1.0, np.abs(lo))):
+                    break
+        rates[todo] = 0.5 * (lo + hi)
+
+    return rates, np.isfinite(rates)
+
+
+def solve_xirr(times: np.ndarray, amounts: np.ndarray, guess: float = XIRR_GUESS) -> XirrResult:
+    """
+    Solve XIRR for every row of pre-packed (times, amounts) arrays.
+    Newton with the analytic derivative first; rows that diverge or leave the
+    valid domain fall back to a bracket scan + bisection.
+    """
+    n = amounts.shape[0]
+    rates = np.full(n, np.nan)
+    status = np.full(n, XIRR_NO_ROOT, dtype=object)
+
+    has_pos = (amounts > 0).any(axis=1)
+    has_neg = (amounts < 0).any(axis=1)
+    status[~(has_pos | has_neg)] = XIRR_EMPTY
+    status[(has_pos ^ has_neg)] = XIRR_NO_SIGN_CHANGE
+
+    idx = np.flatnonzero(has_pos & has_neg)
+    if idx.size == 0:
+        return XirrResult(rates, status)
+
+    r, ok = _xirr_newton(times[idx], amounts[idx], guess)
+    rates[idx[ok]] = r[ok]
+    status[idx[ok]] = XIRR_OK
+
+    rest = idx[~ok]
+    if rest.size:
+        r, ok = _xirr_bracketed(times[rest], amounts[rest])
+        rates[rest[ok]] = r[ok]
+        status[rest[ok]] = XIRR_OK
+
+    return XirrResult(rates, status)
+
+
+def xirr_batch(series: Sequence[Sequence[Tuple[date, float]]], guess: float = XIRR_GUESS,
+               day_count: str = DEFAULT_DAY_COUNT) -> XirrResult:
+    times, amounts = xirr_arrays(series, day_count)
+    return solve_xirr(times, amounts, guess)
+
+
+def xnpv(rate: float, cfs: List[Tuple[date, float]], day_count: str = DEFAULT_DAY_COUNT) -> float:
+    if rate <= -0.999999999:
+        return float("inf")
+    times, amounts = xirr_arrays([cfs], day_count)
+    return float(_npv(np.array([rate]), times, amounts)[0])
+
+
+def xirr(cfs: List[Tuple[date, float]], day_count: str = DEFAULT_DAY_COUNT) -> float:
+    res = xirr_batch([cfs], day_count=day_count)
+    if res.status[0] != XIRR_OK:
+        raise ValueError(f"XIRR has no solution for these cash flows ({res.status[0]})")
+    return float(res.rates[0])
+
+
+# ============================================================
+# STATE (deal and partner balances, vectorized ledger)
+# ============================================================
+# A deal's partners live in one PartnerLedger: a float array per balance (one
+# slot per partner) and an append-only flow log of (slot, date ordinal, amount)
+# in growable arrays. PartnerState is a thin view of one slot, so scalar code
+# and the vectorized replay share the same storage.
+LEDGER_MIN_CAPACITY = 16
+
+
+class PartnerLedger:
+    """Struct-of-arrays partner balances and IRR cash flows."""
+
+    __slots__ = ("codes", "principal", "pref_accrued", "pref_capitalized", "_owner", "_ords", "_amounts", "n_flows")
+
+    def __init__(self):
+        self.codes: List[str] = []
+        self.principal = np.zeros(0)
+        self.pref_accrued = np.zeros(0)
+        self.pref_capitalized = np.zeros(0)
+        self._owner = np.empty(LEDGER_MIN_CAPACITY, dtype=np.int64)
+        self._ords = np.empty(LEDGER_MIN_CAPACITY, dtype=np.int64)
+        self._amounts = np.empty(LEDGER_MIN_CAPACITY, dtype=float)
+        self.n_flows = 0
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def add_partner(self, code: str) -> int:
+        self.codes.append(code)
+        self.principal = np.append(self.principal, 0.0)
+        self.pref_accrued = np.append(self.pref_accrued, 0.0)
+        self.pref_capitalized = np.append(self.pref_capitalized, 0.0)
+        return len(self.codes) - 1
+
+    def append(self, slot, ords, amounts):
+        """Append flows; slot and ords may be scalars or one per amount."""
+        amounts = np.atleast_1d(np.asarray(amounts, dtype=float))
+        end = self.n_flows + len(amounts)
+        if end > len(self._amounts):
+            capacity = max(end, 2 * len(self._amounts))
+            for name in ("_owner", "_ords", "_amounts"):
+                old = getattr(self, name)
+                grown = np.empty(capacity, dtype=old.dtype)
+                grown[:self.n_flows] = old[:self.n_flows]
+                setattr(self, name, grown)
+        self._owner[self.n_flows:end] = slot
+        self._ords[self.n_flows:end] = ords
+        self._amounts[self.n_flows:end] = amounts
+        self.n_flows = end
+
+    def flows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(slot, date ordinal, amount) views of the flow log in append order (no copy)."""
+        n = self.n_flows
+        return self._owner[:n], self._ords[:n], self._amounts[:n]
+
+    def partner_flows(self, slot: int) -> Tuple[np.ndarray, np.ndarray]:
+        owner, ords, amounts = self.flows()
+        mine = owner == slot
+        return ords[mine], amounts[mine]
+
+    def snapshot(self) -> PartnerLedger:
+        """Independent copy (flow log trimmed to its length)."""
+        out = PartnerLedger()
+        out.codes = list(self.codes)
+        out.principal = self.principal.copy()
+        out.pref_accrued = self.pref_accrued.copy()
+        out.pref_capitalized = self.pref_capitalized.copy()
+        out.n_flows = 0
+        out.append(*self.flows())
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__slots__[1:-1])
+
+
+def _ledger_slot(name: str) -> property:
+    def get(self) -> float:
+        return float(getattr(self.ledger, name)[self.slot])
+
+    def set(self, value: float):
+        getattr(self.ledger, name)[self.slot] = value
+
+    return property(get, set)
+
+
+class PartnerState:
+    """View of one partner's slot in a PartnerLedger (a standalone partner gets its own)."""
+
+    __slots__ = ("ledger", "slot")
+
+    def __init__(self, ledger: Optional[PartnerLedger] = None, slot: int = 0):
+        if ledger is None:
+            ledger = PartnerLedger()
+            slot = ledger.add_partner("")
+        self.ledger = ledger
+        self.slot = slot
+
+    principal = _ledger_slot("principal")
+    pref_accrued = _ledger_slot("pref_accrued")
+    pref_capitalized = _ledger_slot("pref_capitalized")
+
+    @property
+    def irr_cashflows(self) -> List[Tuple[date, float]]:
+        """The partner's flows as (date, amount) tuples (a copy; append with add_flow)."""
+        ords, amounts = self.ledger.partner_flows(self.slot)
+        return [(date.fromordinal(int(o)), float(a)) for o, a in zip(ords, amounts)]
+
+    def add_flow(self, d: date, amount: float):
+        self.ledger.append(self.slot, d.toordinal(), amount)
+
+    def base(self) -> float:
+        return self.principal + self.pref_capitalized
+
+
+@dataclass
+class DealState:
+    vcode: str
+    last_event_date: date
+    ledger: PartnerLedger = field(default_factory=PartnerLedger)
+    partners: Dict[str, PartnerState] = field(default_factory=dict)  # PropCode -> view into ledger
+    day_counts: Dict[str, str] = field(default_factory=dict)         # PropCode -> pref accrual convention
+
+    def add_partner(self, code: str) -> PartnerState:
+        ps = PartnerState(self.ledger, self.ledger.add_partner(code))
+        self.partners[code] = ps
+        return ps
+
+    def snapshot(self) -> DealState:
+        """Independent copy, e.g. to resume a replay without touching a cached state."""
+        ledger = self.ledger.snapshot()
+        return DealState(self.vcode, self.last_event_date, ledger,
+                         {code: PartnerState(ledger, j) for j, code in enumerate(ledger.codes)},
+                         dict(self.day_counts))
+
+    def partner_day_counts(self) -> List[str]:
+        """Accrual convention per ledger slot."""
+        return [self.day_counts.get(p, DEFAULT_DAY_COUNT) for p in self.ledger.codes]
+
+    @property
+    def nbytes(self) -> int:
+        return self.ledger.nbytes
+
+
+def ledger_flows(states: Sequence[DealState]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flow logs of many deals as one (partner, ordinal, amount) log, partners
+    numbered across deals in state / ledger slot order.
+    """
+    if not states:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    offsets = np.cumsum([0] + [len(s.ledger) for s in states[:-1]])
+    logs = [s.ledger.flows() for s in states]
+    return (
+        np.concatenate([owner + off for (owner, _, _), off in zip(logs, offsets)]),
+        np.concatenate([ords for _, ords, _ in logs]),
+        np.concatenate([amounts for _, _, amounts in logs]),
+    )
+
+
+# ============================================================
+# ACCRUAL / COMPOUNDING (pref accrual, year-end capitalization)
+# ============================================================
+def compound_year_end(deal: DealState):
+    led = deal.ledger
+    led.pref_capitalized += led.pref_accrued
+    led.pref_accrued[:] = 0.0
+
+
+def partner_year_fractions(conventions: Sequence[str], start: np.ndarray, end: np.ndarray) -> np.ndarray:
+    """(segments, partners) year fractions, each partner under its own convention."""
+    out = np.empty((len(start), len(conventions)))
+    conv = np.asarray(conventions, dtype=object)
+    for c in set(conventions):
+        out[:, conv == c] = year_fraction(start, end, c)[:, None]
+    return out
+
+
+def accrue_to(deal: DealState, new_date: date, pref_rates: Dict[str, float]):
+    d0, d1 = deal.last_event_date, new_date
+    if d1 <= d0:
+        return
+
+    _, seg_from, seg_to, at_year_end = year_end_splits(np.array([d0.toordinal()]), np.array([d1.toordinal()]))
+    yf = partner_year_fractions(deal.partner_day_counts(), seg_from, seg_to)
+    led = deal.ledger
+    rates = np.array([pref_rates.get(p, 0.0) for p in led.codes], dtype=float)
+
+    for k in range(len(seg_to)):
+        led.pref_accrued += (led.principal + led.pref_capitalized) * rates * yf[k]
+
+        if at_year_end[k]:
+            compound_year_end(deal)
+
+
+def partner_irrs(deals: Iterable[DealState], day_count: str = DEFAULT_DAY_COUNT) -> pd.DataFrame:
+    """
+    XIRR for every partner of every deal in one batched solve.
+    Returns one row per (vcode, partner) with columns: vcode, PropCode, XIRR, status.
+    """
+    deals = list(deals)
+    vcodes = [d.vcode for d in deals for _ in d.ledger.codes]
+    codes = [p for d in deals for p in d.ledger.codes]
+
+    times, amounts = pack_flows(*ledger_flows(deals), len(codes), day_count)
+    res = solve_xirr(times, amounts)
+    return pd.DataFrame({
+        "vcode": vcodes,
+        "PropCode": codes,
+        "XIRR": res.rates,
+        "status": res.status,
+    })
+
+
+# ============================================================
+# ACCOUNTING INGESTION (historical replay into deal state)
+# ============================================================
+def map_bucket(flag):
+    return "capital" if str(flag).upper() == "Y" else "pref"
+
+
+def apply_txn(ps: PartnerState, d: date, amt: float, bucket: str):
+    # NOTE: accounting-feed sign conventions will be finalized later.
+    ps.add_flow(d, amt)
+
+    if bucket == "capital":
+        ps.principal += -amt if amt < 0 else -min(amt, ps.principal)
+    else:
+        if amt > 0:
+            pay = min(amt, ps.pref_accrued)
+            ps.pref_accrued -= pay
+            ps.pref_capitalized -= (amt - pay)
+        else:
+            ps.pref_accrued += -amt
+
+
+def plan_deal_state(plan: WaterfallPlan) -> DealState:
+    """Fresh DealState for a compiled plan: one ledger slot per PropCode, starting at the plan's start date."""
+    state = DealState(plan.vcode, plan.start_date)
+    for p in plan.codes:
+        state.add_partner(p)
+    state.day_counts.update(plan.day_counts)
+    return state
+
+
+def init_deal_state(vcode: str, wf_d: pd.DataFrame) -> Tuple[DealState, Dict[str, float]]:
+    """
+    Fresh DealState (one partner per PropCode, starting at the earliest
+    dteffective) and per-partner pref rates from a deal's waterfall steps.
+    An optional vDayCount on a pref step sets that partner's accrual convention
+    (see daycount.day_count; default Actual/365 Fixed).
+    """
+    plan = compile_waterfall(vcode, wf_d)
+    return plan_deal_state(plan), plan.pref_rates
+
+
+def replay_accounting(state: DealState, acct_d: pd.DataFrame, pref_rates: Dict[str, float]):
+    """
+    Scalar reference replay: accrue_to + apply_txn for each accounting row,
+    in EffectiveDate order (feed order within a date).
+    """
+    if acct_d.empty or "EffectiveDate" not in acct_d.columns or "InvestorID" not in acct_d.columns:
+        return
+
+    acct_d = acct_d.assign(
+        EffectiveDate=pd.to_datetime(acct_d["EffectiveDate"]).dt.date,
+        InvestorID=acct_d["InvestorID"].astype(str),
+    )
+
+    for _, r in acct_d.sort_values("EffectiveDate", kind="stable").iterrows():
+        d = r["EffectiveDate"]
+        accrue_to(state, d, pref_rates)
+
+        inv_id = r["InvestorID"]
+        if inv_id in state.partners:
+            apply_txn(
+                state.partners[inv_id],
+                d,
+                float(r.get("Amt", 0.0)),
+                map_bucket(r.get("Capital", "Y")),
+            )
+
+        state.last_event_date = d
+
+
+def replay_deal(vcode: str, wf_d: pd.DataFrame, acct_d: pd.DataFrame) -> Tuple[DealState, WaterfallPlan, pd.DataFrame]:
+    """compile_waterfall + replay_ledger for one deal: (state, plan, ledger)."""
+    plan = compile_waterfall(vcode, wf_d)
+    state = plan_deal_state(plan)
+    ledger = replay_ledger([state], {state.vcode: plan.pref_rates}, acct_d)
+    return state, plan, ledger
+
+
+# ============================================================
+# VECTORIZED LEDGER REPLAY (event sweep across all deals)
+# ============================================================
+# Same semantics as replay_accounting, without the per-row / per-partner Python
+# loop. Every deal walks its own timeline of points -- its distinct
+# EffectiveDates plus the year-end compounding points accrue_to would insert
+# between them -- and all deals advance through their timelines in lockstep,
+# one array update over every partner per point. Same-day transactions of one
+# partner are applied in successive layers, preserving feed order.
+LEDGER_COLUMNS = [
+    "vcode", "PropCode", "EffectiveDate", "Amt", "bucket",
+    "principal", "pref_accrued", "pref_capitalized",
+]
+
+
+def replay_ledger(states: Sequence[DealState], pref_rates: Dict[str, Dict[str, float]],
+                  acct: pd.DataFrame) -> pd.DataFrame:
+    """
+    Vectorized replay_accounting for many deals in one pass.
+
+    states:     DealStates to advance in place (fresh from init_deal_state, or resumed)
+    pref_rates: vcode -> {PropCode: rate}
+    acct:       control-joined accounting rows (must carry vcode); rows for other deals are ignored
+
+    Returns the per-transaction trajectory (LEDGER_COLUMNS): each partner
+    transaction with that partner's balances right after it is applied.
+    """
+    needed = ("vcode", "EffectiveDate", "InvestorID")
+    if not states or acct.empty or any(c not in acct.columns for c in needed):
+        return pd.DataFrame(columns=LEDGER_COLUMNS)
+
+    deal_pos = {s.vcode: g for g, s in enumerate(states)}
+    g_row = pd.Series(id_strings(acct["vcode"]), index=acct.index).map(deal_pos)
+    keep = g_row.notna().to_numpy()
+    if not keep.any():
+        return pd.DataFrame(columns=LEDGER_COLUMNS)
+
+    rows = acct.loc[keep]
+    g_row = g_row[keep].to_numpy(dtype=np.int64)
+    ord_row = to_ordinals(rows["EffectiveDate"])
+    order = np.lexsort((ord_row, g_row))  # deal, then date; stable -> feed order within a date
+    rows, g_row, ord_row = rows.iloc[order], g_row[order], ord_row[order]
+
+    amt_row = rows["Amt"].astype(float).to_numpy() if "Amt" in rows.columns else np.zeros(len(rows))
+    if "Capital" in rows.columns:
+        cap_row = rows["Capital"].astype(str).str.upper().eq("Y").fillna(False).to_numpy(dtype=bool)
+    else:
+        cap_row = np.ones(len(rows), dtype=bool)
+
+    # ---- partners, flattened across deals (ledger slot order)
+    n_part = np.array([len(s.ledger) for s in states], dtype=np.int64)
+    part_offset = np.cumsum(n_part) - n_part
+    g_part = np.repeat(np.arange(len(states)), n_part)
+    p_part = [p for s in states for p in s.ledger.codes]
+    rate = np.array([pref_rates.get(states[g].vcode, {}).get(p, 0.0) for g, p in zip(g_part, p_part)], dtype=float)
+    P = np.concatenate([s.ledger.principal for s in states])
+    A = np.concatenate([s.ledger.pref_accrued for s in states])
+    C = np.concatenate([s.ledger.pref_capitalized for s in states])
+
+    # ---- distinct (deal, date) pairs and the date each one accrues from
+    new_pair = np.ones(len(rows), dtype=bool)
+    new_pair[1:] = (g_row[1:] != g_row[:-1]) | (ord_row[1:] != ord_row[:-1])
+    pair_of_row = np.cumsum(new_pair) - 1
+    ug, ut = g_row[new_pair], ord_row[new_pair]
+
+    first_of_deal = np.ones(len(ug), dtype=bool)
+    first_of_deal[1:] = ug[1:] != ug[:-1]
+    start = np.array([s.last_event_date.toordinal() for s in states], dtype=np.int64)
+    prev = np.where(first_of_deal, start[ug], np.roll(ut, 1))
+    accrue = ut > prev
+
+    # ---- timeline points per pair: the year-ends strictly inside its accruing
+    # gap (compounding points), then the date itself; one year-fraction row per
+    # accrual convention in use
+    pt_pair, pt_from, pt_ord, pt_compound = year_end_splits(prev, ut)
+    n_pts = np.bincount(pt_pair, minlength=len(ug))
+    conventions = sorted({c for s in states for c in s.partner_day_counts()})
+    pt_yf = np.stack([np.where(accrue[pt_pair], year_fraction(pt_from, pt_ord, c), 0.0) for c in conventions])
+    pt_deal = ug[pt_pair]
+
+    deal_starts = np.flatnonzero(np.r_[True, pt_deal[1:] != pt_deal[:-1]])
+    pt_step = np.arange(len(pt_deal)) - np.repeat(deal_starts, np.diff(np.r_[deal_starts, len(pt_deal)]))
+    n_steps = int(pt_step.max()) + 1
+
+    # ---- partner transactions: timeline step + same-day layer
+    part_index = pd.MultiIndex.from_arrays([g_part, np.asarray(p_part, dtype=object)])
+    j_row = part_index.get_indexer(
+        pd.MultiIndex.from_arrays([g_row, id_strings(rows["InvestorID"])])
+    )
+    tx = np.flatnonzero(j_row >= 0)
+    date_pt_of_pair = np.cumsum(n_pts) - 1
+    tx_step = pt_step[date_pt_of_pair[pair_of_row[tx]]]
+    tx_layer = pd.Series(tx).groupby([j_row[tx], pair_of_row[tx]], sort=False).cumcount().to_numpy()
+    tx_order = np.lexsort((tx_layer, tx_step))
+    tx_bounds = np.searchsorted(tx_step[tx_order], np.arange(n_steps + 1))
+
+    pt_order = np.argsort(pt_step, kind="stable")
+    pt_bounds = np.searchsorted(pt_step[pt_order], np.arange(n_steps + 1))
+
+    led_P = np.empty(len(tx))
+    led_A = np.empty(len(tx))
+    led_C = np.empty(len(tx))
+
+    conv_part = np.array([conventions.index(c) for s in states for c in s.partner_day_counts()], dtype=np.int64)
+    yf_deal = np.zeros((len(conventions), len(states)))
+    comp_deal = np.zeros(len(states), dtype=bool)
+
+    for k in range(n_steps):
+        pts = pt_order[pt_bounds[k]:pt_bounds[k + 1]]
+
+        yf_deal[:] = 0.0
+        yf_deal[:, pt_deal[pts]] = pt_yf[:, pts]
+        yf = yf_deal[conv_part, g_part]
+        A = np.where(yf > 0, A + (P + C) * rate * yf, A)
+
+        comp = pts[pt_compound[pts]]
+        if comp.size:
+            comp_deal[:] = False
+            comp_deal[pt_deal[comp]] = True
+            m = comp_deal[g_part]
+            C = np.where(m, C + A, C)
+            A = np.where(m, 0.0, A)
+
+        step_tx = tx_order[tx_bounds[k]:tx_bounds[k + 1]]
+        if step_tx.size == 0:
+            continue
+        layers = tx_layer[step_tx]
+        cuts = np.flatnonzero(np.r_[True, layers[1:] != layers[:-1], True])
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            t = step_tx[a:b]
+            rt = tx[t]
+            j = j_row[rt]
+            amt, cap = amt_row[rt], cap_row[rt]
+            Pj, Aj, Cj = P[j], A[j], C[j]
+
+            pay = np.minimum(amt, Aj)
+            pos = ~cap & (amt > 0)
+            neg = ~cap & ~(amt > 0)
+            P[j] = np.where(cap, Pj + np.where(amt < 0, -amt, -np.minimum(amt, Pj)), Pj)
+            A[j] = np.where(pos, Aj - pay, np.where(neg, Aj + -amt, Aj))
+            C[j] = np.where(pos, Cj - (amt - pay), Cj)
+
+            led_P[t], led_A[t], led_C[t] = P[j], A[j], C[j]
+
+    # ---- write back: balances by slice, flows appended per deal (rows are grouped by deal)
+    for g, s in enumerate(states):
+        sl = slice(part_offset[g], part_offset[g] + n_part[g])
+        s.ledger.principal[:] = P[sl]
+        s.ledger.pref_accrued[:] = A[sl]
+        s.ledger.pref_capitalized[:] = C[sl]
+
+    j_tx = j_row[tx]
+    g_tx = g_part[j_tx]
+    # No partner rows at all (e.g. InvestorIDs that match no PropCode): nothing to append
+    cuts = np.flatnonzero(np.r_[True, g_tx[1:] != g_tx[:-1], True]) if tx.size else np.zeros(1, dtype=np.int64)
+    for a, b in zip(cuts[:-1], cuts[1:]):
+        g = g_tx[a]
+        states[g].ledger.append(j_tx[a:b] - part_offset[g], ord_row[tx[a:b]], amt_row[tx[a:b]])
+
+    last_pair = np.r_[np.flatnonzero(ug[1:] != ug[:-1]), len(ug) - 1]
+    for g, o in zip(ug[last_pair], ut[last_pair]):
+        states[g].last_event_date = date.fromordinal(int(o))
+
+    return pd.DataFrame({
+        "vcode": [states[g].vcode for g in g_part[j_tx]],
+        "PropCode": [p_part[j] for j in j_tx],
+        "EffectiveDate": (ord_row[tx] - EPOCH_ORDINAL).astype("datetime64[D]"),
+        "Amt": amt_row[tx],
+        "bucket": np.where(cap_row[tx], "capital", "pref"),
+        "principal": led_P,
+        "pref_accrued": led_A,
+        "pref_capitalized": led_C,
+    })
+
+
+# ============================================================
+# LOADERS + SIGN NORMALIZATION
+# ============================================================
+def load_coa(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    coa.csv headers (per your feed):
+      vcode, vdescription, vtype, iNOI, vMisc, vAccountType
+
+    Join rule:
+      coa.vcode == forecast_feed.vAccount == accounting_feed.TypeID
+
+    NOTE: iNOI is ignored in all calculations per your request.
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+
+    if "vcode" not in df.columns:
+        raise ValueError("coa.csv is missing required column: vcode")
+
+    df = df.rename(columns={"vcode": "vAccount"})
+    df["vAccount"] = pd.to_numeric(df["vAccount"], errors="coerce").astype("Int64")
+
+    if "vAccountType" not in df.columns:
+        df["vAccountType"] = ""
+    df["vAccountType"] = df["vAccountType"].fillna("").astype(str).str.strip()
+
+    return df[["vAccount", "vAccountType"]]
+
+
+# In-memory dtypes: identifiers are categoricals with string categories (one
+# Python string per distinct value, int codes per row), dates are datetime64.
+# Python date objects / per-row strings are only made at the display edge.
+def categorical_ids(values: pd.Series) -> pd.Series:
+    """Identifier column as a categorical of strings (categories converted, not rows)."""
+    cat = values.astype("category")
+    return cat.cat.rename_categories([str(v) for v in cat.cat.categories])
+
+
+def id_strings(values: pd.Series) -> np.ndarray:
+    """Object array of per-row id strings ("nan" where missing); cheap for categoricals."""
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(str).to_numpy(dtype=object)
+    labels = np.append(np.asarray([str(c) for c in values.cat.categories], dtype=object), "nan")
+    return labels[values.cat.codes.to_numpy()]  # code -1 (missing) picks the trailing "nan"
+
+
+def load_investment_map(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df["vcode"] = categorical_ids(df["vcode"])
+    if "InvestmentID" in df.columns:
+        df["InvestmentID"] = categorical_ids(df["InvestmentID"])
+    return df
+
+
+def load_waterfalls(df: pd.DataFrame) -> pd.DataFrame:
+    """Waterfall steps: vcode / PropCode / vState as categoricals, dteffective as datetime64."""
+    df = df.copy()
+    for c in ("vcode", "PropCode", "vState"):
+        if c in df.columns:
+            df[c] = categorical_ids(df[c])
+    if "dteffective" in df.columns:
+        df["dteffective"] = pd.to_datetime(df["dteffective"])
+    return df
+
+
+def load_accounting(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    if "EffectiveDate" in df.columns:
+        df["EffectiveDate"] = pd.to_datetime(df["EffectiveDate"])
+    return _compact_accounting_chunk(df)
+
+
+def _compact_accounting_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    # IDs/flags -> category, TypeID -> Int32; Amt stays float64 (money, replay parity)
+    for c in ("InvestmentID", "InvestorID", "Capital"):
+        if c in df.columns:
+            df[c] = categorical_ids(df[c])
+    if "TypeID" in df.columns:
+        df["TypeID"] = pd.to_numeric(df["TypeID"], errors="coerce").astype("Int32")
+    if "Amt" in df.columns:
+        df["Amt"] = pd.to_numeric(df["Amt"], errors="coerce").astype("float64")
+    return df
+
+
+def _concat_chunks(parts: List[pd.DataFrame]) -> pd.DataFrame:
+    out = pd.concat(parts, ignore_index=True)
+    for c in parts[0].columns:
+        if isinstance(parts[0][c].dtype, pd.CategoricalDtype):
+            out[c] = pd.api.types.union_categoricals([p[c] for p in parts])
+    return out
+
+
+def stream_accounting(src, inv: pd.DataFrame, vcodes: Optional[Iterable[str]] = None,
+                      date_from: Optional[date] = None, date_to: Optional[date] = None,
+                      chunksize: int = ACCOUNTING_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Chunked accounting_feed reader with filter pushdown.
+
+    Keeps only rows whose InvestmentID maps (via inv) to one of vcodes -- all
+    mapped deals when None -- and, optionally, EffectiveDate within
+    [date_from, date_to]. Only the columns the pipeline uses are parsed; IDs are
+    read as text (consistent across chunks) and compacted per chunk, so peak
+    memory follows the selected deals rather than the whole ledger.
+    """
+    if hasattr(src, "seek"):
+        src.seek(0)
+
+    if "InvestmentID" not in inv.columns:
+        return pd.DataFrame(columns=ACCOUNTING_READ_COLUMNS)
+    mapped = inv if vcodes is None else inv[inv["vcode"].isin({str(v) for v in vcodes})]
+    wanted = set(mapped["InvestmentID"].astype(str))
+
+    cols = set(ACCOUNTING_READ_COLUMNS)
+    reader = pd.read_csv(
+        src,
+        chunksize=chunksize,
+        usecols=lambda c: str(c).strip() in cols,
+        dtype={"InvestmentID": str, "InvestorID": str, "Capital": str},
+        float_precision="round_trip",
+    )
+
+    parts: List[pd.DataFrame] = []
+    header: List[str] = []
+    for chunk in reader:
+        chunk.columns = [str(c).strip() for c in chunk.columns]
+        header = list(chunk.columns)
+        if "InvestmentID" not in chunk.columns:
+            return pd.DataFrame(columns=header)
+
+        chunk = chunk[chunk["InvestmentID"].isin(wanted)]
+        if (date_from is not None or date_to is not None) and "EffectiveDate" in chunk.columns:
+            eff = pd.to_datetime(chunk["EffectiveDate"])
+            keep = pd.Series(True, index=chunk.index)
+            if date_from is not None:
+                keep &= eff >= pd.Timestamp(date_from)
+            if date_to is not None:
+                keep &= eff <= pd.Timestamp(date_to)
+            chunk = chunk[keep]
+        if chunk.empty:
+            continue
+
+        if "EffectiveDate" in chunk.columns:
+            chunk = chunk.assign(EffectiveDate=pd.to_datetime(chunk["EffectiveDate"]))
+        parts.append(_compact_accounting_chunk(chunk))
+
+    if not parts:
+        return pd.DataFrame(columns=header or ACCOUNTING_READ_COLUMNS)
+    return _concat_chunks(parts)
+
+
+# Read schemas per feed: the pipeline's columns get explicit types in the pyarrow
+# CSV reader, so it never infers them (IDs stay text, e.g. leading zeros).
+# Other columns (and headers with stray whitespace) are inferred.
+FEED_DTYPES: Dict[str, Dict[str, str]] = {
+    "investment_map": {"vcode": "str", "InvestmentID": "str"},
+    "waterfalls": {"vcode": "str", "PropCode": "str", "vState": "str", "nPercent": "float64",
+                   "dteffective": "datetime64[us]"},
+    "coa": {"vcode": "Int64", "vAccountType": "str"},
+    "accounting_feed": {"InvestmentID": "str", "InvestorID": "str", "EffectiveDate": "datetime64[us]",
+                        "TypeID": "Int64", "Amt": "float64", "Capital": "str"},
+    "forecast_feed": {"Vcode": "str", "dtEntry": "datetime64[us]", "vSource": "str", "vAccount": "Int64",
+                      "mAmount": "float64", "Year": "Int64", "Qtr": "Int64", "Date": "datetime64[us]",
+                      "Pro_Yr": "Int64"},
+}
+
+
+def _arrow_type(dtype: str):
+    import pyarrow as pa
+
+    return {"str": pa.string(), "float64": pa.float64(), "Int64": pa.int64(),
+            "datetime64[us]": pa.timestamp("us")}[dtype]
+
+
+def read_feed(name: str, src) -> pd.DataFrame:
+    """
+    Parse one feed CSV (path or file-like) with the multithreaded pyarrow CSV
+    reader, typed by the feed's FEED_DTYPES schema. A file the schema doesn't
+    fit (e.g. text in a numeric column) is re-read with the C parser, keeping
+    only the schema's text columns; the loaders then coerce as before. Both
+    paths parse floats round-trip exact, so they agree to the last bit.
+    """
+    import pyarrow.csv as pa_csv
+
+    schema = FEED_DTYPES.get(name, {})
+    if hasattr(src, "seek"):
+        src.seek(0)
+    try:
+        table = pa_csv.read_csv(src, convert_options=pa_csv.ConvertOptions(
+            column_types={c: _arrow_type(t) for c, t in schema.items()}))
+        df = table.to_pandas()
+        # Nullable ints, and all-empty columns as float64 (as pd.read_csv gives them)
+        fix = {c: t for c, t in schema.items() if c in df.columns and t == "Int64"}
+        fix.update({f.name: "float64" for f in table.schema if str(f.type) == "null"})
+        return df.astype(fix)
+    except ValueError:
+        if hasattr(src, "seek"):
+            src.seek(0)
+        return pd.read_csv(src, dtype={c: t for c, t in schema.items() if t == "str"}, float_precision="round_trip")
+
+
+def read_feeds(sources: Dict[str, object], names: Sequence[str]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, float]]:
+    """
+    Parse several feeds concurrently, one thread each (the pyarrow engine
+    releases the GIL), so the total approaches the largest file's parse time.
+    Returns (name -> frame, name -> parse seconds).
+    """
+    def timed(name: str):
+        t0 = time.perf_counter()
+        df = read_feed(name, sources[name])
+        return df, time.perf_counter() - t0
+
+    if not names:
+        return {}, {}
+    with ThreadPoolExecutor(max_workers=len(names)) as pool:
+        done = dict(zip(names, pool.map(timed, names)))
+    return {n: df for n, (df, _) in done.items()}, {n: sec for n, (_, sec) in done.items()}
+
+
+def classify_accounts(vaccount: pd.Series) -> pd.Series:
+    """Categorical account class (ACCOUNT_CLASSES) per row, via one ACCOUNT_CLASS_TABLE lookup."""
+    pos = ACCOUNT_CLASS_TABLE.index.get_indexer(pd.to_numeric(vaccount, errors="coerce"))
+    codes = np.where(pos >= 0, ACCOUNT_CLASS_TABLE.to_numpy()[pos], 0).astype(np.int8)
+    return pd.Series(pd.Categorical.from_codes(codes, ACCOUNT_CLASSES), index=vaccount.index, name="acct_class")
+
+
+def account_class_codes(fc: pd.DataFrame) -> np.ndarray:
+    """int8 class codes of fc's rows: the load-time acct_class column, or classified from vAccount."""
+    cls = fc["acct_class"] if "acct_class" in fc.columns else classify_accounts(fc["vAccount"])
+    return cls.cat.codes.to_numpy()
+
+
+def signed_amounts(amount: pd.Series, codes: np.ndarray) -> np.ndarray:
+    base = pd.to_numeric(amount, errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    sign = ACCOUNT_CLASS_SIGN[codes]
+    return np.where(sign == 0, base, sign * np.abs(base))
+
+
+def normalize_forecast_signs(fc: pd.DataFrame) -> pd.DataFrame:
+    """
+    Deal-agnostic normalization by account class:
+
+      - Gross Revenue accounts: +abs(mAmount)
+      - Contra-Revenue (vacancy/concessions): -abs(mAmount)
+      - Expense accounts: -abs(mAmount)
+      - Interest/Principal/Capex/Other excluded: -abs(mAmount)
+      - Other accounts: leave as-is (for future expansion)
+
+    load_forecast already applies this; returns fc plus acct_class / mAmount_norm
+    columns (fc itself is not modified).
+    """
+    cls = fc["acct_class"] if "acct_class" in fc.columns else classify_accounts(fc["vAccount"])
+    return fc.assign(acct_class=cls, mAmount_norm=signed_amounts(fc["mAmount"], cls.cat.codes.to_numpy()))
+
+
+def load_forecast(df: pd.DataFrame, coa: pd.DataFrame, pro_yr_base: int) -> pd.DataFrame:
+    """
+    Forecast feed columns (per your feed):
+      Vcode, dtEntry, vSource, vAccount, mAmount, Year, Qtr, Date, Pro_Yr
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+
+    df = df.rename(columns={"Vcode": "vcode", "Date": "event_date"})
+    df["vcode"] = categorical_ids(df["vcode"])
+
+    df["event_date"] = pd.to_datetime(df["event_date"])
+    # Pass-through feed columns, kept compact as well
+    if "dtEntry" in df.columns:
+        df["dtEntry"] = pd.to_datetime(df["dtEntry"], errors="coerce")
+    if "vSource" in df.columns:
+        df["vSource"] = categorical_ids(df["vSource"])
+    df["vAccount"] = pd.to_numeric(df["vAccount"], errors="coerce").astype("Int64")
+    df["mAmount"] = pd.to_numeric(df["mAmount"], errors="coerce").fillna(0.0)
+
+    df["Year"] = (int(pro_yr_base) + pd.to_numeric(df["Pro_Yr"], errors="coerce")).astype("Int64")
+
+    # Join to COA (optional: for labeling / future use)
+    df = df.merge(coa, on="vAccount", how="left")
+    df["vAccountType"] = df["vAccountType"].fillna("").astype("category")
+
+    # Classify once; sign normalization (and later aggregation) index by the code
+    df["acct_class"] = classify_accounts(df["vAccount"])
+    df["mAmount_norm"] = signed_amounts(df["mAmount"], df["acct_class"].cat.codes.to_numpy())
+    return df
+
+
+# ============================================================
+# ANNUAL AGGREGATION (Revenues → FAD by year) using explicit sets
+# ============================================================
+# Base line items and the account sets that feed them (sets are disjoint)
+LINE_ITEM_ACCOUNTS = {
+    # Revenues include gross + contra (contra already negative after normalization)
+    "Revenues": GROSS_REVENUE_ACCTS | CONTRA_REVENUE_ACCTS,
+    "Expenses": EXPENSE_ACCTS,
+    "Interest": INTEREST_ACCTS,
+    "Principal": PRINCIPAL_ACCTS,
+    "Capital Expenditures": CAPEX_ACCTS,
+    "Excluded Accounts": OTHER_EXCLUDED_ACCTS,
+}
+
+LINE_ITEMS = list(LINE_ITEM_ACCOUNTS)
+
+# Account class -> line item it feeds; as codes -> position in LINE_ITEMS (-1: not in the table)
+CLASS_LINE_ITEMS = {
+    "gross_revenue": "Revenues",
+    "contra_revenue": "Revenues",
+    "expense": "Expenses",
+    "interest": "Interest",
+    "principal": "Principal",
+    "capex": "Capital Expenditures",
+    "excluded": "Excluded Accounts",
+}
+CLASS_LINE_ITEM = np.array(
+    [LINE_ITEMS.index(CLASS_LINE_ITEMS[c]) if c in CLASS_LINE_ITEMS else -1 for c in ACCOUNT_CLASSES],
+    dtype=np.int8,
+)
+
+
+def derive_annual_lines(base: pd.DataFrame) -> pd.DataFrame:
+    """
+    Build the ordered line-item columns from the six base sums
+    (NaN where an item has no rows). Works for any index (Year or vcode × Year).
+    """
+    out = pd.DataFrame(index=base.index)
+
+    out["Revenues"] = base["Revenues"]
+    out["Expenses"] = base["Expenses"]
+
+    # Expenses are normalized negative; NOI = Revenues + Expenses
+    out["NOI"] = out["Revenues"].fillna(0.0) + out["Expenses"].fillna(0.0)
+
+    out["Interest"] = base["Interest"]
+    out["Principal"] = base["Principal"]
+    out["Total Debt Service"] = out["Interest"].fillna(0.0) + out["Principal"].fillna(0.0)
+
+    out["Excluded Accounts"] = base["Excluded Accounts"]
+    out["Capital Expenditures"] = base["Capital Expenditures"]
+
+    # Interest/Principal/Excluded/Capex are normalized negative outflows:
+    out["Funds Available for Distribution"] = (
+        out["NOI"].fillna(0.0)
+        + out["Interest"].fillna(0.0)
+        + out["Principal"].fillna(0.0)
+        + out["Excluded Accounts"].fillna(0.0)
+        + out["Capital Expenditures"].fillna(0.0)
+    )
+
+    # DSCR = NOI / |Total Debt Service|
+    tds_abs = out["Total Debt Service"].abs().replace(0, pd.NA)
+    out["Debt Service Coverage Ratio"] = out["NOI"] / tds_abs
+
+    return out
+
+
+def line_item_sums(fc: pd.DataFrame, years: List[int], by_deal: bool = False) -> pd.Series:
+    """
+    mAmount_norm summed per (Year, line item) -- per (vcode, Year, line item)
+    with by_deal -- for rows in years, in one grouped pass keyed by class code.
+    """
+    year = fc["Year"].to_numpy(dtype=np.int64, na_value=-1)
+    item = CLASS_LINE_ITEM[account_class_codes(fc)]
+    keep = (item >= 0) & (year >= years[0]) & (year <= years[-1]) if years else np.zeros(len(fc), dtype=bool)
+
+    keys = [year[keep], pd.Categorical.from_codes(item[keep], LINE_ITEMS)]
+    if by_deal:
+        keys.insert(0, id_strings(fc["vcode"])[keep])
+    return pd.Series(fc["mAmount_norm"].to_numpy(dtype=float)[keep]).groupby(keys, observed=True).sum()
+
+
+def annual_aggregation_table(fc_deal: pd.DataFrame, start_year: int, horizon_years: int) -> pd.DataFrame:
+    years = list(range(int(start_year), int(start_year) + int(horizon_years)))
+    sums = line_item_sums(fc_deal, years)
+
+    base = pd.DataFrame(index=pd.Index(years, name="Year"), columns=LINE_ITEMS, dtype=float)
+    if len(sums):
+        base = sums.unstack().reindex(index=base.index, columns=LINE_ITEMS)
+
+    out = derive_annual_lines(base)
+    out = out.reset_index().fillna(0.0)
+    return out
+
+
+def portfolio_annual_aggregation(fc: pd.DataFrame, start_year: int, horizon_years: int,
+                                 vcodes: Iterable[str] = None) -> pd.DataFrame:
+    """
+    annual_aggregation_table for every deal at once: one account→line-item map
+    and a single (vcode, Year, line item) grouped sum over the whole forecast.
+
+    Returns a tidy frame with one row per (vcode, Year) and the same columns as
+    annual_aggregation_table; deals without rows in the window get zeros.
+    vcodes defaults to every deal in the forecast.
+    """
+    years = list(range(int(start_year), int(start_year) + int(horizon_years)))
+    sums = line_item_sums(fc, years, by_deal=True)
+
+    if vcodes is None:
+        vcodes = sorted(set(id_strings(fc["vcode"])))
+    full = pd.MultiIndex.from_product([[str(v) for v in vcodes], years], names=["vcode", "Year"])
+    if len(sums):
+        base = sums.unstack().reindex(index=full, columns=LINE_ITEMS)
+    else:
+        base = pd.DataFrame(index=full, columns=LINE_ITEMS, dtype=float)
+
+    out = derive_annual_lines(base)
+    out = out.reset_index().fillna(0.0)
+    # Zero debt service (pd.NA divisor) leaves DSCR as object dtype; values are already floats
+    out["Debt Service Coverage Ratio"] = out["Debt Service Coverage Ratio"].astype(float)
+    return out
+
+
+def pivot_annual_table(df: pd.DataFrame) -> pd.DataFrame:
+    wide = df.set_index("Year").T
+    wide.index.name = "Line Item"
+
+    desired_order = [
+        "Revenues",
+        "Expenses",
+        "NOI",
+        "Interest",
+        "Principal",
+        "Total Debt Service",
+        "Excluded Accounts",
+        "Capital Expenditures",
+        "Funds Available for Distribution",
+        "Debt Service Coverage Ratio",
+    ]
+    existing = [r for r in desired_order if r in wide.index]
+    remainder = [r for r in wide.index if r not in existing]
+    return wide.loc[existing + remainder]
+
+
+@dataclass(frozen=True)
+class RowStyle:
+    decimals: int = 0                 # 0: dollars with commas, 2: ratio
+    bold: bool = False
+    underline: bool = False
+    rule_below: Optional[str] = None  # "double" | "single"
+    rule_above: bool = False          # light separator
+
+
+def annual_row_styles(rows: Sequence[str]) -> Dict[str, RowStyle]:
+    """
+    Formatting rules of the annual table per line item, shared by
+    style_annual_table and the document renderers (report_export):
+      Expenses underlined; NOI bold with a double rule below; a rule under the
+      row before FAD; FAD bold; DSCR two decimals below a light separator.
+    """
+    rows = list(rows)
+    styles = {r: RowStyle() for r in rows}
+    if "Expenses" in styles:
+        styles["Expenses"] = replace(styles["Expenses"], underline=True)
+    if "NOI" in styles:
+        styles["NOI"] = replace(styles["NOI"], bold=True, rule_below="double")
+    if "Funds Available for Distribution" in styles:
+        fad_idx = rows.index("Funds Available for Distribution")
+        if fad_idx > 0:
+            prev_row = rows[fad_idx - 1]
+            styles[prev_row] = replace(styles[prev_row], rule_below="single")
+        styles["Funds Available for Distribution"] = replace(styles["Funds Available for Distribution"], bold=True)
+    if "Debt Service Coverage Ratio" in styles:
+        styles["Debt Service Coverage Ratio"] = replace(styles["Debt Service Coverage Ratio"], decimals=2,
+                                                        rule_above=True)
+    return styles
+
+
+def style_annual_table(df: pd.DataFrame) -> pd.io.formats.style.Styler:
+    # Base formatter: dollars with commas
+    def money_fmt(x):
+        if pd.isna(x):
+            return ""
+        return f"{x:,.0f}"
+
+    # DSCR formatter
+    def dscr_fmt(x):
+        if pd.isna(x):
+            return ""
+        return f"{x:,.2f}"
+
+    styles = annual_row_styles(df.index)
+    styler = df.style.format(money_fmt)
+
+    # Override DSCR row formatting
+    ratio_rows = [r for r, rs in styles.items() if rs.decimals == 2]
+    if ratio_rows:
+        styler = styler.format({col: dscr_fmt for col in df.columns}, subset=pd.IndexSlice[ratio_rows, :])
+
+    # Equal column widths + alignment
+    styler = styler.set_table_styles(
+        [
+            {"selector": "th", "props": [("text-align", "left"), ("width", "220px")]},
+            {"selector": "td", "props": [("text-align", "right"), ("width", "140px")]},
+        ],
+        overwrite=False,
+    )
+
+    # One set_properties per styled row (underline, rules, bold, separator)
+    for row, rs in styles.items():
+        props = {}
+        if rs.underline:
+            props["text-decoration"] = "underline"
+        if rs.rule_below == "double":
+            props["border-bottom"] = "3px double black"
+        elif rs.rule_below == "single":
+            props["border-bottom"] = "2px solid black"
+        if rs.bold:
+            props["font-weight"] = "bold"
+        if rs.rule_above:
+            props["border-top"] = "1px solid #999"
+        if props:
+            styler = styler.set_properties(subset=pd.IndexSlice[[row], :], **props)
+
+    return styler
+
+
+# ============================================================
+# PORTFOLIO ROLL-UP (deals x years per metric, sliced into pages for display)
+# ============================================================
+# Built once per load and report window from portfolio_annual_aggregation and
+# memoized by the caller. Tables hold plain rounded floats (formatting is left
+# to the grid's column config), so showing a page is a row slice rather than a
+# Styler pass over the whole portfolio.
+ROLLUP_METRICS = {"FAD": "Funds Available for Distribution", "NOI": "NOI", "DSCR": "Debt Service Coverage Ratio"}
+ROLLUP_DECIMALS = {"FAD": 0, "NOI": 0, "DSCR": 2}
+ROLLUP_PAGE_SIZES = (25, 50, 100, 250)
+
+
+@dataclass
+class PortfolioRollup:
+    tables: Dict[str, pd.DataFrame]   # metric label -> vcode x Year (column names are str years)
+    totals: pd.DataFrame              # portfolio line items per Year, as annual_aggregation_table
+    annual: pd.DataFrame              # the portfolio_annual_aggregation input (per-deal exports)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(frame_nbytes(t) for t in (*self.tables.values(), self.totals, self.annual))
+
+
+def portfolio_rollup(annual: pd.DataFrame) -> PortfolioRollup:
+    """
+    Roll-up tables from portfolio_annual_aggregation output: one deals x years
+    table per ROLLUP_METRICS entry, plus portfolio totals (line items summed
+    over deals; DSCR re-derived from the summed NOI and debt service).
+    """
+    tables = {}
+    for label, column in ROLLUP_METRICS.items():
+        wide = annual.pivot(index="vcode", columns="Year", values=column).round(ROLLUP_DECIMALS[label])
+        wide.columns = [str(y) for y in wide.columns]
+        tables[label] = wide
+
+    totals = derive_annual_lines(annual.groupby("Year")[LINE_ITEMS].sum()).reset_index().fillna(0.0)
+    totals["Debt Service Coverage Ratio"] = totals["Debt Service Coverage Ratio"].astype(float)
+    return PortfolioRollup(tables, totals, annual)
+
+
+def rollup_page(table: pd.DataFrame, page: int, page_size: int, search: str = "",
+                sort_by: Optional[str] = None, descending: bool = True) -> Tuple[pd.DataFrame, int, int]:
+    """
+    One page (1-based, clamped to the last page) of a roll-up table after an
+    optional vcode substring filter and a sort on one year column (vcode order
+    otherwise). Returns (rows of the page, filtered row count, page count).
+    """
+    if search:
+        table = table[table.index.astype(str).str.contains(search, case=False, regex=False)]
+    if sort_by is not None:
+        table = table.sort_values(sort_by, ascending=not descending, kind="stable")
+
+    n_rows = len(table)
+    n_pages = max(1, -(-n_rows // int(page_size)))
+    page = min(max(int(page), 1), n_pages)
+    start = (page - 1) * int(page_size)
+    return table.iloc[start:start + int(page_size)], n_rows, n_pages
+
+
+# ============================================================
+# DEAL INDEX (vcode -> row positions, built once per load)
+# ============================================================
+# Replaces per-report full-table scans (astype(str) == deal) and the
+# whole-ledger InvestmentID→vcode merge. The control join is resolved against
+# the (small) investment map at build time, keeping inner-join semantics:
+# accounting rows are returned in feed order, repeated once per matching map row.
+EMPTY_ROWS = np.empty(0, dtype=np.intp)
+
+
+@dataclass
+class DealIndex:
+    waterfalls: Dict[str, np.ndarray]
+    accounting: Dict[str, np.ndarray]
+    forecast: Dict[str, np.ndarray]
+    has_control_join: bool = True
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            rows.nbytes
+            for positions in (self.waterfalls, self.accounting, self.forecast)
+            for rows in positions.values()
+        )
+
+
+def _group_positions(keys: pd.Series) -> Dict[str, np.ndarray]:
+    rows = pd.Series(np.arange(len(keys), dtype=np.intp))
+    if isinstance(keys.dtype, pd.CategoricalDtype):
+        # Group on the int codes; only the categories become strings
+        labels = [str(c) for c in keys.cat.categories]
+        groups = rows.groupby(keys.cat.codes.to_numpy(), sort=False)
+        return {labels[k]: r.to_numpy() for k, r in groups if k >= 0}
+    groups = rows.groupby(keys.astype(str).to_numpy(), sort=False)
+    return {str(k): r.to_numpy() for k, r in groups}
+
+
+def accounting_positions(inv: pd.DataFrame, acct: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """vcode -> accounting row positions under the InvestmentID→vcode inner join."""
+    by_investment = _group_positions(acct["InvestmentID"])
+    parts: Dict[str, List[np.ndarray]] = {}
+    for inv_id, vcode in zip(inv["InvestmentID"], inv["vcode"]):
+        rows = by_investment.get(str(inv_id))
+        if rows is not None:
+            parts.setdefault(str(vcode), []).append(rows)
+    return {v: np.sort(np.concatenate(p)) for v, p in parts.items()}
+
+
+def build_deal_index(inv: pd.DataFrame, wf: pd.DataFrame, acct: pd.DataFrame, fc: pd.DataFrame) -> DealIndex:
+    has_join = "InvestmentID" in acct.columns and "InvestmentID" in inv.columns
+
+    return DealIndex(
+        waterfalls=_group_positions(wf["vcode"]),
+        accounting=accounting_positions(inv, acct) if has_join else {},
+        forecast=_group_positions(fc["vcode"]),
+        has_control_join=has_join,
+    )
+
+
+def control_join(inv: pd.DataFrame, acct: pd.DataFrame, deal: str) -> pd.DataFrame:
+    """Control-joined accounting rows for one deal, exactly as deal_frames returns them."""
+    if "InvestmentID" not in acct.columns or "InvestmentID" not in inv.columns:
+        return pd.DataFrame()
+    rows = accounting_positions(inv, acct).get(str(deal), EMPTY_ROWS)
+    acct_d = acct.iloc[rows].reset_index(drop=True)
+    acct_d["vcode"] = str(deal)
+    return acct_d
+
+
+def deal_frames(index: DealIndex, wf: pd.DataFrame, acct: pd.DataFrame, fc: pd.DataFrame, deal: str):
+    """(waterfall steps, control-joined accounting, forecast) for one deal; each a fresh frame."""
+    deal = str(deal)
+    wf_d = wf.iloc[index.waterfalls.get(deal, EMPTY_ROWS)].reset_index(drop=True)
+    fc_d = fc.iloc[index.forecast.get(deal, EMPTY_ROWS)].reset_index(drop=True)
+
+    if index.has_control_join:
+        acct_d = acct.iloc[index.accounting.get(deal, EMPTY_ROWS)].reset_index(drop=True)
+        acct_d["vcode"] = deal
+    else:
+        acct_d = pd.DataFrame()
+
+    return wf_d, acct_d, fc_d
+
+
+# ============================================================
+# COLUMNAR DATASET (compiled feeds, memory-mapped per-deal reads)
+# ============================================================
+# A one-time compile turns the five CSVs into uncompressed Feather (Arrow IPC)
+# files with explicit dtypes. The large feeds are split into one file per
+# partition value, so a report reads only the selected deal's rows and only the
+# columns the pipeline uses:
+#   <root>/investment_map.feather, waterfalls.feather, coa.feather
+#   <root>/forecast_feed/part-NNNNN.feather    one file per Vcode
+#   <root>/accounting_feed/part-NNNNN.feather  one file per InvestmentID
+#   <root>/manifest.json                       partition value -> file, columns
+DATASET_VERSION = 1
+DATASET_MANIFEST = "manifest.json"
+
+PARTITION_COLUMNS = {"forecast_feed": "Vcode", "accounting_feed": "InvestmentID"}
+
+FORECAST_READ_COLUMNS = ["Vcode", "Date", "vAccount", "mAmount", "Pro_Yr"]
+ACCOUNTING_READ_COLUMNS = ["InvestmentID", "InvestorID", "EffectiveDate", "TypeID", "Amt", "Capital"]
+
+
+def type_feed(name: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Explicit on-disk dtypes per feed; any other object column is stored as string."""
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+
+    if name == "forecast_feed":
+        df["Vcode"] = df["Vcode"].astype(str)
+        df["Date"] = pd.to_datetime(df["Date"])
+        df["vAccount"] = pd.to_numeric(df["vAccount"], errors="coerce").astype("Int64")
+        df["mAmount"] = pd.to_numeric(df["mAmount"], errors="coerce").astype("float64")
+        df["Pro_Yr"] = pd.to_numeric(df["Pro_Yr"], errors="coerce")
+    elif name == "accounting_feed":
+        for c in ("InvestmentID", "InvestorID"):
+            if c in df.columns:
+                df[c] = df[c].astype(str)
+        if "EffectiveDate" in df.columns:
+            df["EffectiveDate"] = pd.to_datetime(df["EffectiveDate"])
+        if "TypeID" in df.columns:
+            df["TypeID"] = pd.to_numeric(df["TypeID"], errors="coerce").astype("Int64")
+        if "Amt" in df.columns:
+            df["Amt"] = pd.to_numeric(df["Amt"], errors="coerce").astype("float64")
+
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].astype("string")
+    return df
+
+
+def _write_feather(df: pd.DataFrame, path: Path):
+    # pyarrow is imported on first dataset use, not with the module
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, str(path), compression="uncompressed")
+
+
+def compile_dataset(sources: Dict[str, object], out_dir) -> Path:
+    """
+    Compile the five feeds (paths or file-likes) into a columnar dataset at out_dir.
+    The manifest is written last, so an interrupted compile is never opened.
+    """
+    root = Path(out_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest_path = root / DATASET_MANIFEST
+    if manifest_path.exists():
+        manifest_path.unlink()
+
+    manifest = {"version": DATASET_VERSION, "columns": {}, "partitions": {}}
+
+    raw, _ = read_feeds(sources, FEED_NAMES)
+    for name in FEED_NAMES:
+        df = type_feed(name, raw.pop(name))
+        manifest["columns"][name] = list(df.columns)
+
+        part_col = PARTITION_COLUMNS.get(name)
+        if part_col is None:
+            _write_feather(df, root / f"{name}.feather")
+            continue
+
+        part_dir = root / name
+        if part_dir.exists():
+            shutil.rmtree(part_dir)
+        part_dir.mkdir()
+
+        parts: Dict[str, str] = {}
+        for i, (value, part) in enumerate(df.groupby(part_col, sort=True)):
+            rel = f"{name}/part-{i:05d}.feather"
+            _write_feather(part, root / rel)
+            parts[str(value)] = rel
+        manifest["partitions"][name] = parts
+
+    with open(manifest_path, "w") as fh:
+        json.dump(manifest, fh)
+    return root
+
+
+class ColumnarDataset:
+    def __init__(self, root):
+        self.root = Path(root)
+        with open(self.root / DATASET_MANIFEST) as fh:
+            self.manifest = json.load(fh)
+        if self.manifest.get("version") != DATASET_VERSION:
+            raise ValueError(f"Unsupported dataset version in {self.root}; recompile the CSV folder.")
+
+    def _columns(self, name: str, columns: List[str] = None) -> List[str]:
+        stored = self.manifest["columns"][name]
+        return stored if columns is None else [c for c in columns if c in stored]
+
+    def _read(self, rel: str, columns: List[str]) -> pd.DataFrame:
+        import pyarrow.feather as feather
+
+        return feather.read_table(str(self.root / rel), columns=columns, memory_map=True).to_pandas()
+
+    def frame(self, name: str, columns: List[str] = None) -> pd.DataFrame:
+        return self._read(f"{name}.feather", self._columns(name, columns))
+
+    def partitions(self, name: str, values: Iterable, columns: List[str] = None) -> pd.DataFrame:
+        cols = self._columns(name, columns)
+        parts = self.manifest["partitions"][name]
+        files = [parts[str(v)] for v in values if str(v) in parts]
+        if not files:
+            return pd.DataFrame(columns=cols)
+        return pd.concat([self._read(rel, cols) for rel in files], ignore_index=True)
+
+
+def load_dataset_deal(ds: ColumnarDataset, deal: str, inv: pd.DataFrame, wf: pd.DataFrame, coa: pd.DataFrame,
+                      pro_yr_base: int):
+    """deal_frames() for one deal, reading only its accounting/forecast partitions."""
+    inv_ids = inv.loc[inv["vcode"] == str(deal), "InvestmentID"] if "InvestmentID" in inv.columns else []
+    acct = load_accounting(ds.partitions("accounting_feed", inv_ids, ACCOUNTING_READ_COLUMNS))
+    fc = load_forecast(ds.partitions("forecast_feed", [deal], FORECAST_READ_COLUMNS), coa, int(pro_yr_base))
+    return deal_frames(build_deal_index(inv, wf, acct, fc), wf, acct, fc, deal)
+
+
+# ============================================================
+# INGESTION CACHE (content-hash keyed, LRU under a memory budget)
+# ============================================================
+
+# Parsed + normalized frames are cached across Streamlit reruns and sessions.
+# Keys are derived from file *content* (uploads) or path + mtime + size (local
+# folder), so a changed file is simply a new key; stale entries age out via LRU.
+# Cached frames are shared: callers must treat them as read-only.
+def frame_nbytes(obj) -> int:
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+    if isinstance(obj, (tuple, list)):
+        return sum(frame_nbytes(o) for o in obj)
+    return 0
+
+
+class FrameCache:
+    def __init__(self, budget_bytes: int, max_items: Optional[int] = None):
+        self.budget_bytes = int(budget_bytes)
+        self.max_items = max_items
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Hashable, Tuple[object, int]]" = OrderedDict()
+        self._digests: Dict[Hashable, str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], object]):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+
+        value = loader()
+        self.put(key, value)
+        return value
+
+    def put(self, key: Hashable, value: object):
+        size = frame_nbytes(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if size > self.budget_bytes:
+                return  # larger than the whole budget: serve it, don't keep it
+            self._items[key] = (value, size)
+            self.nbytes += size
+            self._evict()
+
+    def set_budget(self, budget_bytes: int):
+        with self._lock:
+            self.budget_bytes = int(budget_bytes)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._digests.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self._items and (
+            self.nbytes > self.budget_bytes
+            or (self.max_items is not None and len(self._items) > self.max_items)
+        ):
+            _, (_, size) = self._items.popitem(last=False)
+            self.nbytes -= size
+
+    def upload_key(self, f) -> Tuple[str, str]:
+        # Hash each distinct upload once; Streamlit reuses file_id across reruns.
+        handle = (getattr(f, "file_id", None) or id(f), getattr(f, "size", None))
+        with self._lock:
+            digest = self._digests.get(handle)
+        if digest is None:
+            digest = hashlib.blake2b(f.getvalue(), digest_size=16).hexdigest()
+            with self._lock:
+                self._digests[handle] = digest
+        return ("blake2b", digest)
+
+
+# Feeds each memoized per-deal stage reads
+STAGE_FEEDS = {
+    "deal_state": ("investment_map", "waterfalls", "accounting_feed"),
+    "annual_table": ("coa", "forecast_feed"),
+    "waterfall": ("investment_map", "waterfalls", "accounting_feed", "coa", "forecast_feed"),
+    "scenarios": ("investment_map", "waterfalls", "accounting_feed", "coa", "forecast_feed"),
+    "portfolio_rollup": ("investment_map", "coa", "forecast_feed"),
+    "goal_seek": ("investment_map", "waterfalls", "accounting_feed", "coa", "forecast_feed"),
+}
+
+
+class ResultMemo:
+    """
+    Dependency-aware memo for per-deal results on top of a FrameCache.
+
+    A stage's key is its name, the content keys of the feeds it reads
+    (STAGE_FEEDS) and the settings passed as params. A settings change therefore
+    misses only the stages that depend on it -- e.g. a new start year
+    re-aggregates the annual table but reuses the replayed DealState.
+    Cached results are shared: treat them as read-only.
+    """
+
+    def __init__(self, cache: FrameCache, data_keys: Dict[str, Hashable]):
+        self.cache = cache
+        self.data_keys = data_keys
+        self.last_hit = False
+
+    def key(self, stage: str, params: Tuple) -> Tuple:
+        return ("result", stage, tuple(self.data_keys[f] for f in STAGE_FEEDS[stage]), params)
+
+    def get(self, stage: str, params: Tuple, compute: Callable[[], object]):
+        key = self.key(stage, params)
+        self.last_hit = key in self.cache
+        return self.cache.get_or_load(key, compute)
+
+
+def path_key(path: str) -> Tuple[str, str, int, int]:
+    stat = os.stat(path)
+    return ("path", str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+
+
+def load_inputs_cached(cache: FrameCache, sources: Dict[str, object], keys: Dict[str, Hashable], pro_yr_base: int,
+                       accounting: bool = True, timer: Optional[StageTimer] = None):
+    """
+    Parse/normalize the five feeds through the cache.
+    sources: feed name -> path or file-like; keys: feed name -> content key.
+    Derived frames key on everything they depend on (forecast: itself + coa + Pro_Yr base).
+    accounting=False skips accounting_feed (an empty frame is returned); use
+    stream_accounting to read just the rows a run needs.
+    Feeds missing from the cache are parsed concurrently (read_feeds); with a
+    timer, each parse is recorded as a "parse <feed>" stage.
+    """
+    cache_keys = {
+        "investment_map": ("investment_map", keys["investment_map"]),
+        "waterfalls": ("waterfalls", keys["waterfalls"]),
+        "coa": ("coa", keys["coa"]),
+        "accounting_feed": ("accounting_feed", keys["accounting_feed"]),
+        "forecast_feed": ("forecast_feed", keys["forecast_feed"], keys["coa"], int(pro_yr_base)),
+    }
+    wanted = [n for n in FEED_NAMES if accounting or n != "accounting_feed"]
+    raw, seconds = read_feeds(sources, [n for n in wanted if cache_keys[n] not in cache])
+    if timer is not None:
+        for name, sec in seconds.items():
+            timer.record(f"parse {name}", sec, len(raw[name]))
+
+    inv = cache.get_or_load(cache_keys["investment_map"], lambda: load_investment_map(raw.pop("investment_map")))
+    wf = cache.get_or_load(cache_keys["waterfalls"], lambda: load_waterfalls(raw.pop("waterfalls")))
+    coa = cache.get_or_load(cache_keys["coa"], lambda: load_coa(raw.pop("coa")))
+    if accounting:
+        acct = cache.get_or_load(cache_keys["accounting_feed"], lambda: load_accounting(raw.pop("accounting_feed")))
+    else:
+        acct = pd.DataFrame(columns=ACCOUNTING_READ_COLUMNS)
+    fc = cache.get_or_load(
+        cache_keys["forecast_feed"],
+        lambda: load_forecast(raw.pop("forecast_feed"), coa, int(pro_yr_base)),
+    )
+    return inv, wf, coa, acct, fc
+
+
+# ============================================================
+# INSTRUMENTATION (per-stage timing / rows / memory)
+# ============================================================
+# Memory figures come from tracemalloc (Python + NumPy/pandas allocations),
+# traced only for the duration of each stage. tracemalloc is process-wide, so
+# figures from concurrent sessions can overlap.
+@dataclass
+class StageMetric:
+    stage: str
+    seconds: float = 0.0
+    rows: int = 0
+    mem_delta_mb: float = float("nan")   # traced memory still held after the stage
+    mem_peak_mb: float = float("nan")    # traced peak during the stage, above its start
+    cached: bool = False                 # served from a result memo
+
+
+class StageTimer:
+    def __init__(self, enabled: bool = True, trace_memory: bool = False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.metrics: List[StageMetric] = []
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0):
+        """Time a block; set .rows on the yielded metric once known."""
+        metric = StageMetric(name, rows=rows)
+        if not self.enabled:
+            yield metric
+            return
+
+        started = False
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started = True
+            tracemalloc.reset_peak()
+            mem0 = tracemalloc.get_traced_memory()[0]
+
+        t0 = time.perf_counter()
+        try:
+            yield metric
+        finally:
+            metric.seconds = time.perf_counter() - t0
+            if self.trace_memory:
+                cur, peak = tracemalloc.get_traced_memory()
+                metric.mem_delta_mb = (cur - mem0) / 1024 ** 2
+                metric.mem_peak_mb = (peak - mem0) / 1024 ** 2
+                if started:
+                    tracemalloc.stop()
+            self.metrics.append(metric)
+
+    def record(self, name: str, seconds: float, rows: int = 0):
+        """Add a stage timed elsewhere (e.g. on a worker thread)."""
+        if self.enabled:
+            self.metrics.append(StageMetric(name, seconds=seconds, rows=rows))
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame([asdict(m) for m in self.metrics], columns=list(StageMetric.__dataclass_fields__))
+
+    def to_jsonl(self, meta: Dict[str, object] = None) -> str:
+        """One JSON object per stage, stamped with UTC time and any extra meta fields."""
+        stamp = {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"), **(meta or {})}
+        lines = []
+        for m in self.metrics:
+            rec = {**stamp, **asdict(m)}
+            lines.append(json.dumps({k: (None if isinstance(v, float) and v != v else v) for k, v in rec.items()}))
+        return "\n".join(lines) + ("\n" if lines else "")
+
+
+MEMORY_REPORT_COLUMNS = [
+    "frame", "rows", "columns", "MB", "bytes_per_row",
+    "category_MB", "datetime_MB", "numeric_MB", "text_MB", "largest_column",
+]
+
+
+def _dtype_kind(dtype) -> str:
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return "numeric"
+    return "text"
+
+
+def memory_report(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Deep memory footprint of loaded frames, one row per frame: size, bytes per
+    row, MB by dtype kind (category / datetime / numeric / text, i.e. object and
+    string columns) and the largest column.
+    """
+    records = []
+    for name, df in frames.items():
+        usage = df.memory_usage(index=False, deep=True)
+        by_kind = {k: 0 for k in ("category", "datetime", "numeric", "text")}
+        for col, nbytes in usage.items():
+            by_kind[_dtype_kind(df[col].dtype)] += int(nbytes)
+        total = int(usage.sum())
+        records.append((
+            name, len(df), df.shape[1], total / 1024 ** 2, total / len(df) if len(df) else 0.0,
+            *(by_kind[k] / 1024 ** 2 for k in ("category", "datetime", "numeric", "text")),
+            str(usage.idxmax()) if len(usage) else "",
+        ))
+    return pd.DataFrame(records, columns=MEMORY_REPORT_COLUMNS)
+
+
+# ============================================================
+# WATERFALL ENGINE (compiled tier plans, executed over yearly FAD)
+# ============================================================
+# A deal's waterfall steps are compiled once into a WaterfallPlan -- arrays in
+# ledger slot order -- with these tiers, paid in order each year:
+#   pref            -> vState "pref": nPercent is the partner's pref rate; pays accrued pref pro rata
+#   return of capital (implicit) -> pays outstanding principal pro rata
+#   promote         -> vState "share" / "promote": nPercent is the partner's split of the remainder
+#                      (normalized; without such steps the remainder follows capital at projection start)
+#   exit            -> in the exit year, exit proceeds (execute_waterfalls exit_value; none in
+#                      the feeds, so 0 by default) pay outstanding pref -- accrued and
+#                      capitalized -- then principal pro rata, the rest by the promote split;
+#                      whatever they leave unpaid is written off. No tier pays more than its pool.
+# Steps are effective-dated: per (PropCode, vState) the latest dteffective wins.
+# Other vStates are ignored.
+#
+# Execution runs many rows -- (deal, scenario) pairs sharing plans -- through
+# the tiers in lockstep, one array step per year, starting from each deal's
+# replayed balances; distributions then go into XIRR behind each partner's history.
+PROMOTE_STATES = {"share", "promote"}
+WATERFALL_TIERS = ["pref", "capital", "promote", "exit"]
+WATERFALL_DISTRIBUTION_COLUMNS = ["vcode", "PropCode", "Year"] + WATERFALL_TIERS + ["total"]
+WATERFALL_PARTNER_COLUMNS = ["vcode", "PropCode"] + WATERFALL_TIERS + ["total", "XIRR", "status"]
+
+# Cap on (rows x flows) cells packed per XIRR solve
+WATERFALL_XIRR_CELLS = 4_000_000
+
+
+@dataclass
+class WaterfallPlan:
+    vcode: str
+    start_date: date                # earliest dteffective
+    codes: List[str]                # PropCodes, in DealState ledger slot order
+    has_pref: np.ndarray            # partner has a pref step
+    pref_rate: np.ndarray           # pref rate (0 where no pref step)
+    split: np.ndarray               # promote split, sums to 1 (empty: follow capital)
+    day_counts: Dict[str, str]      # PropCode -> pref accrual convention, where the pref step sets one
+
+    @property
+    def pref_rates(self) -> Dict[str, float]:
+        return {p: float(r) for p, r, has in zip(self.codes, self.pref_rate, self.has_pref) if has}
+
+
+def compile_waterfall(vcode: str, wf_d: pd.DataFrame) -> WaterfallPlan:
+    """Compile a deal's waterfall steps (PropCode, vState, nPercent, dteffective) into a WaterfallPlan."""
+    eff = pd.to_datetime(wf_d["dteffective"])
+    codes = list(wf_d["PropCode"].astype(str).unique())
+    slot = {p: j for j, p in enumerate(codes)}
+
+    has_pref = np.zeros(len(codes), dtype=bool)
+    pref_rate = np.zeros(len(codes))
+    split = np.zeros(len(codes))
+    day_counts: Dict[str, str] = {}
+
+    if "vState" in wf_d.columns:
+        steps = wf_d.assign(
+            _eff=eff,
+            _prop=wf_d["PropCode"].astype(str),
+            _state=wf_d["vState"].astype(str).str.strip().str.lower(),
+        ).sort_values("_eff", kind="stable")
+        steps = steps.drop_duplicates(["_prop", "_state"], keep="last")
+
+        for _, r in steps[steps["_state"].eq("pref")].iterrows():
+            rate = float(r.get("nPercent") or 0.0)
+            if rate > 1.0:
+                rate /= 100.0
+            has_pref[slot[r["_prop"]]] = True
+            pref_rate[slot[r["_prop"]]] = rate
+            if "vDayCount" in steps.columns:
+                day_counts[r["_prop"]] = day_count(r["vDayCount"])
+
+        promote = steps[steps["_state"].isin(PROMOTE_STATES)]
+        for p, pct in zip(promote["_prop"], pd.to_numeric(promote["nPercent"], errors="coerce").fillna(0.0)):
+            split[slot[p]] += max(float(pct), 0.0)
+
+    split = split / split.sum() if split.sum() > 0 else np.zeros(0)
+    return WaterfallPlan(str(vcode), eff.min().date(), codes, has_pref, pref_rate, split, day_counts)
+
+
+@dataclass
+class WaterfallRun:
+    years: np.ndarray        # distribution years (year-end dated)
+    row_plan: np.ndarray     # plan / state index of each row
+    valid: np.ndarray        # (rows, max partners): slot exists for the row's deal
+    tiers: np.ndarray        # (rows, max partners, years, WATERFALL_TIERS) distributions
+
+
+def _pro_rata(balances: np.ndarray, pool: np.ndarray) -> np.ndarray:
+    # Pay up to pool (per row) against positive balances, pro rata
+    bal = np.maximum(balances, 0.0)
+    total = bal.sum(axis=1)
+    paid = np.minimum(np.maximum(pool, 0.0), total)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share = np.where(total[:, None] > 0, bal / total[:, None], 0.0)
+    return share * paid[:, None]
+
+
+def execute_waterfalls(plans: Sequence[WaterfallPlan], states: Sequence[DealState], fad: np.ndarray,
+                       start_year: int, exit_year: np.ndarray, row_plan: Optional[np.ndarray] = None,
+                       pref_shift: Optional[np.ndarray] = None,
+                       exit_value: Optional[np.ndarray] = None) -> WaterfallRun:
+    """
+    Run compiled plans over yearly FAD.
+
+    plans, states: one plan per replayed DealState (read only; balances are copied)
+    fad:           (rows, years) Funds Available for Distribution from start_year on
+    exit_year:     (rows,) last held year; FAD after it is ignored
+    row_plan:      (rows,) plan index per row (default: one row per plan)
+    pref_shift:    (rows,) added to every pref rate (floored at 0), e.g. for scenarios
+    exit_value:    (rows,) exit proceeds in the exit year, paid through the exit tier (default 0)
+    """
+    n_rows, n_yr = fad.shape
+    row_plan = np.arange(len(plans)) if row_plan is None else np.asarray(row_plan, dtype=np.int64)
+    start_year = int(start_year)
+    years = np.arange(start_year, start_year + n_yr)
+
+    # ---- plans padded to (plans, max partners)
+    width = max((len(p.codes) for p in plans), default=0)
+    n_plan = len(plans)
+    valid = np.zeros((n_plan, width), dtype=bool)
+    has_pref = np.zeros((n_plan, width), dtype=bool)
+    rate = np.zeros((n_plan, width))
+    split = np.zeros((n_plan, width))
+    bal = np.zeros((3, n_plan, width))
+    for i, (plan, state) in enumerate(zip(plans, states)):
+        n = len(plan.codes)
+        valid[i, :n] = True
+        has_pref[i, :n] = plan.has_pref
+        rate[i, :n] = plan.pref_rate
+        bal[:, i, :n] = state.ledger.principal, state.ledger.pref_accrued, state.ledger.pref_capitalized
+        if len(plan.split):
+            split[i, :n] = plan.split
+        else:
+            capital = np.maximum(bal[0, i, :n] + bal[2, i, :n], 0.0)
+            split[i, :n] = capital / capital.sum() if capital.sum() > 0 else 1.0 / n
+
+    # ---- accrual segments: each deal accrues from its last replayed event, and
+    # compounds only at year-ends on or after it
+    last = np.array([s.last_event_date.toordinal() for s in states], dtype=np.int64)
+    first_year = min(start_year, int(ordinal_years(last).min())) if n_plan else start_year
+    all_years = np.arange(first_year, years[-1] + 1) if n_yr else np.arange(0)
+    ye = year_end_ordinals(all_years)
+    yf = np.zeros((n_plan, len(all_years), width))
+    for i, (plan, state) in enumerate(zip(plans, states)):
+        seg_to = np.maximum(ye, last[i])
+        seg_from = np.r_[last[i], seg_to[:-1]]
+        yf[i, :, :len(plan.codes)] = partner_year_fractions(state.partner_day_counts(), seg_from, seg_to)
+    compounds = ye[None, :] >= last[:, None]
+
+    # ---- rows
+    r_rate = rate[row_plan]
+    if pref_shift is not None:
+        r_rate = np.where(has_pref[row_plan], np.maximum(r_rate + np.asarray(pref_shift)[:, None], 0.0), 0.0)
+    r_split = split[row_plan]
+    P, A, C = (b[row_plan].copy() for b in bal)
+    exit_year = np.asarray(exit_year, dtype=np.int64)
+    pool_all = np.where(years[None, :] <= exit_year[:, None], np.maximum(fad, 0.0), 0.0)
+    proceeds = np.zeros(n_rows) if exit_value is None else np.maximum(np.asarray(exit_value, dtype=float), 0.0)
+    tiers = np.zeros((n_rows, width, n_yr, len(WATERFALL_TIERS)))
+
+    for k, y in enumerate(all_years):
+        A += (P + C) * r_rate * yf[row_plan, k]
+
+        j = int(y) - start_year
+        if j >= 0:
+            pool = pool_all[:, j]
+            pref = _pro_rata(A, pool)
+            A -= pref
+            pool = pool - pref.sum(axis=1)
+            capital = _pro_rata(P, pool)
+            P -= capital
+            pool = pool - capital.sum(axis=1)
+
+            ex = exit_year == y
+            tiers[:, :, j, 0] = pref
+            tiers[:, :, j, 1] = capital
+            tiers[:, :, j, 2] = pool[:, None] * r_split
+            if ex.any():
+                pool = proceeds[ex]
+                exit_pref = _pro_rata(A[ex] + C[ex], pool)
+                pool = pool - exit_pref.sum(axis=1)
+                exit_capital = _pro_rata(P[ex], pool)
+                pool = pool - exit_capital.sum(axis=1)
+                tiers[ex, :, j, 3] = exit_pref + exit_capital + pool[:, None] * r_split[ex]
+                P[ex], C[ex], A[ex] = 0.0, 0.0, 0.0
+
+        comp = compounds[row_plan, k]
+        C[comp] += A[comp]
+        A[comp] = 0.0
+
+    return WaterfallRun(years, row_plan, valid[row_plan], tiers)
+
+
+def partner_series(run: WaterfallRun, states: Sequence[DealState], day_count: str = DEFAULT_DAY_COUNT
+                   ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every partner's history packed once (pack_flows), led by one zero slot per
+    projected year-end of run.years for its distributions.
+
+    Returns (times, amounts, r_idx, p_idx, series): the packed arrays, and for
+    each valid (row, partner slot) of the run its series (row of the arrays).
+    """
+    n_part = np.array([len(s.ledger) for s in states], dtype=np.int64)
+    offset = np.cumsum(n_part) - n_part
+    n_series, n_yr = int(n_part.sum()), len(run.years)
+
+    owner, ords, amounts = ledger_flows(states)
+    times, packed = pack_flows(
+        np.concatenate([np.repeat(np.arange(n_series), n_yr), owner]),
+        np.concatenate([np.tile(year_end_ordinals(run.years), n_series), ords]),
+        np.concatenate([np.zeros(n_series * n_yr), amounts]),
+        n_series,
+        day_count,
+    )
+    r_idx, p_idx = np.nonzero(run.valid)
+    return times, packed, r_idx, p_idx, offset[run.row_plan[r_idx]] + p_idx
+
+
+def waterfall_irrs(run: WaterfallRun, states: Sequence[DealState],
+                   day_count: str = DEFAULT_DAY_COUNT) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (rows, max partners) XIRR and status of each partner's history plus its
+    year-end waterfall distributions. Every deal's flows are packed once; rows
+    sharing a deal reuse them with their own distributions.
+    """
+    n_yr = len(run.years)
+    times, packed, r_idx, p_idx, series = partner_series(run, states, day_count)
+
+    rates = np.full(run.valid.shape, np.nan)
+    status = np.full(run.valid.shape, XIRR_EMPTY, dtype=object)
+    dist = run.tiers.sum(axis=3)
+
+    block = max(1, WATERFALL_XIRR_CELLS // max(times.shape[1], 1))
+    for b0 in range(0, len(series), block):
+        b = slice(b0, b0 + block)
+        amt = packed[series[b]]
+        amt[:, :n_yr] = dist[r_idx[b], p_idx[b]]
+        res = solve_xirr(times[series[b]], amt)
+        rates[r_idx[b], p_idx[b]] = res.rates
+        status[r_idx[b], p_idx[b]] = res.status
+    return rates, status
+
+
+def fad_matrix(annual: pd.DataFrame, vcodes: Sequence[str], years: np.ndarray) -> np.ndarray:
+    """(deals, years) FAD from portfolio_annual_aggregation rows; 0 where a deal has none."""
+    return (
+        annual.assign(vcode=annual["vcode"].astype(str))
+        .pivot(index="vcode", columns="Year", values="Funds Available for Distribution")
+        .reindex(index=list(vcodes), columns=years)
+        .fillna(0.0)
+        .to_numpy(dtype=float)
+    )
+
+
+def run_waterfalls(states: Sequence[DealState], plans: Sequence[WaterfallPlan], annual: pd.DataFrame,
+                   start_year: int, horizon_years: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Base-case waterfall for many deals: FAD from annual (portfolio_annual_aggregation
+    rows), exit at the end of the horizon.
+
+    Returns (distributions, partners):
+      distributions -> one row per (vcode, PropCode, Year): each tier, total
+      partners      -> one row per (vcode, PropCode): tier totals, XIRR (history + distributions), status
+    """
+    if not states:
+        return pd.DataFrame(columns=WATERFALL_DISTRIBUTION_COLUMNS), pd.DataFrame(columns=WATERFALL_PARTNER_COLUMNS)
+
+    years = np.arange(int(start_year), int(start_year) + int(horizon_years))
+    vcodes = [s.vcode for s in states]
+    fad = fad_matrix(annual, vcodes, years)
+    run = execute_waterfalls(plans, states, fad, int(start_year), np.full(len(states), years[-1]))
+    rates, status = waterfall_irrs(run, states)
+
+    r_idx, p_idx = np.nonzero(run.valid)
+    deal_vcode = np.asarray(vcodes, dtype=object)[r_idx]
+    prop = np.array([plans[r].codes[p] for r, p in zip(r_idx, p_idx)], dtype=object)
+    per_year = run.tiers[r_idx, p_idx]   # (partners, years, tiers)
+
+    distributions = pd.DataFrame({
+        "vcode": np.repeat(deal_vcode, len(years)),
+        "PropCode": np.repeat(prop, len(years)),
+        "Year": np.tile(years, len(r_idx)),
+        **{t: per_year[:, :, i].ravel() for i, t in enumerate(WATERFALL_TIERS)},
+        "total": per_year.sum(axis=2).ravel(),
+    })
+    totals = per_year.sum(axis=1)
+    partners = pd.DataFrame({
+        "vcode": deal_vcode,
+        "PropCode": prop,
+        **{t: totals[:, i] for i, t in enumerate(WATERFALL_TIERS)},
+        "total": totals.sum(axis=1),
+        "XIRR": rates[r_idx, p_idx],
+        "status": status[r_idx, p_idx],
+    })
+    return distributions, partners
+
+
+# ============================================================
+# DEAL STATE STORE (SQLite checkpoints, watermark-based refresh)
+# ============================================================
+# Each deal's replayed ledger (balances + flow log) is checkpointed together with
+# its watermark -- the last EffectiveDate applied -- plus the count and an
+# order-independent digest of the accounting rows at or before it. A refresh
+# resumes from the checkpoint and replays only rows past the watermark; it
+# falls back to a full replay when those rows changed (back-dated or edited
+# rows; also a new row on the watermark date itself) or the compiled
+# waterfall did. One connection per call, so a store can be shared across
+# threads and worker processes.
+STORE_VERSION = 1
+
+REFRESH_NEW = "new"
+REFRESH_UNCHANGED = "unchanged"
+REFRESH_DELTA = "delta"
+REFRESH_BACKDATED = "full: back-dated rows"
+REFRESH_PLAN_CHANGED = "full: waterfall changed"
+
+STORE_STATUS_COLUMNS = ["vcode", "watermark", "rows", "partners", "flows", "last_refresh", "updated_at"]
+
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS deal_states (
+    vcode TEXT PRIMARY KEY,
+    plan_key TEXT NOT NULL,
+    watermark INTEGER,
+    n_rows INTEGER NOT NULL,
+    rows_digest TEXT NOT NULL,
+    last_event INTEGER NOT NULL,
+    codes TEXT NOT NULL,
+    day_counts TEXT NOT NULL,
+    principal BLOB, pref_accrued BLOB, pref_capitalized BLOB,
+    flow_owner BLOB, flow_ords BLOB, flow_amounts BLOB,
+    last_refresh TEXT,
+    updated_at TEXT
+);
+"""
+
+
+@dataclass
+class DealCheckpoint:
+    state: DealState
+    plan_key: str
+    watermark: Optional[int]   # date ordinal of the last applied EffectiveDate (None: no rows yet)
+    n_rows: int                # accounting rows at or before the watermark
+    rows_digest: int           # sum of their row hashes (mod 2**64)
+    last_refresh: str = REFRESH_NEW
+
+
+def plan_key(plan: WaterfallPlan) -> str:
+    """Content key of everything a replay reads from the plan."""
+    payload = json.dumps({
+        "start": plan.start_date.toordinal(),
+        "codes": plan.codes,
+        "pref": [[bool(h), float(r)] for h, r in zip(plan.has_pref, plan.pref_rate)],
+        "day_counts": plan.day_counts,
+    }, sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+def accounting_row_hashes(acct_d: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """(EffectiveDate ordinals, uint64 hashes) of a deal's accounting rows, over the fields replay reads."""
+    if acct_d.empty or "EffectiveDate" not in acct_d.columns or "InvestorID" not in acct_d.columns:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64)
+    ords = to_ordinals(acct_d["EffectiveDate"])
+    fields = pd.DataFrame({
+        "date": ords,
+        "investor": id_strings(acct_d["InvestorID"]),
+        "amt": acct_d["Amt"].astype(float).to_numpy() if "Amt" in acct_d.columns else 0.0,
+        "capital": acct_d["Capital"].astype(str).str.upper().eq("Y").to_numpy(dtype=bool)
+        if "Capital" in acct_d.columns else True,
+    })
+    return ords, pd.util.hash_pandas_object(fields, index=False).to_numpy(dtype=np.uint64)
+
+
+def _digest(hashes: np.ndarray) -> int:
+    return int(hashes.sum(dtype=np.uint64))
+
+
+class DealStateStore:
+    def __init__(self, path):
+        self.path = str(path)
+        with closing(self._connect()) as con, con:
+            con.executescript(_STORE_SCHEMA)
+            row = con.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or int(row[0]) != STORE_VERSION:
+                # Checkpoints are derived data: an old layout is dropped and rebuilt by the next refresh
+                con.execute("DELETE FROM deal_states")
+                con.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(STORE_VERSION),))
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.path, timeout=60)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def load(self, vcode: str) -> Optional[DealCheckpoint]:
+        with closing(self._connect()) as con:
+            row = con.execute(
+                "SELECT plan_key, watermark, n_rows, rows_digest, last_event, codes, day_counts, principal, "
+                "pref_accrued, pref_capitalized, flow_owner, flow_ords, flow_amounts, last_refresh "
+                "FROM deal_states WHERE vcode = ?",
+                (str(vcode),),
+            ).fetchone()
+        if row is None:
+            return None
+
+        key, watermark, n_rows, digest, last_event, codes, day_counts = row[:7]
+        state = DealState(str(vcode), date.fromordinal(last_event), day_counts=json.loads(day_counts))
+        for p in json.loads(codes):
+            state.add_partner(p)
+        led = state.ledger
+        led.principal, led.pref_accrued, led.pref_capitalized = (np.frombuffer(b, dtype=float).copy() for b in row[7:10])
+        led.append(np.frombuffer(row[10], dtype=np.int64), np.frombuffer(row[11], dtype=np.int64),
+                   np.frombuffer(row[12], dtype=float))
+        return DealCheckpoint(state, key, watermark, n_rows, int(digest, 16), row[13])
+
+    def save(self, checkpoints: Iterable[DealCheckpoint]):
+        """Write checkpoints in one transaction (replacing each deal's previous one)."""
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        records = []
+        for ck in checkpoints:
+            led = ck.state.ledger
+            owner, ords, amounts = led.flows()
+            records.append((
+                ck.state.vcode, ck.plan_key, ck.watermark, ck.n_rows, f"{ck.rows_digest:016x}",
+                ck.state.last_event_date.toordinal(), json.dumps(led.codes), json.dumps(ck.state.day_counts),
+                led.principal.tobytes(), led.pref_accrued.tobytes(), led.pref_capitalized.tobytes(),
+                owner.tobytes(), ords.tobytes(), amounts.tobytes(), ck.last_refresh, now,
+            ))
+        with closing(self._connect()) as con, con:
+            con.executemany(f"INSERT OR REPLACE INTO deal_states VALUES ({', '.join('?' * 16)})", records)
+
+    def status(self, vcodes: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """One row per checkpointed deal (optionally only vcodes): watermark date, size, last refresh mode."""
+        with closing(self._connect()) as con:
+            rows = con.execute(
+                "SELECT vcode, watermark, n_rows, codes, length(flow_amounts) / 8, last_refresh, updated_at "
+                "FROM deal_states ORDER BY vcode"
+            ).fetchall()
+        out = pd.DataFrame(rows, columns=STORE_STATUS_COLUMNS)
+        out["watermark"] = [date.fromordinal(int(o)) if o is not None else None for o in out["watermark"]]
+        out["partners"] = [len(json.loads(c)) for c in out["partners"]]
+        if vcodes is not None:
+            out = out[out["vcode"].isin({str(v) for v in vcodes})].reset_index(drop=True)
+        return out
+
+    def clear(self):
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM deal_states")
+
+
+def refresh_deals(store: DealStateStore, frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]
+                  ) -> Tuple[List[DealState], Dict[str, WaterfallPlan], List[str], pd.DataFrame]:
+    """
+    replay_deals through the store: every deal resumes from its checkpoint when
+    the rows at or before its watermark are unchanged, and one replay_ledger
+    pass applies the remaining rows (all rows for new / invalidated deals).
+    Checkpoints are then updated.
+
+    Returns (states, plans by vcode, skipped, ledger); ledger is the trajectory
+    of the rows applied in this refresh. Each deal's refresh mode (REFRESH_*)
+    is recorded in the store (see DealStateStore.status).
+    """
+    states: List[DealState] = []
+    plans: Dict[str, WaterfallPlan] = {}
+    skipped: List[str] = []
+    pending: List[DealCheckpoint] = []
+    to_apply: List[pd.DataFrame] = []
+
+    for vcode, (wf_d, acct_d, _) in frames.items():
+        if wf_d.empty:
+            skipped.append(vcode)
+            continue
+        plan = compile_waterfall(vcode, wf_d)
+        key = plan_key(plan)
+        ords, hashes = accounting_row_hashes(acct_d)
+
+        ck = store.load(plan.vcode)
+        if ck is None or ck.plan_key != key:
+            mode = REFRESH_NEW if ck is None else REFRESH_PLAN_CHANGED
+        else:
+            old = ords <= (ck.watermark if ck.watermark is not None else -1)
+            same = int(old.sum()) == ck.n_rows and _digest(hashes[old]) == ck.rows_digest
+            mode = (REFRESH_DELTA if not old.all() else REFRESH_UNCHANGED) if same else REFRESH_BACKDATED
+
+        if mode in (REFRESH_DELTA, REFRESH_UNCHANGED):
+            state, new = ck.state, ~old
+        else:
+            state, new = plan_deal_state(plan), np.ones(len(ords), dtype=bool)
+        if new.any():
+            to_apply.append(acct_d[new])
+
+        states.append(state)
+        plans[plan.vcode] = plan
+        watermark = int(ords.max()) if len(ords) else None
+        pending.append(DealCheckpoint(state, key, watermark, len(ords), _digest(hashes), mode))
+
+    if to_apply:
+        ledger = replay_ledger(states, {v: p.pref_rates for v, p in plans.items()},
+                               pd.concat(to_apply, ignore_index=True))
+    else:
+        ledger = pd.DataFrame(columns=LEDGER_COLUMNS)
+    store.save(pending)
+    return states, plans, skipped, ledger
+
+
+def refresh_deal(store: DealStateStore, vcode: str, wf_d: pd.DataFrame, acct_d: pd.DataFrame
+                 ) -> Tuple[DealState, WaterfallPlan, pd.DataFrame]:
+    """replay_deal through the store: (state, plan, ledger of the rows applied)."""
+    states, plans, _, ledger = refresh_deals(store, {str(vcode): (wf_d, acct_d, None)})
+    if not states:
+        raise ValueError(f"No waterfall steps found for deal {vcode}.")
+    return states[0], plans[states[0].vcode], ledger
+
+
+# ============================================================
+# PORTFOLIO RUN (full report pipeline for many deals, no UI)
+# ============================================================
+PARTNER_STATE_COLUMNS = [
+    "vcode", "PropCode", "principal", "pref_accrued", "pref_capitalized",
+    "last_event_date", "XIRR", "status",
+]
+
+
+def partner_states_frame(states: Sequence[DealState]) -> pd.DataFrame:
+    """Final partner balances plus batched XIRR, one row per (vcode, PropCode)."""
+    if not states:
+        return pd.DataFrame(columns=PARTNER_STATE_COLUMNS)
+
+    balances = pd.DataFrame(
+        [
+            (s.vcode, p, ps.principal, ps.pref_accrued, ps.pref_capitalized, s.last_event_date)
+            for s in states
+            for p, ps in s.partners.items()
+        ],
+        columns=PARTNER_STATE_COLUMNS[:6],
+    )
+    irrs = partner_irrs(states)
+    balances["XIRR"] = irrs["XIRR"].to_numpy()
+    balances["status"] = irrs["status"].to_numpy()
+    return balances
+
+
+def replay_deals(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+                 store: Optional[DealStateStore] = None
+                 ) -> Tuple[List[DealState], Dict[str, WaterfallPlan], List[str]]:
+    """
+    compile_waterfall for every deal with waterfall steps, then one replay_ledger
+    pass over all of their accounting. Returns (states, plans by vcode, skipped).
+    With a store, deals resume from their checkpoints (refresh_deals).
+    """
+    if store is not None:
+        states, plans, skipped, _ = refresh_deals(store, frames)
+        return states, plans, skipped
+
+    states: List[DealState] = []
+    plans: Dict[str, WaterfallPlan] = {}
+    skipped: List[str] = []
+    for vcode, (wf_d, _, _) in frames.items():
+        if wf_d.empty:
+            skipped.append(vcode)
+            continue
+        plan = compile_waterfall(vcode, wf_d)
+        states.append(plan_deal_state(plan))
+        plans[plan.vcode] = plan
+
+    accts = [a for _, a, _ in frames.values() if not a.empty]
+    if accts:
+        replay_ledger(states, {v: plan.pref_rates for v, plan in plans.items()}, pd.concat(accts, ignore_index=True))
+    return states, plans, skipped
+
+
+def run_deals(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+              start_year: int, horizon_years: int, store: Optional[DealStateStore] = None
+              ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, List[str]]:
+    """
+    frames: vcode -> (waterfall steps, control-joined accounting, forecast), as from deal_frames().
+    store:  optional DealStateStore; deal states are refreshed from its checkpoints.
+
+    Returns (annual, partners, distributions, skipped):
+      annual        -> portfolio_annual_aggregation rows for every deal
+      partners      -> partner_states_frame after replaying each deal's accounting, plus
+                       forecast_distributions / forecast_XIRR / forecast_status from run_waterfalls
+      distributions -> run_waterfalls tier distributions per (vcode, PropCode, Year)
+      skipped       -> deals without waterfall steps (no partner state, as in the UI)
+    """
+    states, plans, skipped = replay_deals(frames, store)
+    fcs = [f for _, _, f in frames.values()]
+    annual = portfolio_annual_aggregation(pd.concat(fcs, ignore_index=True), start_year, horizon_years,
+                                          vcodes=list(frames))
+    distributions, forecast = run_waterfalls(states, [plans[s.vcode] for s in states], annual,
+                                             start_year, horizon_years)
+    partners = partner_states_frame(states)
+    partners["forecast_distributions"] = forecast["total"].to_numpy(dtype=float)
+    partners["forecast_XIRR"] = forecast["XIRR"].to_numpy(dtype=float)
+    partners["forecast_status"] = forecast["status"].to_numpy(dtype=object)
+    return annual, partners, distributions, skipped
+
+
+def load_folder(folder, pro_yr_base: int, cache: FrameCache = None, stream: bool = False,
+                vcodes: Optional[Iterable[str]] = None, timer: Optional[StageTimer] = None):
+    """
+    (inv, wf, coa, acct, fc) from a folder of the five CSVs, as the UI's local-folder mode loads them.
+    stream=True reads accounting_feed through stream_accounting, keeping only
+    rows for vcodes (every mapped deal when None) in compact dtypes.
+    """
+    cache = cache or FrameCache(DEFAULT_CACHE_BUDGET_MB * 1024 * 1024)
+    sources = {k: str(Path(folder) / f"{k}.csv") for k in FEED_NAMES}
+    keys = {k: path_key(p) for k, p in sources.items()}
+    if not stream:
+        return load_inputs_cached(cache, sources, keys, int(pro_yr_base), timer=timer)
+
+    inv, wf, coa, _, fc = load_inputs_cached(cache, sources, keys, int(pro_yr_base), accounting=False, timer=timer)
+    acct = stream_accounting(sources["accounting_feed"], inv, vcodes)
+    return inv, wf, coa, acct, fc
+
+
+# ============================================================
+# SCENARIOS (sensitivity grids + Monte Carlo, batched per deal)
+# ============================================================
+# All scenarios of a deal are evaluated as rows of (scenarios, years) arrays:
+# the base line items are summed once by annual_aggregation_table, shocked by
+# broadcasting and derived with derive_annual_lines on a (scenario, Year) index.
+# Distributions come from execute_waterfalls with every scenario as a row of
+# the deal's compiled plan (pref shock as pref_shift, exit year per row), and
+# all (scenario, partner) XIRRs from waterfall_irrs.
+SCENARIO_COLUMNS = ["pref_bps", "revenue_growth", "expense_growth", "exit_shift"]
+SCENARIO_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def sensitivity_grid(pref_bps: Sequence[float] = (0.0,), revenue_growth: Sequence[float] = (0.0,),
+                     expense_growth: Sequence[float] = (0.0,), exit_shift: Sequence[int] = (0,)) -> pd.DataFrame:
+    """
+    Every combination of the given shocks, one row per scenario:
+      pref_bps       -> added to each partner's pref rate (basis points)
+      revenue_growth -> extra annual growth compounded on Revenues (0.01 = +1%/yr)
+      expense_growth -> extra annual growth compounded on Expenses
+      exit_shift     -> years added to (or taken off) the end of the horizon
+    """
+    grid = pd.MultiIndex.from_product(
+        [list(pref_bps), list(revenue_growth), list(expense_growth), [int(s) for s in exit_shift]],
+        names=SCENARIO_COLUMNS,
+    )
+    return grid.to_frame(index=False)
+
+
+def monte_carlo_scenarios(n: int, pref_bps_sd: float = 0.0, revenue_growth_sd: float = 0.0,
+                          expense_growth_sd: float = 0.0, exit_shift_max: int = 0,
+                          seed: Optional[int] = None) -> pd.DataFrame:
+    """
+    n random scenarios: normal shocks with mean 0 and the given standard
+    deviations, exit shift uniform over [-exit_shift_max, exit_shift_max].
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "pref_bps": rng.normal(0.0, pref_bps_sd, n),
+        "revenue_growth": rng.normal(0.0, revenue_growth_sd, n),
+        "expense_growth": rng.normal(0.0, expense_growth_sd, n),
+        "exit_shift": rng.integers(-int(exit_shift_max), int(exit_shift_max) + 1, n),
+    })
+
+
+@dataclass
+class ScenarioResult:
+    vcode: str
+    scenarios: pd.DataFrame  # SCENARIO_COLUMNS + exit_year, one row per scenario (index = scenario)
+    annual: pd.DataFrame     # scenario, Year + annual line items, held years only
+    partners: pd.DataFrame   # scenario, PropCode, distributions, XIRR, status
+
+    @property
+    def nbytes(self) -> int:
+        return sum(frame_nbytes(f) for f in (self.scenarios, self.annual, self.partners))
+
+
+def run_scenarios(state: DealState, plan: WaterfallPlan, fc_deal: pd.DataFrame,
+                  scenarios: pd.DataFrame, start_year: int, horizon_years: int) -> ScenarioResult:
+    """
+    Evaluate every scenario row (SCENARIO_COLUMNS) for one deal.
+
+    state:   replayed DealState (read only; projections run on copies of its balances)
+    plan:    the deal's compiled waterfall, as from compile_waterfall
+    fc_deal: the deal's normalized forecast rows
+    """
+    if scenarios.empty:
+        raise ValueError("No scenarios to run.")
+
+    sc = scenarios.reset_index(drop=True)[SCENARIO_COLUMNS]
+    n_sc = len(sc)
+    bps = sc["pref_bps"].to_numpy(dtype=float)
+    g_rev = sc["revenue_growth"].to_numpy(dtype=float)
+    g_exp = sc["expense_growth"].to_numpy(dtype=float)
+
+    start_year = int(start_year)
+    last_year = start_year + int(horizon_years) - 1
+    exit_year = np.maximum(last_year + sc["exit_shift"].to_numpy(dtype=np.int64), start_year)
+    years = np.arange(start_year, max(last_year, int(exit_year.max())) + 1)
+    n_yr = len(years)
+    held = years[None, :] <= exit_year[:, None]
+
+    # ---- annual lines: base sums once, growth shocks broadcast over scenarios
+    base = annual_aggregation_table(fc_deal, start_year, n_yr).set_index("Year")
+    lines = {item: np.broadcast_to(base[item].to_numpy(dtype=float), (n_sc, n_yr)) for item in LINE_ITEMS}
+    k = np.arange(1, n_yr + 1)
+    lines["Revenues"] = lines["Revenues"] * (1.0 + g_rev[:, None]) ** k
+    lines["Expenses"] = lines["Expenses"] * (1.0 + g_exp[:, None]) ** k
+
+    index = pd.MultiIndex.from_product([np.arange(n_sc), years], names=["scenario", "Year"])
+    annual = derive_annual_lines(pd.DataFrame({item: v.ravel() for item, v in lines.items()}, index=index))
+    # No debt service leaves pd.NA; keep DSCR numeric with NaN there
+    annual["Debt Service Coverage Ratio"] = annual["Debt Service Coverage Ratio"].astype("Float64").to_numpy(
+        dtype=float, na_value=np.nan)
+    fad = annual["Funds Available for Distribution"].to_numpy().reshape(n_sc, n_yr)
+    annual = annual[held.ravel()].reset_index()
+
+    sc["exit_year"] = exit_year
+    sc.index.name = "scenario"
+
+    # ---- partner distributions and XIRR: every scenario is a row of the deal's plan
+    props = np.asarray(state.ledger.codes, dtype=object)
+    run = execute_waterfalls([plan], [state], fad, start_year, exit_year,
+                             row_plan=np.zeros(n_sc, dtype=np.int64), pref_shift=bps / 10_000.0)
+    rates, status = waterfall_irrs(run, [state])
+
+    n_p = len(props)
+    partners = pd.DataFrame({
+        "scenario": np.repeat(np.arange(n_sc), n_p),
+        "PropCode": np.tile(props, n_sc),
+        "distributions": run.tiers.sum(axis=(2, 3)).ravel(),
+        "XIRR": rates.ravel(),
+        "status": status.ravel(),
+    })
+    return ScenarioResult(state.vcode, sc, annual, partners)
+
+
+def _percentile_table(df: pd.DataFrame, keys: List[str], percentiles: Sequence[float]) -> pd.DataFrame:
+    g = df.groupby(keys, sort=False)["value"]
+    q = g.quantile([p / 100.0 for p in percentiles]).unstack()
+    q.columns = [f"P{p:g}" for p in percentiles]
+    return pd.concat([g.count().rename("n"), g.mean().rename("mean"), q], axis=1).reset_index()
+
+
+def scenario_summary(result: ScenarioResult, percentiles: Sequence[float] = SCENARIO_PERCENTILES) -> pd.DataFrame:
+    """
+    Percentiles across scenarios of total FAD and minimum DSCR over the hold,
+    and of each partner's XIRR (unsolved XIRRs are left out; n counts the rest).
+    """
+    hold = result.annual.groupby("scenario")
+    parts = [
+        pd.DataFrame({"metric": "Total FAD", "value": hold["Funds Available for Distribution"].sum()}),
+        pd.DataFrame({"metric": "Minimum DSCR", "value": hold["Debt Service Coverage Ratio"].min()}),
+        pd.DataFrame({"metric": "XIRR " + result.partners["PropCode"].astype(str),
+                      "value": result.partners["XIRR"].to_numpy()}),
+    ]
+    out = _percentile_table(pd.concat(parts, ignore_index=True), ["metric"], percentiles)
+    out.insert(0, "vcode", result.vcode)
+    return out
+
+
+def scenario_annual_summary(result: ScenarioResult,
+                            percentiles: Sequence[float] = SCENARIO_PERCENTILES) -> pd.DataFrame:
+    """Percentiles across scenarios of FAD and DSCR for each held Year."""
+    long = result.annual.melt(
+        id_vars=["Year"],
+        value_vars=["Funds Available for Distribution", "Debt Service Coverage Ratio"],
+        var_name="metric",
+    )
+    out = _percentile_table(long, ["metric", "Year"], percentiles)
+    out.insert(0, "vcode", result.vcode)
+    return out
+
+
+def run_portfolio_scenarios(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]],
+                            scenarios: pd.DataFrame, start_year: int, horizon_years: int,
+                            percentiles: Sequence[float] = SCENARIO_PERCENTILES,
+                            store: Optional[DealStateStore] = None
+                            ) -> Tuple[pd.DataFrame, pd.DataFrame, List[str]]:
+    """
+    The same scenarios for every deal in frames (as for run_deals, including store).
+
+    Returns (summary, annual, skipped): scenario_summary and
+    scenario_annual_summary rows for all deals, and deals without waterfall steps.
+    """
+    states, plans, skipped = replay_deals(frames, store)
+    fc_by_deal = {str(v): f[2] for v, f in frames.items()}
+    summaries: List[pd.DataFrame] = []
+    annuals: List[pd.DataFrame] = []
+    for state in states:
+        res = run_scenarios(state, plans[state.vcode], fc_by_deal[state.vcode], scenarios, start_year, horizon_years)
+        summaries.append(scenario_summary(res, percentiles))
+        annuals.append(scenario_annual_summary(res, percentiles))
+
+    if not summaries:
+        return pd.DataFrame(), pd.DataFrame(), skipped
+    return pd.concat(summaries, ignore_index=True), pd.concat(annuals, ignore_index=True), skipped
+
+
+# ============================================================
+# GOAL SEEK (terminal flow or FAD multiple for a target partner IRR)
+# ============================================================
+# Each partner's forecast XIRR flows -- accounting history plus year-end
+# waterfall distributions (partner_series) -- are valued at its target rate r:
+# the target is met where NPV_r = sum a * (1 + r)^-t = 0.
+#   terminal  -> an extra flow X at the last year-end of the horizon. NPV_r is
+#                linear in X, so X = -NPV_r * (1 + r)^t_exit for all partners at once.
+#   fad_scale -> a multiple s of the deal's FAD (every year, through the
+#                waterfall). All partners are solved in lockstep: a scan of
+#                GOAL_SCALE_GRID for the first sign change of NPV_r(s), then
+#                Illinois false position, one execute_waterfalls call per step
+#                over every partner still open.
+GOAL_TERMINAL = "terminal"
+GOAL_FAD_SCALE = "fad_scale"
+GOAL_MODES = (GOAL_TERMINAL, GOAL_FAD_SCALE)
+
+GOAL_OK = "ok"
+GOAL_MET_AT_ZERO = "met_at_zero"              # fad_scale: history alone meets the target, no FAD needed
+GOAL_NO_POSITIVE_FAD = "no_positive_fad"      # fad_scale: the deal's FAD is never positive, no multiple helps
+GOAL_UNREACHABLE = "unreachable"              # fad_scale: not met at the largest multiple scanned
+GOAL_NO_CONTRIBUTIONS = "no_contributions"    # no outflow in the partner's history: IRR undefined
+
+GOAL_SEEK_COLUMNS = ["vcode", "PropCode", "mode", "target_irr", "forecast_XIRR", "value", "XIRR_at_value", "status"]
+
+GOAL_SCALE_GRID = np.concatenate([[0.0], np.geomspace(0.01, 1000.0, 51)])
+GOAL_TOL = 1e-10
+GOAL_MAX_ITER = 100
+
+
+def _goal_targets(targets, vcodes: np.ndarray, props: np.ndarray) -> np.ndarray:
+    # One rate for everyone, or a (vcode, PropCode, target_irr) frame; NaN = not asked
+    if isinstance(targets, pd.DataFrame):
+        lookup = {(str(v), str(p)): float(t)
+                  for v, p, t in zip(targets["vcode"], targets["PropCode"], targets["target_irr"])}
+        out = np.array([lookup.get((v, p), np.nan) for v, p in zip(vcodes, props)], dtype=float)
+    else:
+        out = np.full(len(vcodes), float(targets))
+    if (out[np.isfinite(out)] <= XIRR_MIN_RATE).any():
+        raise ValueError(f"Target IRRs must be above {XIRR_MIN_RATE:.2%}")
+    return out
+
+
+def _solve_fad_scale(npv_at: Callable[[np.ndarray, np.ndarray], np.ndarray], n: int
+                     ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Smallest FAD multiple with npv_at(rows, scales) >= 0 for each of n rows
+    (scan, then Illinois on the bracket). Returns (scale, status).
+    """
+    scale = np.full(n, np.nan)
+    status = np.full(n, GOAL_UNREACHABLE, dtype=object)
+    lo, hi = np.zeros(n), np.zeros(n)
+    f_lo, f_hi = np.zeros(n), np.zeros(n)
+
+    # ---- bracket: first grid multiple where the target is met
+    act = np.arange(n)
+    prev = np.zeros(n)
+    for k, g in enumerate(GOAL_SCALE_GRID):
+        if act.size == 0:
+            break
+        f = npv_at(act, np.full(act.size, g))
+        met = f >= 0
+        if k == 0:
+            scale[act[met]] = 0.0
+            status[act[met]] = GOAL_MET_AT_ZERO
+        else:
+            hit = act[met]
+            lo[hit], hi[hit], f_lo[hit], f_hi[hit] = GOAL_SCALE_GRID[k - 1], g, prev[hit], f[met]
+            status[hit] = GOAL_OK
+        prev[act] = f
+        act = act[~met]
+
+    # ---- Illinois false position on every bracket in lockstep
+    act = np.flatnonzero(status == GOAL_OK)
+    side = np.zeros(n, dtype=np.int8)
+    with np.errstate(all="ignore"):
+        for _ in range(GOAL_MAX_ITER):
+            if act.size == 0:
+                break
+            x = hi[act] - f_hi[act] * (hi[act] - lo[act]) / (f_hi[act] - f_lo[act])
+            x = np.where(np.isfinite(x) & (x > lo[act]) & (x < hi[act]), x, 0.5 * (lo[act] + hi[act]))
+            f = npv_at(act, x)
+            scale[act] = x
+
+            below = f < 0
+            a = act[below]
+            lo[a], f_lo[a] = x[below], f[below]
+            f_hi[a[side[a] == -1]] *= 0.5
+            side[a] = -1
+            b = act[~below]
+            hi[b], f_hi[b] = x[~below], f[~below]
+            f_lo[b[side[b] == 1]] *= 0.5
+            side[b] = 1
+
+            done = (f == 0) | (hi[act] - lo[act] <= GOAL_TOL * np.maximum(1.0, np.abs(x)))
+            act = act[~done]
+    return scale, status
+
+
+def goal_seek(states: Sequence[DealState], plans: Sequence[WaterfallPlan], annual: pd.DataFrame,
+              start_year: int, horizon_years: int, targets, mode: str = GOAL_TERMINAL,
+              day_count: str = DEFAULT_DAY_COUNT) -> pd.DataFrame:
+    """
+    Solve every partner for its target IRR on top of the run_waterfalls base
+    case (same inputs; exit at the end of the horizon).
+
+    targets: one IRR for all partners (0.15 = 15%), or a frame with vcode,
+             PropCode, target_irr (partners not listed are left out).
+    mode:    GOAL_TERMINAL  -> value is the extra distribution the partner needs
+                               at the last year-end (negative: it could take less)
+             GOAL_FAD_SCALE -> value is the multiple of the deal's FAD at which
+                               the partner's waterfall distributions meet the target
+
+    Returns one row per partner (GOAL_SEEK_COLUMNS): forecast_XIRR is the
+    base-case XIRR, XIRR_at_value re-solves it with the solution applied (it
+    can land on another root where the solved flows change sign more than once).
+    """
+    if mode not in GOAL_MODES:
+        raise ValueError(f"Unknown goal-seek mode {mode!r} (expected one of {', '.join(GOAL_MODES)})")
+    if not states:
+        return pd.DataFrame(columns=GOAL_SEEK_COLUMNS)
+
+    years = np.arange(int(start_year), int(start_year) + int(horizon_years))
+    n_yr = len(years)
+    vcodes = [s.vcode for s in states]
+    fad = fad_matrix(annual, vcodes, years)
+    exit_year = np.full(len(states), years[-1])
+
+    base = execute_waterfalls(plans, states, fad, int(start_year), exit_year)
+    times, packed, r_idx, p_idx, series = partner_series(base, states, day_count)
+    deal_vcode = np.asarray(vcodes, dtype=object)[r_idx]
+    prop = np.array([plans[r].codes[p] for r, p in zip(r_idx, p_idx)], dtype=object)
+
+    rate = _goal_targets(targets, deal_vcode, prop)
+    keep = np.isfinite(rate)
+    r_idx, p_idx, series, deal_vcode, prop, rate = (a[keep] for a in (r_idx, p_idx, series, deal_vcode, prop, rate))
+    t, hist = times[series], packed[series]   # hist: zeros in the n_yr leading distribution slots
+
+    flows = hist.copy()
+    flows[:, :n_yr] = base.tiers[r_idx, p_idx].sum(axis=2)
+    forecast = solve_xirr(t, flows)
+
+    if mode == GOAL_TERMINAL:
+        with np.errstate(all="ignore"):
+            value = -_npv(rate, t, flows) * np.exp(t[:, n_yr - 1] * np.log1p(rate))
+        status = np.full(len(rate), GOAL_OK, dtype=object)
+        flows[:, n_yr - 1] += value
+    else:
+        def distributions(rows: np.ndarray, scale: np.ndarray) -> np.ndarray:
+            plan_of = r_idx[rows]
+            run = execute_waterfalls(plans, states, fad[plan_of] * scale[:, None], int(start_year),
+                                     exit_year[plan_of], row_plan=plan_of)
+            return run.tiers[np.arange(len(rows)), p_idx[rows]].sum(axis=2)
+
+        def npv_at(rows: np.ndarray, scale: np.ndarray) -> np.ndarray:
+            amt = hist[rows].copy()
+            amt[:, :n_yr] = distributions(rows, scale)
+            return _npv(rate[rows], t[rows], amt)
+
+        value, status = _solve_fad_scale(npv_at, len(rate))
+        status[(status == GOAL_UNREACHABLE) & ~(fad[r_idx] > 0).any(axis=1)] = GOAL_NO_POSITIVE_FAD
+        solved = np.flatnonzero(np.isfinite(value))
+        if solved.size:
+            flows[solved, :n_yr] = distributions(solved, value[solved])
+
+    no_outflow = ~(hist < 0).any(axis=1)
+    value[no_outflow] = np.nan
+    status[no_outflow] = GOAL_NO_CONTRIBUTIONS
+    at_value = solve_xirr(t, flows).rates
+    at_value[~np.isfinite(value)] = np.nan
+
+    return pd.DataFrame({
+        "vcode": deal_vcode,
+        "PropCode": prop,
+        "mode": mode,
+        "target_irr": rate,
+        "forecast_XIRR": forecast.rates,
+        "value": value,
+        "XIRR_at_value": at_value,
+        "status": status,
+    })
+
+
+def run_goal_seek(frames: Dict[str, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]], targets,
+                  start_year: int, horizon_years: int, mode: str = GOAL_TERMINAL,
+                  store: Optional[DealStateStore] = None) -> Tuple[pd.DataFrame, List[str]]:
+    """goal_seek for every deal in frames (as for run_deals, including store). Returns (results, skipped)."""
+    states, plans, skipped = replay_deals(frames, store)
+    annual = portfolio_annual_aggregation(pd.concat([f for _, _, f in frames.values()], ignore_index=True),
+                                          start_year, horizon_years, vcodes=list(frames))
+    results = goal_seek(states, [plans[s.vcode] for s in states], annual, start_year, horizon_years, targets, mode)
+    return results, skipped